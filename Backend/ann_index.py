@@ -0,0 +1,274 @@
+import pickle
+import time
+
+import numpy as np
+
+ANN_BACKENDS = ("ivf", "hnsw")
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(sims, k):
+    k = min(k, len(sims))
+    if k < len(sims):
+        idx = np.argpartition(-sims, k - 1)[:k]
+    else:
+        idx = np.arange(len(sims))
+    return idx[np.argsort(-sims[idx], kind="stable")]
+
+
+def _nearest_centroid(vectors, centroids, chunk_size=16384):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        assignments[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=10, sample_size=None, seed=0):
+    """K-means on the unit sphere (cosine), trained on a random sample of rows"""
+    rng = np.random.default_rng(seed)
+    vectors = _normalize(vectors)
+    if sample_size is not None and len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+    n_clusters = max(1, min(n_clusters, len(vectors)))
+
+    centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists with random rows so no list stays unused
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFSearcher:
+    """
+    Inverted-file index: embedding dibagi ke `n_lists` cluster (spherical
+    k-means) dan pencarian hanya memindai `nprobe` cluster terdekat.
+    Naikkan `nprobe` untuk recall lebih tinggi, turunkan untuk latency.
+
+    Searcher tidak menyimpan salinan embedding; search() menerima matriks
+    embedding milik EmbeddingIndex.
+    """
+
+    backend = "ivf"
+
+    def __init__(self, centroids, assignments, nprobe=8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.nprobe = int(nprobe)
+        self.order = np.argsort(self.assignments, kind="stable").astype(np.int64)
+        self.offsets = np.searchsorted(self.assignments[self.order], np.arange(len(self.centroids) + 1))
+
+    @classmethod
+    def train(cls, vectors, n_lists=None, nprobe=8, iterations=10, sample_size=None, seed=0):
+        """`n_lists` defaults to sqrt(N); k-means is trained on at most 64 rows per list"""
+        vectors = _normalize(vectors)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+        n_lists = max(1, min(int(n_lists), len(vectors)))
+        if sample_size is None:
+            sample_size = 64 * n_lists
+        centroids = spherical_kmeans(vectors, n_lists, iterations, sample_size, seed)
+        return cls(centroids, _nearest_centroid(vectors, centroids), nprobe)
+
+    @property
+    def params(self):
+        return {"n_lists": len(self.centroids), "nprobe": self.nprobe}
+
+    def with_params(self, nprobe=None):
+        searcher = IVFSearcher.__new__(IVFSearcher)
+        searcher.__dict__.update(self.__dict__)
+        if nprobe is not None:
+            searcher.nprobe = int(nprobe)
+        return searcher
+
+    def search(self, vectors, query_unit, k):
+        """Return (row indices, cosine similarities) of the approximate top-k"""
+        probe = _top_k(self.centroids @ query_unit, self.nprobe)
+        rows = np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in probe])
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        sims = vectors[rows] @ query_unit
+        best = _top_k(sims, k)
+        return rows[best], sims[best]
+
+    def with_rows(self, keep, new_vectors):
+        """Searcher for the rows selected by the boolean mask `keep` followed by `new_vectors`"""
+        assignments = np.concatenate([
+            self.assignments[keep],
+            _nearest_centroid(_normalize(new_vectors), self.centroids),
+        ])
+        return IVFSearcher(self.centroids, assignments, self.nprobe)
+
+    def arrays(self):
+        return {"centroids": self.centroids, "assignments": self.assignments}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        return cls(arrays["centroids"], arrays["assignments"], params.get("nprobe", 8))
+
+
+class HNSWSearcher:
+    """
+    HNSW graph lewat dependency opsional `hnswlib`. `ef` mengatur trade-off
+    recall/latency saat search; `m` dan `ef_construction` saat build.
+    Graph tidak disimpan di snapshot dan dibangun saat load.
+
+    Graph tidak pernah diubah setelah dibangun, jadi aman dipakai bersama
+    oleh query yang berjalan paralel dan oleh searcher hasil with_params()
+    dengan `ef` yang sama (`ef` berbeda = salinan graph sendiri).
+    Perubahan index (enroll/delta) lewat with_rows() tidak menyentuh graph:
+    baris yang dihapus hanya dipetakan ke -1 dan dilewati saat search, dan
+    baris baru dicari secara exact di samping graph. Biayanya O(jumlah
+    baris) operasi array per delta, plus search exact atas baris baru yang
+    tumbuh sampai compaction membangun graph baru.
+    """
+
+    backend = "hnsw"
+
+    def __init__(self, vectors, m=16, ef_construction=200, ef=64, num_threads=-1):
+        import hnswlib
+
+        vectors = _normalize(vectors)
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.num_threads = num_threads
+        self._graph = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        self._graph.init_index(max_elements=max(len(vectors), 1), M=m, ef_construction=ef_construction)
+        if len(vectors):
+            self._graph.add_items(vectors, np.arange(len(vectors)), num_threads=num_threads)
+        self._graph.set_ef(ef)
+        # Graph label of every row (-1 for rows added after the build), and the
+        # row of every graph label (-1 once that row was dropped)
+        self._row_ids = np.arange(len(vectors), dtype=np.int64)
+        self._id_rows = np.arange(len(vectors), dtype=np.int64)
+        self._extra_rows = np.zeros(0, dtype=np.int64)
+        self._n_dropped = 0
+
+    @classmethod
+    def train(cls, vectors, m=16, ef_construction=200, ef=64, **kwargs):
+        return cls(vectors, m=m, ef_construction=ef_construction, ef=ef)
+
+    @property
+    def params(self):
+        return {"m": self.m, "ef_construction": self.ef_construction, "ef": self.ef}
+
+    def _copy(self):
+        searcher = HNSWSearcher.__new__(HNSWSearcher)
+        searcher.__dict__.update(self.__dict__)
+        return searcher
+
+    def with_params(self, ef=None):
+        searcher = self._copy()
+        if ef is not None and int(ef) != self.ef:
+            # ef lives in the graph; give this searcher its own copy instead of
+            # changing the graph that concurrent queries of `self` are using
+            searcher.ef = int(ef)
+            searcher._graph = pickle.loads(pickle.dumps(self._graph))
+            searcher._graph.set_ef(searcher.ef)
+        return searcher
+
+    def search(self, vectors, query_unit, k):
+        k = min(k, len(self._row_ids))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = self._extra_rows
+        n_graph = len(self._id_rows)
+        if n_graph > self._n_dropped:
+            # Over-fetch by the dropped rows so k live ones remain; hnswlib searches with max(ef, k)
+            ids, _ = self._graph.knn_query(query_unit[None, :], k=min(k + self._n_dropped, n_graph))
+            found = self._id_rows[ids[0].astype(np.int64)]
+            rows = np.concatenate([found[found >= 0], rows])
+        sims = vectors[rows] @ query_unit
+        best = _top_k(sims, k)
+        return rows[best], sims[best]
+
+    def with_rows(self, keep, new_vectors):
+        """
+        Searcher for the rows selected by the boolean mask `keep` followed by
+        `new_vectors`, sharing this searcher's graph (see the class docstring)
+        """
+        searcher = self._copy()
+        searcher._row_ids = np.concatenate([self._row_ids[keep], np.full(len(new_vectors), -1, dtype=np.int64)])
+        in_graph = np.flatnonzero(searcher._row_ids >= 0)
+        searcher._id_rows = np.full(len(self._id_rows), -1, dtype=np.int64)
+        searcher._id_rows[searcher._row_ids[in_graph]] = in_graph
+        searcher._extra_rows = np.flatnonzero(searcher._row_ids < 0)
+        searcher._n_dropped = len(self._id_rows) - len(in_graph)
+        return searcher
+
+    def arrays(self):
+        return None
+
+
+def train_searcher(backend, vectors, **params):
+    if backend == "ivf":
+        return IVFSearcher.train(vectors, **params)
+    if backend == "hnsw":
+        return HNSWSearcher.train(vectors, **params)
+    raise ValueError(f"Unknown ANN backend '{backend}', expected one of {ANN_BACKENDS}")
+
+
+def recall_report(index, queries, settings, k=None):
+    """
+    Bandingkan search ANN dengan exact search untuk beberapa setting.
+
+    `settings` adalah list dict parameter untuk searcher.with_params(), misal
+    [{"nprobe": 4}, {"nprobe": 8}]. Untuk tiap setting dilaporkan recall@k
+    terhadap exact top-k, seberapa sering hasil match() (label + keputusan
+    verifikasi) sama dengan exact, dan latency per query.
+    """
+    if index.searcher is None:
+        raise ValueError("Index has no ANN searcher")
+    k = k or index.k
+    exact_index = index.with_searcher(None)
+
+    exact_ids = []
+    exact_matches = []
+    exact_ms = []
+    for query in queries:
+        started = time.perf_counter()
+        exact_matches.append(exact_index.match(query))
+        exact_ms.append((time.perf_counter() - started) * 1000)
+        exact_ids.append(set(exact_index.search(query, k)[0].tolist()))
+
+    report = {
+        "num_embeddings": len(index),
+        "num_classes": index.num_classes,
+        "k": k,
+        "queries": len(queries),
+        "exact": {"mean_ms": float(np.mean(exact_ms)), "p99_ms": float(np.percentile(exact_ms, 99))},
+        "settings": [],
+    }
+    for params in settings:
+        approx_index = index.with_searcher(index.searcher.with_params(**params))
+        recalls = []
+        agreements = 0
+        latencies = []
+        for query, truth, expected in zip(queries, exact_ids, exact_matches):
+            started = time.perf_counter()
+            result = approx_index.match(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found = set(approx_index.search(query, k)[0].tolist())
+            recalls.append(len(found & truth) / max(len(truth), 1))
+            agreements += (result.get("match") == expected.get("match")
+                           and result.get("predicted_label") == expected.get("predicted_label"))
+        report["settings"].append({
+            "params": dict(approx_index.searcher.params),
+            "recall_at_k": float(np.mean(recalls)),
+            "decision_agreement": agreements / max(len(queries), 1),
+            "mean_ms": float(np.mean(latencies)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+        })
+    return report
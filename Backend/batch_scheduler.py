@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class MicroBatcher:
+    """
+    Kumpulkan request yang datang bersamaan lalu proses sebagai satu batch.
+
+    Item pertama yang masuk membuka sebuah batch; batch ditutup ketika sudah
+    berisi `max_batch_size` item atau setelah `max_wait_ms` berlalu sejak item
+    pertama, mana yang lebih dulu. `process_batch` menerima list item dan harus
+    mengembalikan list hasil dengan urutan yang sama (sebuah Exception di list
+    hasil diteruskan ke caller item tersebut).
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=10, max_queue_size=256, name="batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "rejected": 0,
+            "cancelled": 0,
+            "batches": 0,
+            "errors": 0,
+            "batch_size_sum": 0,
+            "batch_size_max": 0,
+            "batch_size_histogram": {},
+            "wait_ms_sum": 0.0,
+            "wait_ms_max": 0.0,
+            "process_ms_sum": 0.0,
+        }
+
+    def submit(self, item):
+        """Queue an item and return a Future for its result"""
+        self._ensure_worker()
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected"] += 1
+            raise QueueFullError(f"{self.name} queue is full")
+        with self._stats_lock:
+            self._stats["requests"] += 1
+        return future
+
+    def _ensure_worker(self):
+        # A forked worker inherits the thread object but not the running thread
+        if self._worker is None or self._worker_pid != os.getpid():
+            with self._start_lock:
+                if self._worker is None or self._worker_pid != os.getpid():
+                    self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._worker_pid = os.getpid()
+                    self._worker.start()
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Callers that gave up (timeout) cancel their future; skip those items
+            collected = self._collect()
+            batch = [entry for entry in collected if entry[1].set_running_or_notify_cancel()]
+            if len(batch) < len(collected):
+                with self._stats_lock:
+                    self._stats["cancelled"] += len(collected) - len(batch)
+            if not batch:
+                continue
+            started = time.monotonic()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                results = [e] * len(batch)
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+            finished = time.monotonic()
+
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            self._record(batch, started, finished)
+
+    def _record(self, batch, started, finished):
+        size = len(batch)
+        max_wait_ms = max((started - enqueued) * 1000.0 for _, _, enqueued in batch)
+        with self._stats_lock:
+            stats = self._stats
+            stats["batches"] += 1
+            stats["batch_size_sum"] += size
+            stats["batch_size_max"] = max(stats["batch_size_max"], size)
+            stats["batch_size_histogram"][size] = stats["batch_size_histogram"].get(size, 0) + 1
+            stats["wait_ms_sum"] += sum((started - enqueued) * 1000.0 for _, _, enqueued in batch)
+            stats["wait_ms_max"] = max(stats["wait_ms_max"], max_wait_ms)
+            stats["process_ms_sum"] += (finished - started) * 1000.0
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["batch_size_histogram"] = dict(stats["batch_size_histogram"])
+        batches = max(stats["batches"], 1)
+        processed = max(stats["batch_size_sum"], 1)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "requests": stats["requests"],
+            "rejected": stats["rejected"],
+            "cancelled": stats["cancelled"],
+            "batches": stats["batches"],
+            "errors": stats["errors"],
+            "avg_batch_size": stats["batch_size_sum"] / batches,
+            "largest_batch": stats["batch_size_max"],
+            "batch_size_histogram": stats["batch_size_histogram"],
+            "avg_wait_ms": stats["wait_ms_sum"] / processed,
+            "max_observed_wait_ms": stats["wait_ms_max"],
+            "avg_batch_process_ms": stats["process_ms_sum"] / batches,
+        }
@@ -0,0 +1,517 @@
+"""
+Benchmark untuk hot path recognition, registrasi dan training.
+
+Semua benchmark berjalan terhadap LocalBlobStore di direktori sementara
+(FACE_API_BLOB_STORE_DIR) dan Flask test client, jadi tidak menyentuh bucket
+Firebase. Hasil ditulis sebagai JSON supaya bisa dibandingkan antar commit.
+
+Usage:
+    python benchmark.py [--suites index,ann,storage,training,stages,preprocess,throughput,register]
+                        [--students 10,100,1000,10000] [--output results.json]
+                        [--baseline previous.json]
+
+Dengan --url, suite throughput mengirim request HTTP ke server yang sedang
+berjalan (misalnya `python serve.py --workers N`) sehingga skalabilitas
+multi-proses bisa diukur:
+    python benchmark.py --suites throughput --url http://127.0.0.1:8000
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.join(BASE_DIR, "dataset")
+
+SUITES = ("index", "ann", "storage", "training", "stages", "preprocess", "throughput", "register")
+# Embedding storages compared against float32 by the storage suite
+STORAGE_SETTINGS = {
+    "float16": ("float16", {}),
+    "pq16": ("pq", {"n_subspaces": 16}),
+    "pq32": ("pq", {"n_subspaces": 32}),
+}
+DEFAULT_STUDENT_COUNTS = (10, 100, 1000, 10000)
+EMBEDDING_DIM = 128
+EMBEDDINGS_PER_STUDENT = 20
+
+
+def summarize(samples_ms):
+    """Latency summary in milliseconds"""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if samples.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(samples.size),
+        "mean_ms": round(float(samples.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p90_ms": round(float(np.percentile(samples, 90)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "max_ms": round(float(samples.max()), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def dataset_images(limit=None):
+    """(nim, filename, raw bytes) for the images in Backend/dataset"""
+    images = []
+    for nim in sorted(os.listdir(DATASET_DIR)):
+        student_dir = os.path.join(DATASET_DIR, nim)
+        if not os.path.isdir(student_dir):
+            continue
+        for filename in sorted(os.listdir(student_dir)):
+            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                with open(os.path.join(student_dir, filename), "rb") as f:
+                    images.append((nim, filename, f.read()))
+    return images[:limit] if limit else images
+
+
+def synthetic_store(n_students, per_student=EMBEDDINGS_PER_STUDENT, dim=EMBEDDING_DIM, spread=0.35, seed=0):
+    """
+    Synthetic EmbeddingStore with `n_students` clustered classes: every
+    student is a random direction plus Gaussian noise, roughly like FaceNet
+    embeddings of the same face under different poses.
+    """
+    from embedding_store import EmbeddingStore
+
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_students, dim))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.normal(scale=spread / np.sqrt(dim), size=(n_students, per_student, dim))
+    embeddings = (centers[:, None, :] + noise).astype(np.float32)
+
+    labels = np.array([f"S{i:08d}" for i in range(n_students)], dtype="<U32")
+    offsets = np.arange(0, (n_students + 1) * per_student, per_student, dtype=np.int64)
+    return EmbeddingStore(
+        labels=labels,
+        offsets=offsets,
+        embeddings=embeddings.reshape(-1, dim),
+        centroids=embeddings.mean(axis=1),
+        thresholds=np.full(n_students, 0.85),
+    )
+
+
+def synthetic_queries(store, n_queries, seed=1):
+    """Noisy copies of stored embeddings, as if the students came back to recognize"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(store.embeddings), size=n_queries)
+    noise = rng.normal(scale=0.2 / np.sqrt(store.embeddings.shape[1]), size=(n_queries, store.embeddings.shape[1]))
+    return store.embeddings[rows] + noise.astype(np.float32)
+
+
+def load_face_api(blob_root):
+    os.environ["FACE_API_BLOB_STORE_DIR"] = blob_root
+    # The suites replay the same images; keep the retry cache from turning them into cache hits
+    os.environ.setdefault("FACE_API_RECOGNITION_CACHE_MB", "0")
+    import face_api
+
+    return face_api
+
+
+def bench_recognize_stages(face_api, images, repeats=1):
+    """Per-stage latency of the recognize path, one request at a time"""
+    stages = {name: [] for name in ("decode", "downscale", "detect", "crop", "normalize", "embed", "match")}
+    errors = {}
+    bundle = face_api.model_registry.get()
+
+    for _ in range(repeats):
+        for _, _, data in images:
+            img_array, ms = timed(face_api.decode_upload, BytesIO(data))
+            stages["decode"].append(ms)
+            try:
+                result = face_api.face_detector.detect_and_crop(img_array)
+            except Exception as e:
+                errors.setdefault("detect", str(e))
+                continue
+            for stage, stage_ms in result.timings.items():
+                stages[stage].append(stage_ms)
+            if result.face is None:
+                continue
+
+            features, ms = timed(face_api.face_embedder.embed, [result.face])
+            if features[0] is None:
+                errors.setdefault("embed", "embedding failed")
+                continue
+            stages["embed"].append(ms)
+
+            if bundle is not None and len(bundle.index):
+                _, ms = timed(bundle.index.match, features[0])
+                stages["match"].append(ms)
+
+    report = {stage: summarize(samples) for stage, samples in stages.items()}
+    if errors:
+        report["errors"] = errors
+    return report
+
+
+def bench_preprocess(face_api, images, repeats=1):
+    """
+    Parity and latency of the fused FacePreprocessor against normalize_face
+    followed by FacenetEmbedder.preprocess, on the detected dataset crops.
+    With DeepFace available, the batched embeddings of the raw crops are also
+    compared with DeepFace.represent on the normalized crops.
+    """
+    from face_detection import normalize_face
+    from face_embedder import FACENET_INPUT_SIZE, FacenetEmbedder, FacePreprocessor
+
+    crops = []
+    for _, _, data in images:
+        face = face_api.detect_and_crop_face(face_api.decode_upload(BytesIO(data)))
+        if face is not None:
+            crops.append(face)
+    if not crops:
+        return {"faces": 0}
+
+    legacy = FacenetEmbedder()
+    preprocessor = FacePreprocessor()
+
+    def legacy_batch():
+        return np.stack([legacy.preprocess(normalize_face(face)) for face in crops])
+
+    def fused_batch():
+        batch = preprocessor.batch(len(crops), FACENET_INPUT_SIZE)
+        for row, face in zip(batch, crops):
+            preprocessor.preprocess_into(face, row)
+        return batch
+
+    samples = {"legacy": [], "fused": []}
+    for _ in range(repeats):
+        expected, ms = timed(legacy_batch)
+        samples["legacy"].append(ms / len(crops))
+        actual, ms = timed(fused_batch)
+        samples["fused"].append(ms / len(crops))
+    report = {
+        "faces": len(crops),
+        "max_abs_diff": float(np.max(np.abs(expected - actual))),
+        "legacy_ms_per_face": summarize(samples["legacy"]),
+        "fused_ms_per_face": summarize(samples["fused"]),
+    }
+
+    reference = [face_api.extract_raw_face_embedding(face) for face in crops]
+    candidate = face_api.face_embedder.embed(crops)
+    pairs = [(r, c) for r, c in zip(reference, candidate) if r is not None and c is not None]
+    if pairs:
+        ref, cand = (np.array(side, dtype=np.float64) for side in zip(*pairs))
+        cosine = np.sum(ref * cand, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1))
+        report["embedding_cosine"] = {"compared": len(pairs), "mean": float(cosine.mean()),
+                                      "min": float(cosine.min())}
+    return report
+
+
+def post_image(url, data):
+    """POST `data` as the multipart `image` field to a running server; returns the HTTP status"""
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"frame.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(url, data=body, method="POST",
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def bench_throughput(face_api, images, concurrency_levels=(1, 4, 8, 16), requests_per_client=10, url=None):
+    """End-to-end /recognize-face throughput with N concurrent clients (in-process, or against `url`)"""
+    results = {}
+    for concurrency in concurrency_levels:
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+
+        def client(worker_id):
+            test_client = face_api.app.test_client() if url is None else None
+            for i in range(requests_per_client):
+                _, _, data = images[(worker_id * requests_per_client + i) % len(images)]
+                started = time.perf_counter()
+                if url is None:
+                    status = test_client.post("/recognize-face",
+                                              data={"image": (BytesIO(data), "frame.jpg")},
+                                              content_type="multipart/form-data").status_code
+                else:
+                    status = post_image(f"{url.rstrip('/')}/recognize-face", data)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(client, range(concurrency)))
+        wall = time.perf_counter() - started
+
+        results[str(concurrency)] = {
+            "requests": len(latencies),
+            "requests_per_second": round(len(latencies) / wall, 3),
+            "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+            "latency": summarize(latencies),
+        }
+    if url is None:
+        results["batcher"] = face_api.recognition_batcher.stats()
+    return results
+
+
+def bench_register(face_api, images):
+    """Time /register-face for every student in the dataset"""
+    by_student = {}
+    for nim, filename, data in images:
+        by_student.setdefault(nim, []).append((filename, data))
+
+    test_client = face_api.app.test_client()
+    per_image = []
+    runs = []
+    for nim, files in by_student.items():
+        started = time.perf_counter()
+        response = test_client.post("/register-face", data={
+            "nim": f"bench_{nim}",
+            "images": [(BytesIO(data), filename) for filename, data in files],
+        }, content_type="multipart/form-data")
+        elapsed = (time.perf_counter() - started) * 1000
+        per_image.append(elapsed / len(files))
+        runs.append({"nim": nim, "images": len(files), "status": response.status_code, "total_ms": round(elapsed, 3)})
+
+    return {"per_image": summarize(per_image), "runs": runs}
+
+
+def bench_index(student_counts, n_queries=200):
+    """Index build, serialization, cold load and match latency as the class count grows"""
+    from embedding_index import EmbeddingIndex
+    from model_registry import ModelRegistry
+    from blob_store import LocalBlobStore
+
+    results = {}
+    for n_students in student_counts:
+        store = synthetic_store(n_students)
+        X, y = store.training_data()
+        index, build_ms = timed(EmbeddingIndex.build, X, y, store.user_data(), 8)
+        data, serialize_ms = timed(index.to_bytes)
+
+        root = tempfile.mkdtemp(prefix="bench-index-")
+        try:
+            blob_store = LocalBlobStore(os.path.join(root, "bucket"))
+            publisher = ModelRegistry(blob_store)
+            publisher._put_all([("models/embedding_index.pemb", data)])
+            publisher._write_manifest([])
+
+            # Cold load in a fresh registry, like a new worker would do
+            registry = ModelRegistry(blob_store, cache_dir=os.path.join(root, "cache"))
+            os.makedirs(registry.cache_dir)
+            bundle, load_ms = timed(registry.get)
+
+            queries = synthetic_queries(store, n_queries)
+            match_ms = [timed(bundle.index.match, query)[1] for query in queries]
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        results[str(n_students)] = {
+            "embeddings": int(len(X)),
+            "index_bytes": len(data),
+            "build_ms": round(build_ms, 3),
+            "serialize_ms": round(serialize_ms, 3),
+            "cold_load_ms": round(load_ms, 3),
+            "match": summarize(match_ms),
+        }
+    return results
+
+
+def bench_ann(student_counts, n_queries=200, nprobes=(1, 2, 4, 8, 16, 32), efs=(16, 32, 64, 128)):
+    """Recall, decision agreement and latency of the ANN backends against exact search"""
+    from ann_index import recall_report
+    from embedding_index import EmbeddingIndex
+
+    results = {}
+    for n_students in student_counts:
+        store = synthetic_store(n_students)
+        X, y = store.training_data()
+        index = EmbeddingIndex.build(X, y, store.user_data(), 8)
+        queries = synthetic_queries(store, n_queries)
+
+        ivf_index, build_ms = timed(index.with_ann, "ivf")
+        report = {"ivf": recall_report(ivf_index, queries, [{"nprobe": n} for n in nprobes])}
+        report["ivf"]["build_ms"] = round(build_ms, 3)
+        try:
+            hnsw_index, build_ms = timed(index.with_ann, "hnsw")
+            report["hnsw"] = recall_report(hnsw_index, queries, [{"ef": ef} for ef in efs])
+            report["hnsw"]["build_ms"] = round(build_ms, 3)
+        except ImportError as e:
+            report["hnsw"] = {"error": str(e)}
+        results[str(n_students)] = report
+    return results
+
+
+def bench_storage(student_counts):
+    """
+    Accuracy, memory and latency of float16 / product-quantized index rows
+    against float32: on the registered embeddings in Backend/embeddings (or
+    the packed store) and on synthetic stores of growing size
+    """
+    from blob_store import LocalBlobStore
+    from embedding_store import load_store
+    from quantization import storage_report
+
+    results = {}
+    store = load_store(LocalBlobStore(BASE_DIR))
+    if len(store):
+        X, y = store.training_data()
+        results["dataset"] = storage_report(X, y, store.user_data(), 8, STORAGE_SETTINGS)
+    for n_students in student_counts:
+        store = synthetic_store(n_students)
+        X, y = store.training_data()
+        results[str(n_students)] = storage_report(X, y, store.user_data(), 8, STORAGE_SETTINGS, n_splits=4)
+    return results
+
+
+def bench_training(face_api, student_counts):
+    """/train-model wall time on synthetic stores of growing size"""
+    from embedding_store import EMBEDDING_STORE_PATH
+
+    test_client = face_api.app.test_client()
+    results = {}
+    for n_students in student_counts:
+        store = synthetic_store(n_students)
+        face_api.blob_store.put_bytes(EMBEDDING_STORE_PATH, store.to_bytes())
+        response, elapsed = timed(test_client.post, "/train-model", data={"wait": "true"})
+        body = response.get_json(silent=True) or {}
+        results[str(n_students)] = {
+            "embeddings": int(len(store.embeddings)),
+            "status": response.status_code,
+            "wall_ms": round(elapsed, 3),
+            "accuracy": body.get("accuracy"),
+            "error": body.get("details") if response.status_code >= 400 else None,
+        }
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BASE_DIR,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def flatten(results, prefix=""):
+    """{'a': {'b': 1}} -> {'a.b': 1}, numeric leaves only"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Latency metrics (keys ending in _ms) that got more than `tolerance` slower"""
+    current = flatten(results["results"])
+    previous = flatten(baseline["results"])
+    regressions = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if key.endswith("_ms") and old and value > old * (1 + tolerance):
+            regressions[key] = {"baseline": old, "current": value, "ratio": round(value / old, 3)}
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the face API hot paths")
+    parser.add_argument("--suites", default=",".join(SUITES))
+    parser.add_argument("--students", default=",".join(str(n) for n in DEFAULT_STUDENT_COUNTS),
+                        help="Synthetic student counts for the index and training suites")
+    parser.add_argument("--images", type=int, default=None, help="Use at most this many dataset images")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--concurrency", default="1,4,8,16")
+    parser.add_argument("--url", default=None, help="Run the throughput suite against this running server")
+    parser.add_argument("--output", default=None, help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="Previous JSON report to compare latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    suites = [suite for suite in args.suites.split(",") if suite]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites {sorted(unknown)}, expected {SUITES}")
+    student_counts = [int(n) for n in args.students.split(",") if n]
+
+    report = {"environment": environment(), "config": vars(args), "results": {}}
+    images = dataset_images(args.images)
+    blob_root = tempfile.mkdtemp(prefix="bench-bucket-")
+    try:
+        face_api = None
+        in_process = {"stages", "preprocess", "register", "training"} | (set() if args.url else {"throughput"})
+        if set(suites) & in_process:
+            face_api = load_face_api(blob_root)
+            # Keep training logs out of Backend/training_logs; plotting thousands
+            # of classes also dominates the measurement
+            face_api.save_training_logs = lambda *args, **kwargs: None
+            face_api.DATASET_DIR = os.path.join(blob_root, "local_dataset")
+            report["results"]["startup"] = {"warm_up_ms": round(timed(face_api.warm_up)[1], 3)}
+
+        for suite in suites:
+            print(f"[BENCH] Running {suite}", file=sys.stderr)
+            if suite == "stages":
+                result = bench_recognize_stages(face_api, images, args.repeats)
+            elif suite == "preprocess":
+                result = bench_preprocess(face_api, images, args.repeats)
+            elif suite == "throughput":
+                levels = [int(n) for n in args.concurrency.split(",") if n]
+                result = bench_throughput(face_api, images, levels, url=args.url)
+            elif suite == "register":
+                result = bench_register(face_api, images)
+            elif suite == "index":
+                result = bench_index(student_counts)
+            elif suite == "ann":
+                result = bench_ann(student_counts)
+            elif suite == "storage":
+                result = bench_storage(student_counts)
+            else:
+                result = bench_training(face_api, student_counts)
+            report["results"][suite] = result
+    finally:
+        shutil.rmtree(blob_root, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"[BENCH] Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PreconditionFailedError(Exception):
+    pass
+
+
+class BlobStore:
+    """
+    Base class untuk blob store: subclass cukup mengimplementasikan operasi
+    satu objek (get_bytes, put_bytes, exists, delete, generation, list).
+    Operasi bulk dijalankan paralel di thread pool bersama dengan retry
+    untuk error sementara.
+    """
+
+    def __init__(self, max_workers=16, retries=3, retry_backoff=0.5):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def is_not_found(self, exc):
+        return isinstance(exc, FileNotFoundError)
+
+    def is_precondition_failed(self, exc):
+        return isinstance(exc, PreconditionFailedError)
+
+    def _get_executor(self):
+        # A forked worker inherits the executor object but not its threads
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix="blob-io")
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _with_retries(self, fn, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if self.is_not_found(e) or self.is_precondition_failed(e) or attempt == self.retries:
+                    raise
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
+    def _get_or_none(self, path):
+        try:
+            return self._with_retries(self.get_bytes, path)
+        except Exception as e:
+            if self.is_not_found(e):
+                return None
+            raise
+
+    def get_many(self, paths):
+        """Download many blobs concurrently. Returns {path: bytes}, None for missing blobs"""
+        paths = list(paths)
+        results = self._get_executor().map(self._get_or_none, paths)
+        return dict(zip(paths, results))
+
+    def submit_put(self, path, data, content_type="application/octet-stream"):
+        """Upload in the background and return a Future"""
+        return self._get_executor().submit(self._with_retries, self.put_bytes, path, data, content_type)
+
+    def put_many(self, items):
+        """
+        Upload many (path, data[, content_type]) items concurrently.
+        Returns a list aligned with `items`: None on success, the Exception on failure.
+        """
+        futures = [self.submit_put(*item) for item in items]
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+
+class FirebaseBlobStore(BlobStore):
+    """
+    Blob store backed by the Firebase Storage bucket.
+    Pass `bucket_factory` instead of `bucket` to defer creating the bucket
+    (and initializing Firebase) until the first storage call.
+    """
+
+    def __init__(self, bucket=None, bucket_factory=None, **kwargs):
+        super().__init__(**kwargs)
+        if bucket is None and bucket_factory is None:
+            raise ValueError("Either bucket or bucket_factory is required")
+        self._bucket = None
+        self._bucket_factory = bucket_factory
+        self._bucket_lock = threading.Lock()
+        if bucket is not None:
+            self._set_bucket(bucket)
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            with self._bucket_lock:
+                if self._bucket is None:
+                    self._set_bucket(self._bucket_factory())
+        return self._bucket
+
+    def _set_bucket(self, bucket):
+        self._resize_connection_pool(bucket)
+        self._bucket = bucket
+
+    def _resize_connection_pool(self, bucket):
+        # Reuse connections across the worker threads instead of reopening them
+        try:
+            from requests.adapters import HTTPAdapter
+
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+            bucket.client._http.mount("https://", adapter)
+        except Exception as e:
+            print(f"[WARNING] Could not resize storage connection pool: {e}")
+
+    def is_not_found(self, exc):
+        return type(exc).__name__ == "NotFound" or super().is_not_found(exc)
+
+    def is_precondition_failed(self, exc):
+        return type(exc).__name__ == "PreconditionFailed" or super().is_precondition_failed(exc)
+
+    def get_bytes(self, path):
+        return self.bucket.blob(path).download_as_bytes()
+
+    def put_bytes(self, path, data, content_type="application/octet-stream", if_generation_match=None):
+        """`if_generation_match`: only write if the blob is at this generation (0 = must not exist)"""
+        kwargs = {}
+        if if_generation_match is not None:
+            kwargs["if_generation_match"] = if_generation_match
+        self.bucket.blob(path).upload_from_string(data, content_type=content_type, **kwargs)
+
+    def exists(self, path):
+        return self.bucket.blob(path).exists()
+
+    def delete(self, path):
+        self.bucket.blob(path).delete()
+
+    def generation(self, path):
+        """Return the object generation, or None if the blob does not exist"""
+        blob = self.bucket.get_blob(path)
+        return None if blob is None else blob.generation
+
+    def list(self, prefix=""):
+        return [blob.name for blob in self.bucket.list_blobs(prefix=prefix)]
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blob store yang menyimpan objek di direktori lokal dengan layout yang sama
+    seperti bucket Firebase. Dipakai untuk testing dan benchmark tanpa Firebase.
+    """
+
+    def __init__(self, root, **kwargs):
+        super().__init__(**kwargs)
+        self.root = os.path.abspath(root)
+        self._write_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _full_path(self, path):
+        return os.path.join(self.root, *path.split("/"))
+
+    def get_bytes(self, path):
+        with open(self._full_path(path), "rb") as f:
+            return f.read()
+
+    def put_bytes(self, path, data, content_type="application/octet-stream", if_generation_match=None):
+        full_path = self._full_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # Write to a temp file first so readers never see a half-written blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # Generation check is only atomic within this process
+        with self._write_lock:
+            if if_generation_match is not None and (self.generation(path) or 0) != if_generation_match:
+                os.remove(tmp_path)
+                raise PreconditionFailedError(f"{path} changed (expected generation {if_generation_match})")
+            os.replace(tmp_path, full_path)
+
+    def exists(self, path):
+        return os.path.isfile(self._full_path(path))
+
+    def delete(self, path):
+        try:
+            os.remove(self._full_path(path))
+        except FileNotFoundError:
+            pass
+
+    def generation(self, path):
+        try:
+            return os.stat(self._full_path(path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def list(self, prefix=""):
+        names = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(".tmp-"):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                name = rel.replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
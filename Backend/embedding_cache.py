@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+
+THUMBNAIL_SIZE = (32, 32)
+
+# hash: dHash of the frame, used to find candidates; thumbnail: small grayscale
+# copy used to confirm that a candidate really is the same frame
+FrameKey = namedtuple("FrameKey", ["hash", "thumbnail"])
+
+
+def _gray(img_array):
+    img = np.asarray(img_array)
+    if img.ndim == 3:
+        if img.shape[2] == 4:
+            return cv2.cvtColor(img, cv2.COLOR_RGBA2GRAY)
+        return cv2.cvtColor(np.ascontiguousarray(img[:, :, :3]), cv2.COLOR_RGB2GRAY)
+    return np.ascontiguousarray(img)
+
+
+def dhash(img_array, hash_size=16):
+    """
+    Difference hash: the image is shrunk to (hash_size + 1) x hash_size
+    grayscale and each bit says whether a pixel is brighter than its right
+    neighbour. Re-encoded copies of a frame land close in Hamming distance,
+    but flat regions flip bits easily under camera noise, so it is only a
+    coarse filter. Returns the hash as an int of hash_size**2 bits.
+    """
+    small = cv2.resize(_gray(img_array), (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _nbytes(value):
+    if value is None:
+        return 0
+    return np.asarray(value).nbytes
+
+
+def _frozen(value):
+    if value is None:
+        return None
+    value = np.array(value, copy=True)
+    # Cached arrays are shared between requests; make accidental in-place edits fail loudly
+    value.setflags(write=False)
+    return value
+
+
+class EmbeddingCache:
+    """
+    LRU/TTL cache (crop wajah + embedding) per frame, dengan key perceptual
+    hash (dHash) dari frame input. Dipakai untuk menyerap retry: mahasiswa
+    yang menekan tombol absen berkali-kali mengirim frame yang hampir sama,
+    jadi MTCNN dan FaceNet tidak perlu dijalankan ulang.
+
+    Kandidat dicari lewat jarak Hamming hash (<= `max_distance` bit), lalu
+    dikonfirmasi dengan selisih rata-rata piksel thumbnail grayscale
+    (<= `max_pixel_diff`). dHash saja tidak cukup: orang lain di depan
+    kamera yang sama bisa berbeda hanya beberapa bit, sedangkan noise
+    kamera/JPEG pada frame yang sama juga menggeser belasan bit. Ukuran
+    cache dibatasi `max_bytes` (crop + embedding + thumbnail).
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=15.0, max_distance=24, max_pixel_diff=1.0, hash_size=16):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_pixel_diff = max_pixel_diff
+        self.hash_size = hash_size
+        # hash -> (thumbnail, face_img, embedding, nbytes, stored_at), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, img_array):
+        gray = _gray(img_array)
+        thumbnail = cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+        return FrameKey(dhash(gray, self.hash_size), thumbnail)
+
+    def _expire(self, now):
+        # Caller must hold self._lock; entries are in LRU order, not insertion order,
+        # so every entry is checked
+        expired = [key for key, entry in self._entries.items() if now - entry[4] > self.ttl]
+        for key in expired:
+            self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes_used -= entry[3]
+
+    def _find(self, key):
+        # Caller must hold self._lock
+        best, best_diff = None, self.max_pixel_diff
+        for candidate, entry in self._entries.items():
+            if (candidate ^ key.hash).bit_count() > self.max_distance:
+                continue
+            diff = float(np.abs(entry[0] - key.thumbnail).mean())
+            if diff <= best_diff:
+                best, best_diff = candidate, diff
+        return best
+
+    def get(self, key):
+        """Return (face_img, embedding) for a near-duplicate of the frame with FrameKey `key`, or None"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            found = self._find(key)
+            if found is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(found)
+            self.hits += 1
+            _, face_img, embedding, _, _ = self._entries[found]
+            return face_img, embedding
+
+    def put(self, key, face_img, embedding):
+        if not self.enabled:
+            return
+        face_img, embedding = _frozen(face_img), _frozen(embedding)
+        nbytes = _nbytes(face_img) + _nbytes(embedding) + key.thumbnail.nbytes
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key.hash in self._entries:
+                self._drop(key.hash)
+            self._entries[key.hash] = (key.thumbnail, face_img, embedding, nbytes, time.monotonic())
+            self.bytes_used += nbytes
+            while self.bytes_used > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,393 @@
+import numpy as np
+
+from ann_index import IVFSearcher, train_searcher
+from embedding_store import open_packed, pack_arrays, unpack_arrays
+from quantization import FloatVectors, encode_vectors, vectors_from_arrays
+
+# Verification rules applied on top of the class vote
+VERIFY_THRESHOLD_RATIO = 0.8  # Stricter threshold (80% of the user threshold)
+MIN_CONFIDENCE = 0.85
+
+
+def l2_normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingIndex:
+    """
+    Index semua embedding FaceNet yang terdaftar dalam satu matriks float32.
+
+    Baris embedding (sudah di-L2-normalize) dan centroid tiap user disimpan
+    bertumpuk dalam satu matriks contiguous, sehingga satu perkalian
+    matriks-vektor sudah cukup untuk top-k, voting kelas (setara KNN
+    weights='distance', metric='cosine'), jarak ke centroid dan verifikasi
+    threshold.
+
+    Dengan `searcher` (lihat ann_index), top-k diambil dari index ANN dan
+    hanya kandidat serta centroid kelas hasil vote yang dihitung, bukan
+    seluruh matriks.
+
+    Baris embedding juga bisa disimpan sebagai float16 atau kode product
+    quantization (lihat quantization, with_storage()); centroid tetap
+    float32 sehingga verifikasi threshold tidak berubah.
+    """
+
+    def __init__(self, embeddings, labels, classes, centroids, centroid_norms, thresholds, k, searcher=None):
+        # `embeddings`: raw rows, or rows already encoded by quantization.encode_vectors()
+        if not hasattr(embeddings, "storage"):
+            embeddings = FloatVectors.encode(l2_normalize(embeddings))
+        self.vectors = embeddings
+        self._centroids = np.ascontiguousarray(l2_normalize(centroids))
+        self.n_embeddings = len(embeddings)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.classes = np.asarray(classes, dtype=str)
+        self.centroid_norms = np.asarray(centroid_norms, dtype=np.float32)
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.k = int(k)
+        self.searcher = searcher
+
+    @classmethod
+    def build(cls, embeddings, labels, user_data, k):
+        """Build from raw embeddings and their string labels plus the user_data dict"""
+        classes, label_ids = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+        centroids = []
+        thresholds = []
+        for nim in classes:
+            data = user_data.get(nim)
+            if data is None:
+                # No centroid for this label: never verifies
+                centroids.append(np.zeros(np.shape(embeddings)[1], dtype=np.float32))
+                thresholds.append(np.nan)
+            else:
+                centroids.append(np.asarray(data["avg_embedding"], dtype=np.float32).ravel())
+                thresholds.append(float(data["threshold"]))
+        centroids = np.array(centroids, dtype=np.float32)
+        return cls(embeddings, label_ids, classes, centroids,
+                   np.linalg.norm(centroids, axis=1), thresholds, k)
+
+    @classmethod
+    def from_model(cls, knn, label_encoder, user_data):
+        """Build from a fitted KNeighborsClassifier and its LabelEncoder"""
+        labels = label_encoder.classes_[knn.classes_[knn._y]]
+        return cls.build(knn._fit_X, labels, user_data, knn.n_neighbors)
+
+    @classmethod
+    def empty(cls, k=1):
+        index = cls.__new__(cls)
+        index.vectors = FloatVectors(np.zeros((0, 0), dtype=np.float32))
+        index._centroids = np.zeros((0, 0), dtype=np.float32)
+        index.n_embeddings = 0
+        index.labels = np.zeros(0, dtype=np.int32)
+        index.classes = np.zeros(0, dtype=str)
+        index.centroid_norms = np.zeros(0, dtype=np.float32)
+        index.thresholds = np.zeros(0, dtype=np.float64)
+        index.k = int(k)
+        index.searcher = None
+        return index
+
+    @property
+    def storage(self):
+        return self.vectors.storage
+
+    @property
+    def nbytes(self):
+        """Memory held by the embedding rows and centroids"""
+        return self.vectors.nbytes + self._centroids.nbytes
+
+    def with_class(self, label, embeddings, avg_embedding, threshold, k=None):
+        """
+        Return a new index with `label` added, or replaced if already enrolled.
+        This index is left untouched so readers can keep using it while the
+        new one is swapped in.
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        avg_embedding = np.asarray(avg_embedding, dtype=np.float32).ravel()
+        dim = embeddings.shape[1]
+        vectors = self.vectors
+        centroids = self._centroids.copy()
+        if vectors.shape[1] != dim:
+            vectors = FloatVectors(np.zeros((0, dim), dtype=np.float32))
+            centroids = np.zeros((0, dim), dtype=np.float32)
+
+        classes = [str(c) for c in self.classes]
+        old_vectors = vectors
+        old_labels = self.labels
+        centroid_norms = self.centroid_norms.copy()
+        thresholds = self.thresholds.copy()
+
+        keep = np.ones(len(old_labels), dtype=bool)
+        if label in classes:
+            class_id = classes.index(label)
+            keep = old_labels != class_id
+            old_vectors = vectors.take(keep)
+            old_labels = old_labels[keep]
+            centroids[class_id] = l2_normalize(avg_embedding)
+            centroid_norms[class_id] = np.linalg.norm(avg_embedding)
+            thresholds[class_id] = float(threshold)
+        else:
+            class_id = len(classes)
+            classes.append(label)
+            centroids = np.vstack([centroids, l2_normalize(avg_embedding)[None, :]])
+            centroid_norms = np.append(centroid_norms, np.linalg.norm(avg_embedding))
+            thresholds = np.append(thresholds, float(threshold))
+
+        return EmbeddingIndex(
+            # New rows are encoded like the existing ones (same PQ codebooks)
+            old_vectors.append(l2_normalize(embeddings)),
+            np.concatenate([old_labels, np.full(len(embeddings), class_id, dtype=np.int32)]),
+            classes,
+            centroids,
+            centroid_norms,
+            thresholds,
+            self.k if k is None else k,
+            searcher=self.searcher.with_rows(keep, embeddings) if self.searcher is not None else None,
+        )
+
+    def subset(self, labels, k=None):
+        """
+        New exact-search index restricted to `labels` (unknown labels are ignored).
+        Returns None if none of the labels are enrolled.
+        """
+        positions = {str(label): i for i, label in enumerate(self.classes)}
+        class_ids = np.array(sorted({positions[label] for label in labels if label in positions}), dtype=np.int64)
+        if len(class_ids) == 0:
+            return None
+
+        rows = np.isin(self.labels, class_ids)
+        remap = np.full(self.num_classes, -1, dtype=np.int32)
+        remap[class_ids] = np.arange(len(class_ids), dtype=np.int32)
+        return EmbeddingIndex(
+            self.vectors.take(rows),
+            remap[self.labels[rows]],
+            self.classes[class_ids],
+            self._centroids[class_ids],
+            self.centroid_norms[class_ids],
+            self.thresholds[class_ids],
+            self.k if k is None else k,
+        )
+
+    def with_searcher(self, searcher):
+        """Same index with a different ANN searcher (None = exact search)"""
+        index = EmbeddingIndex.__new__(EmbeddingIndex)
+        index.__dict__.update(self.__dict__)
+        index.searcher = searcher
+        return index
+
+    def with_ann(self, backend, **params):
+        """Train an ANN searcher of `backend` ("ivf" or "hnsw") over the current embeddings"""
+        return self.with_searcher(train_searcher(backend, self.vectors[:], **params))
+
+    def with_storage(self, storage, **params):
+        """
+        Same index with the embedding rows re-encoded as `storage` ("float32",
+        "float16" or "pq"); `params` go to ProductQuantizer.train for "pq".
+        Row order is unchanged, so an attached ANN searcher stays valid.
+        """
+        index = EmbeddingIndex.__new__(EmbeddingIndex)
+        index.__dict__.update(self.__dict__)
+        index.vectors = encode_vectors(self.vectors[:], storage, **params)
+        return index
+
+    def __len__(self):
+        return self.n_embeddings
+
+    @property
+    def num_classes(self):
+        return len(self.classes)
+
+    def _unit(self, query):
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query_norm = float(np.linalg.norm(query))
+        return query / max(query_norm, 1e-12), query_norm
+
+    def _neighbours(self, query_unit, k):
+        """(row indices, cosine similarities) of the top-k embeddings, most similar first"""
+        if self.searcher is not None:
+            return self.searcher.search(self.vectors, query_unit, k)
+        sims = self.vectors.similarities(query_unit)
+        idx = self._top_k(sims, k)
+        return idx, sims[idx]
+
+    def _top_k(self, sims, k):
+        k = min(k, len(sims))
+        if k < len(sims):
+            idx = np.argpartition(-sims, k - 1)[:k]
+        else:
+            idx = np.arange(len(sims))
+        return idx[np.argsort(-sims[idx], kind="stable")]
+
+    def search(self, query, k=None):
+        """Return (indices, cosine distances, label ids) of the k nearest embeddings"""
+        query_unit, _ = self._unit(query)
+        idx, sims = self._neighbours(query_unit, k or self.k)
+        return idx, 1.0 - sims, self.labels[idx]
+
+    def _vote(self, distances, label_ids):
+        # Same weighting as sklearn weights='distance': exact hits win outright
+        zero = distances <= 1e-7
+        weights = zero.astype(np.float32) if zero.any() else 1.0 / distances
+        proba = np.bincount(label_ids, weights=weights, minlength=self.num_classes)
+        return proba / proba.sum()
+
+    def match(self, query):
+        """Classify and verify a single embedding, returning recognize_face() response fields"""
+        query_unit, query_norm = self._unit(query)
+        idx, sims = self._neighbours(query_unit, self.k)
+        proba = self._vote(np.maximum(1.0 - sims, 0.0), self.labels[idx])
+        pred = int(np.argmax(proba))
+        cos_sim = float(self._centroids[pred] @ query_unit)
+        return self._result(pred, float(proba[pred]), cos_sim, query_norm)
+
+    def match_group(self, queries):
+        """
+        Match every face of one photo at once, with each student assigned to
+        at most one face.
+
+        Top-k neighbours and centroid similarities of all faces come from
+        batched matrix products (per-face search when an ANN searcher is attached).
+        Every (face, student) pair passing the same vote + threshold rules as
+        match() is a candidate; the Hungarian assignment then keeps the set
+        of pairs with the smallest total centroid distance. A face that
+        verified but lost its student to a closer face gets match=False and
+        `duplicate_of` pointing at that face.
+        Returns one match()-style dict per query.
+        """
+        from scipy.optimize import linear_sum_assignment
+
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        query_norms = np.linalg.norm(queries, axis=1)
+        units = l2_normalize(queries)
+        centroid_sims = units @ self._centroids.T
+        if self.searcher is None:
+            neighbours = []
+            for row in self.vectors.similarities(units):
+                idx = self._top_k(row, self.k)
+                neighbours.append((idx, row[idx]))
+        else:
+            neighbours = [self._neighbours(unit, self.k) for unit in units]
+        proba = np.vstack([self._vote(np.maximum(1.0 - sims, 0.0), self.labels[idx]) for idx, sims in neighbours])
+
+        distances = 1.0 - centroid_sims
+        with np.errstate(invalid="ignore"):
+            valid = (proba > MIN_CONFIDENCE) & (distances < self.thresholds * VERIFY_THRESHOLD_RATIO)
+        preds = np.argmax(proba, axis=1)
+        results = [self._result(int(pred), float(proba[f, pred]), float(centroid_sims[f, pred]), float(query_norms[f]))
+                   for f, pred in enumerate(preds)]
+
+        faces, candidates = np.nonzero(valid.any(axis=1))[0], np.nonzero(valid.any(axis=0))[0]
+        if len(faces) == 0:
+            return results
+        cost = np.where(valid[np.ix_(faces, candidates)], distances[np.ix_(faces, candidates)], 1e6)
+        rows, cols = linear_sum_assignment(cost)
+        assigned = {}
+        for row, col in zip(rows, cols):
+            if cost[row, col] < 1e6:
+                face, class_id = int(faces[row]), int(candidates[col])
+                assigned[class_id] = face
+                results[face] = self._result(class_id, float(proba[face, class_id]),
+                                             float(centroid_sims[face, class_id]), float(query_norms[face]))
+        for face in faces:
+            if int(face) in assigned.values():
+                continue
+            winner = assigned.get(int(preds[face]))
+            results[face] = dict(results[face], match=False, predicted_label=None,
+                                 message="Face matched a student already assigned to another face")
+            if winner is not None:
+                results[face]["duplicate_of"] = winner
+        return results
+
+    def _result(self, pred, confidence, cos_sim, query_norm):
+        pred_label = str(self.classes[pred])
+        user_threshold = float(self.thresholds[pred])
+        if np.isnan(user_threshold):
+            return {
+                "success": True,
+                "match": False,
+                "message": "Unknown user predicted",
+            }
+
+        centroid_norm = float(self.centroid_norms[pred])
+        cosine_dist = 1.0 - cos_sim
+        euclidean_dist = float(np.sqrt(max(
+            query_norm ** 2 + centroid_norm ** 2 - 2.0 * query_norm * centroid_norm * cos_sim, 0.0)))
+
+        is_verified = cosine_dist < user_threshold * VERIFY_THRESHOLD_RATIO and confidence > MIN_CONFIDENCE
+
+        return {
+            "success": True,
+            "match": bool(is_verified),
+            "predicted_label": pred_label if is_verified else None,
+            "confidence": confidence,
+            "cosine_distance": cosine_dist,
+            "euclidean_distance": euclidean_dist,
+            "user_threshold": user_threshold,
+            "message": "Face recognized successfully" if is_verified else "Face not recognized",
+        }
+
+    def _arrays(self):
+        if self.storage == FloatVectors.storage:
+            # Rows and centroids stacked, as in snapshots written before other storages existed
+            arrays = {"matrix": np.vstack([self.vectors[:], self._centroids])}
+        else:
+            arrays = {"centroids": self._centroids}
+            arrays.update({f"vectors_{name}": array for name, array in self.vectors.arrays().items()})
+        arrays.update({
+            "labels": self.labels,
+            "classes": self.classes,
+            "centroid_norms": self.centroid_norms,
+            "thresholds": self.thresholds,
+        })
+        # Only searchers that expose their arrays (IVF) are stored in the snapshot
+        searcher_arrays = self.searcher.arrays() if self.searcher is not None else None
+        for name, array in (searcher_arrays or {}).items():
+            arrays[f"ann_{name}"] = array
+        return arrays
+
+    def _meta(self):
+        meta = {"n_embeddings": self.n_embeddings, "k": self.k}
+        if self.storage != FloatVectors.storage:
+            meta["storage"] = {"backend": self.storage, "params": self.vectors.params}
+        if self.searcher is not None and self.searcher.arrays() is not None:
+            meta["ann"] = {"backend": self.searcher.backend, "params": self.searcher.params}
+        return meta
+
+    def to_bytes(self):
+        return pack_arrays(self._arrays(), meta=self._meta())
+
+    @classmethod
+    def _from_arrays(cls, arrays, meta):
+        index = cls.__new__(cls)
+        index.n_embeddings = int(meta["n_embeddings"])
+        storage = meta.get("storage")
+        if storage is None:
+            index.vectors = FloatVectors(arrays["matrix"][:index.n_embeddings])
+            index._centroids = arrays["matrix"][index.n_embeddings:]
+        else:
+            index.vectors = vectors_from_arrays(
+                storage["backend"],
+                {name[len("vectors_"):]: array for name, array in arrays.items() if name.startswith("vectors_")},
+                storage["params"])
+            index._centroids = arrays["centroids"]
+        index.labels = arrays["labels"]
+        index.classes = arrays["classes"]
+        index.centroid_norms = arrays["centroid_norms"]
+        index.thresholds = arrays["thresholds"]
+        index.k = int(meta["k"])
+        index.searcher = None
+        ann = meta.get("ann")
+        if ann and ann["backend"] == IVFSearcher.backend:
+            index.searcher = IVFSearcher.from_arrays(
+                {name[len("ann_"):]: array for name, array in arrays.items() if name.startswith("ann_")},
+                ann["params"])
+        return index
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls._from_arrays(*unpack_arrays(data))
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a snapshot written with to_bytes() read-only"""
+        return cls._from_arrays(*open_packed(path))
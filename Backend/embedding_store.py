@@ -0,0 +1,465 @@
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+
+PACKED_MAGIC = b"PEMB"
+PACKED_FORMAT_VERSION = 1
+PACKED_ALIGNMENT = 64
+
+EMBEDDING_STORE_PATH = "embeddings/store.pemb"
+# One small blob per registration, folded into the packed store by compact_store()
+STORE_DELTA_PREFIX = "embeddings/deltas/"
+STORE_UPDATE_RETRIES = 5
+
+
+def pack_arrays(arrays, meta=None):
+    """
+    Serialize named numpy arrays into one packed blob.
+
+    Layout: magic, format version (uint32), header length (uint64), JSON header,
+    then every array as raw C-order bytes at a 64-byte aligned offset so the
+    file can be memory-mapped directly.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+        entries[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    header = json.dumps({"meta": meta or {}, "arrays": entries}).encode("utf-8")
+    prefix_len = len(PACKED_MAGIC) + 4 + 8 + len(header)
+    data_start = -(-prefix_len // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+
+    buffer = BytesIO()
+    buffer.write(PACKED_MAGIC)
+    buffer.write(struct.pack("<IQ", PACKED_FORMAT_VERSION, len(header)))
+    buffer.write(header)
+    for name, array in arrays.items():
+        buffer.write(b"\0" * (data_start + entries[name]["offset"] - buffer.tell()))
+        buffer.write(array.tobytes())
+    return buffer.getvalue()
+
+
+def _parse_header(raw):
+    if raw[:4] != PACKED_MAGIC:
+        raise ValueError("Not a packed embedding file")
+    version, header_len = struct.unpack("<IQ", raw[4:16])
+    if version != PACKED_FORMAT_VERSION:
+        raise ValueError(f"Unsupported packed format version {version}")
+    header = json.loads(bytes(raw[16:16 + header_len]).decode("utf-8"))
+    data_start = -(-(16 + header_len) // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+    return header, data_start
+
+
+def unpack_arrays(data):
+    """Inverse of pack_arrays for an in-memory blob. Returns (arrays, meta)"""
+    header, data_start = _parse_header(data)
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=data_start + entry["offset"])
+        arrays[name] = array.reshape(entry["shape"])
+    return arrays, header["meta"]
+
+
+def open_packed(path):
+    """Memory-map a packed file read-only. Returns (arrays, meta)"""
+    with open(path, "rb") as f:
+        prefix = f.read(16)
+        header_len = struct.unpack("<IQ", prefix[4:16])[1]
+        header, data_start = _parse_header(prefix + f.read(header_len))
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        shape = tuple(entry["shape"])
+        dtype = np.dtype(entry["dtype"])
+        if int(np.prod(shape, dtype=np.int64)) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+            continue
+        arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=data_start + entry["offset"], shape=shape)
+    return arrays, header["meta"]
+
+
+def write_local_copy(path, data, replace=True):
+    """
+    Atomically write `data` to `path` (existing mappings of the old file stay valid).
+    With replace=False an existing file wins, so processes racing to cache the
+    same immutable blob all end up mapping the same file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    if replace:
+        os.replace(tmp_path, path)
+        return
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+
+
+class EmbeddingStore:
+    """
+    Semua embedding mahasiswa dalam satu file packed.
+
+    embeddings  float32 (N, d)   semua embedding, dikelompokkan per mahasiswa (atau float16, lihat astype())
+    offsets     int64   (C + 1,) embedding milik labels[i] ada di offsets[i]:offsets[i+1]
+    centroids   float32 (C, d)   rata-rata embedding per mahasiswa
+    thresholds  float64 (C,)     dynamic threshold per mahasiswa
+    labels      unicode (C,)     NIM
+    """
+
+    def __init__(self, labels, offsets, embeddings, centroids, thresholds, version=0):
+        self.labels = labels
+        self.offsets = offsets
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.thresholds = thresholds
+        self.version = version
+        self._positions = {str(label): i for i, label in enumerate(labels)}
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            labels=np.zeros(0, dtype="<U32"),
+            offsets=np.zeros(1, dtype=np.int64),
+            embeddings=np.zeros((0, 0), dtype=np.float32),
+            centroids=np.zeros((0, 0), dtype=np.float32),
+            thresholds=np.zeros(0, dtype=np.float64),
+        )
+
+    @classmethod
+    def from_users(cls, users, version=0, dtype=np.float32):
+        """Build from {nim: (embeddings, avg_embedding, threshold)}"""
+        labels = sorted(users)
+        if not labels:
+            return cls.empty()
+        embeddings = [np.atleast_2d(np.asarray(users[nim][0], dtype=dtype)) for nim in labels]
+        offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in embeddings])
+        return cls(
+            labels=np.array(labels, dtype="<U32"),
+            offsets=offsets,
+            embeddings=np.ascontiguousarray(np.vstack(embeddings)),
+            centroids=np.array([np.asarray(users[nim][1], dtype=np.float32).ravel() for nim in labels]),
+            thresholds=np.array([float(users[nim][2]) for nim in labels], dtype=np.float64),
+            version=version,
+        )
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, nim):
+        return nim in self._positions
+
+    def get(self, nim):
+        """Return (embeddings, avg_embedding, threshold) for one NIM"""
+        i = self._positions[nim]
+        return (
+            self.embeddings[self.offsets[i]:self.offsets[i + 1]],
+            self.centroids[i],
+            float(self.thresholds[i]),
+        )
+
+    def users(self):
+        return {str(nim): self.get(str(nim)) for nim in self.labels}
+
+    def with_user(self, nim, embeddings, avg_embedding, threshold):
+        """Return a new store with one user added or replaced"""
+        return self.with_users({nim: (embeddings, avg_embedding, threshold)})
+
+    def with_users(self, updates):
+        """Return a new store with every user in {nim: (embeddings, avg_embedding, threshold)} added or replaced"""
+        users = self.users()
+        users.update(updates)
+        dtype = self.embeddings.dtype if len(self.embeddings) else np.float32
+        return EmbeddingStore.from_users(users, version=self.version + 1, dtype=dtype)
+
+    def astype(self, dtype):
+        """
+        Store with the embeddings in `dtype` ("float32" or "float16"; centroids
+        stay float32). Returns this store if nothing changes.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float16):
+            raise ValueError(f"Unsupported embedding dtype {dtype}, expected float32 or float16")
+        if self.embeddings.dtype == dtype:
+            return self
+        return EmbeddingStore(
+            labels=self.labels,
+            offsets=self.offsets,
+            embeddings=np.ascontiguousarray(self.embeddings, dtype=dtype),
+            centroids=self.centroids,
+            thresholds=self.thresholds,
+            version=self.version,
+        )
+
+    def with_thresholds(self, thresholds):
+        """Return a new store with every threshold replaced"""
+        return EmbeddingStore(
+            labels=self.labels,
+            offsets=self.offsets,
+            embeddings=self.embeddings,
+            centroids=self.centroids,
+            thresholds=np.asarray(thresholds, dtype=np.float64),
+            version=self.version + 1,
+        )
+
+    def user_data(self):
+        """Same shape as the dict returned by load_user_data()"""
+        return {
+            str(nim): {"avg_embedding": self.centroids[i], "threshold": self.thresholds[i]}
+            for i, nim in enumerate(self.labels)
+        }
+
+    def training_data(self):
+        """Return (X, y) with one label per embedding row"""
+        counts = np.diff(self.offsets)
+        return self.embeddings, np.repeat(self.labels, counts)
+
+    def to_bytes(self):
+        return pack_arrays(
+            {
+                "labels": self.labels,
+                "offsets": self.offsets,
+                "embeddings": self.embeddings,
+                "centroids": self.centroids,
+                "thresholds": self.thresholds,
+            },
+            meta={"version": self.version},
+        )
+
+    @classmethod
+    def _from_arrays(cls, arrays, meta):
+        return cls(
+            labels=arrays["labels"],
+            offsets=arrays["offsets"],
+            embeddings=arrays["embeddings"],
+            centroids=arrays["centroids"],
+            thresholds=arrays["thresholds"],
+            version=meta.get("version", 0),
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls._from_arrays(*unpack_arrays(data))
+
+    @classmethod
+    def open(cls, path):
+        """Open a local copy memory-mapped, so workers on one host share its pages"""
+        return cls._from_arrays(*open_packed(path))
+
+
+def load_legacy_users(blob_store):
+    """Read the old embeddings/{nim}.npy, avg_{nim}.npy and threshold_{nim}.npy layout"""
+    nims = []
+    for name in blob_store.list(prefix="embeddings/"):
+        filename = name.split("/")[-1]
+        if filename.startswith("avg_") and filename.endswith(".npy"):
+            nims.append(filename[4:-4])
+
+    paths = []
+    for nim in nims:
+        paths += [f"embeddings/{nim}.npy", f"embeddings/avg_{nim}.npy", f"embeddings/threshold_{nim}.npy"]
+    blobs = blob_store.get_many(paths)
+
+    users = {}
+    for nim in nims:
+        parts = [blobs[f"embeddings/{nim}.npy"], blobs[f"embeddings/avg_{nim}.npy"],
+                 blobs[f"embeddings/threshold_{nim}.npy"]]
+        if any(part is None for part in parts):
+            print(f"[WARNING] Incomplete legacy embeddings for {nim} — skipping")
+            continue
+        users[nim] = tuple(np.load(BytesIO(part)) for part in parts)
+    return users
+
+
+def put_store_delta(blob_store, nim, embeddings, avg_embedding, threshold):
+    """
+    Record one registration as its own small blob: O(1) per enrollment, no
+    contention on the packed store. Returns the blob name.
+    """
+    name = f"{STORE_DELTA_PREFIX}{time.time_ns():020d}_{nim}.npz"
+    buffer = BytesIO()
+    np.savez(
+        buffer,
+        nim=nim,
+        embeddings=np.asarray(embeddings, dtype=np.float32),
+        avg_embedding=np.asarray(avg_embedding, dtype=np.float32),
+        threshold=np.asarray(threshold),
+    )
+    blob_store.put_bytes(name, buffer.getvalue())
+    return name
+
+
+def pending_store_deltas(blob_store):
+    """Registration deltas not yet folded into the packed store, oldest first"""
+    return sorted(blob_store.list(STORE_DELTA_PREFIX))
+
+
+def read_store_deltas(blob_store, names):
+    """{nim: (embeddings, avg_embedding, threshold)} from `names`; a later delta for a NIM wins"""
+    users = {}
+    for name, data in sorted(blob_store.get_many(names).items()):
+        if data is None:
+            # Folded and deleted by a concurrent compaction
+            continue
+        delta = np.load(BytesIO(data))
+        users[str(delta["nim"])] = (delta["embeddings"], delta["avg_embedding"], float(delta["threshold"]))
+    return users
+
+
+def load_store(blob_store, cache_dir=None):
+    """
+    Load the packed store with the pending registration deltas applied. With
+    `cache_dir` the blob is kept as a local file (one per generation) and
+    memory-mapped instead of parsed into memory. Falls back to the legacy
+    per-student layout if no packed store exists yet.
+    """
+    deltas = pending_store_deltas(blob_store)
+    store = _load_packed(blob_store, cache_dir)
+    if deltas:
+        store = store.with_users(read_store_deltas(blob_store, deltas))
+    return store
+
+
+def _load_packed(blob_store, cache_dir=None):
+    for attempt in range(STORE_UPDATE_RETRIES):
+        generation = blob_store.generation(EMBEDDING_STORE_PATH)
+        if generation is None:
+            return EmbeddingStore.from_users(load_legacy_users(blob_store))
+
+        if cache_dir is None:
+            break
+
+        local_path = os.path.join(cache_dir, f"store_{generation}.pemb")
+        if not os.path.exists(local_path):
+            write_local_copy(local_path, blob_store.get_bytes(EMBEDDING_STORE_PATH), replace=False)
+        try:
+            store = EmbeddingStore.open(local_path)
+        except FileNotFoundError:
+            # Another worker cached a newer generation and cleaned this one up
+            continue
+        # Mapped now, so unlinking our own older snapshots cannot break this process
+        _remove_older_snapshots(cache_dir, generation)
+        return store
+
+    return EmbeddingStore.from_bytes(blob_store.get_bytes(EMBEDDING_STORE_PATH))
+
+
+def _remove_older_snapshots(cache_dir, generation):
+    """
+    Delete cached store snapshots older than `generation`. Other workers may be
+    doing the same, and anyone still mapping an old snapshot keeps its pages.
+    """
+    for filename in os.listdir(cache_dir):
+        if not (filename.startswith("store_") and filename.endswith(".pemb")):
+            continue
+        try:
+            older = int(filename[len("store_"):-len(".pemb")]) < int(generation)
+        except ValueError:
+            continue
+        if older:
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+            except FileNotFoundError:
+                pass
+
+
+def update_store(blob_store, mutate):
+    """Apply `mutate` to the packed store (see _update_store) and return the stored result"""
+    return _update_store(blob_store, mutate)[0]
+
+
+def _update_store(blob_store, mutate):
+    """
+    Read-modify-write the packed store with optimistic concurrency: the upload
+    only succeeds if nobody else wrote the store in between, otherwise retry.
+    Pending registration deltas are folded in first and deleted once the new
+    store is written. If `mutate` returns the store unchanged and there was
+    nothing to fold, nothing is written.
+    """
+    for attempt in range(STORE_UPDATE_RETRIES):
+        # List before reading: a delta written in between stays pending for the next fold
+        deltas = pending_store_deltas(blob_store)
+        generation = blob_store.generation(EMBEDDING_STORE_PATH)
+        if generation is None:
+            # First write migrates whatever is still in the legacy layout
+            store = EmbeddingStore.from_users(load_legacy_users(blob_store))
+        else:
+            store = EmbeddingStore.from_bytes(blob_store.get_bytes(EMBEDDING_STORE_PATH))
+        if deltas:
+            store = store.with_users(read_store_deltas(blob_store, deltas))
+
+        new_store = mutate(store)
+        if new_store is store and not deltas:
+            return store, deltas
+        try:
+            blob_store.put_bytes(EMBEDDING_STORE_PATH, new_store.to_bytes(),
+                                 if_generation_match=generation or 0)
+        except Exception as e:
+            if not blob_store.is_precondition_failed(e):
+                raise
+            print(f"[WARNING] Embedding store changed concurrently, retrying ({attempt + 1})")
+            continue
+        for name in deltas:
+            try:
+                blob_store.delete(name)
+            except Exception as e:
+                print(f"[WARNING] Failed to delete store delta {name}: {e}")
+        return new_store, deltas
+    raise RuntimeError("Could not update embedding store: too many concurrent writers")
+
+
+def compact_store(blob_store, dtype=None):
+    """
+    Fold the pending registration deltas into the packed store (converting
+    the embeddings to `dtype` if given). Returns (store, names of the folded deltas)
+    """
+    return _update_store(blob_store, lambda store: store.astype(dtype) if dtype else store)
+
+
+def migrate_legacy_layout(blob_store, delete_legacy=False):
+    """Pack every student from the legacy layout into embeddings/store.pemb"""
+    users = load_legacy_users(blob_store)
+
+    def merge(store):
+        merged = store.users()
+        # Students already in the packed store win over stale legacy blobs
+        for nim, user in users.items():
+            merged.setdefault(nim, user)
+        return EmbeddingStore.from_users(merged, version=store.version + 1)
+
+    store = update_store(blob_store, merge)
+
+    if delete_legacy:
+        for nim in users:
+            for path in (f"embeddings/{nim}.npy", f"embeddings/avg_{nim}.npy", f"embeddings/threshold_{nim}.npy"):
+                blob_store.delete(path)
+    return store, sorted(users)
+
+
+if __name__ == "__main__":
+    # Usage: python embedding_store.py migrate <local root containing embeddings/> [--delete-legacy]
+    from blob_store import LocalBlobStore
+
+    if len(sys.argv) < 3 or sys.argv[1] != "migrate":
+        print("Usage: python embedding_store.py migrate <root_dir> [--delete-legacy]")
+        sys.exit(1)
+
+    store, migrated = migrate_legacy_layout(LocalBlobStore(sys.argv[2]),
+                                            delete_legacy="--delete-legacy" in sys.argv[3:])
+    print(f"[MIGRATE] Packed {len(migrated)} legacy students; store now has {len(store)} students "
+          f"and {len(store.embeddings)} embeddings")
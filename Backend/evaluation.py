@@ -0,0 +1,275 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Confidence thresholds of the precision-recall curve (same grid as before)
+CONFIDENCE_THRESHOLDS = np.linspace(0, 1, 20)
+# Cosine-distance thresholds of the FAR/FRR curve
+DISTANCE_THRESHOLDS = np.linspace(0, 1.2, 61)
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def class_centroids(embeddings, labels, n_classes):
+    """L2-normalized mean embedding per class id; classes without rows get a zero vector"""
+    sums = np.zeros((n_classes, np.shape(embeddings)[1]), dtype=np.float32)
+    np.add.at(sums, labels, _normalize(embeddings))
+    return _normalize(sums)
+
+
+class NeighbourGraph:
+    """
+    Graf tetangga terdekat data uji terhadap data latih, dihitung sekali.
+
+    Menyimpan jarak cosine dan label `k` tetangga terdekat tiap query
+    (terurut, terdekat dulu), ditambah jarak ke centroid kelas aslinya
+    (genuine) dan ke centroid kelas lain yang terdekat (impostor). Vote KNN
+    untuk setiap k <= `k` diturunkan dari graf yang sama, tanpa fit ulang
+    KNeighborsClassifier.
+    """
+
+    def __init__(self, distances, neighbour_labels, y_true, genuine, impostor, n_classes):
+        self.distances = distances
+        self.neighbour_labels = neighbour_labels
+        self.y_true = y_true
+        self.genuine = genuine
+        self.impostor = impostor
+        self.n_classes = n_classes
+
+    @classmethod
+    def build(cls, X_train, y_train, X_test, y_test, n_classes, k, chunk_size=2048):
+        X_train = _normalize(X_train)
+        y_train = np.asarray(y_train, dtype=np.int64)
+        y_test = np.asarray(y_test, dtype=np.int64)
+        centroids = class_centroids(X_train, y_train, n_classes)
+        k = min(int(k), len(X_train))
+
+        distances = np.empty((len(X_test), k), dtype=np.float32)
+        neighbour_labels = np.empty((len(X_test), k), dtype=np.int64)
+        genuine = np.empty(len(X_test), dtype=np.float32)
+        impostor = np.full(len(X_test), np.inf, dtype=np.float32)
+        for start in range(0, len(X_test), chunk_size):
+            queries = _normalize(X_test[start:start + chunk_size])
+            rows = np.arange(len(queries))
+            own = y_test[start:start + chunk_size]
+
+            sims = queries @ X_train.T
+            if k < sims.shape[1]:
+                idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            else:
+                idx = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+            top = np.take_along_axis(sims, idx, axis=1)
+            order = np.argsort(-top, axis=1, kind="stable")
+            distances[start:start + len(queries)] = np.maximum(1.0 - np.take_along_axis(top, order, axis=1), 0.0)
+            neighbour_labels[start:start + len(queries)] = y_train[np.take_along_axis(idx, order, axis=1)]
+
+            centroid_distances = 1.0 - queries @ centroids.T
+            genuine[start:start + len(queries)] = centroid_distances[rows, own]
+            if n_classes > 1:
+                centroid_distances[rows, own] = np.inf
+                impostor[start:start + len(queries)] = centroid_distances.min(axis=1)
+
+        return cls(distances, neighbour_labels, y_test, genuine, impostor, n_classes)
+
+    @property
+    def k(self):
+        return self.distances.shape[1]
+
+    def vote(self, k):
+        """
+        (predicted class ids, confidence) of a distance-weighted KNN vote over
+        the first `k` neighbours, same as KNeighborsClassifier(weights='distance')
+        and EmbeddingIndex: exact hits win outright, ties go to the lower class id.
+        """
+        distances = self.distances[:, :k]
+        labels = self.neighbour_labels[:, :k]
+        zero = distances <= 1e-7
+        with np.errstate(divide="ignore"):
+            weights = np.where(zero.any(axis=1, keepdims=True), zero.astype(np.float64), 1.0 / distances)
+        # Score of the class of every neighbour slot: sum of the weights of the slots with the same class
+        same = labels[:, :, None] == labels[:, None, :]
+        scores = np.einsum("nij,nj->ni", same, weights)
+        best = scores >= scores.max(axis=1, keepdims=True)
+        slot = np.argmin(np.where(best, labels, np.iinfo(np.int64).max), axis=1)
+        rows = np.arange(len(labels))
+        return labels[rows, slot], scores[rows, slot] / weights.sum(axis=1)
+
+
+def _per_class_scores(tp, predicted, actual):
+    """Precision/recall/F1 per class and their macro average over classes seen in y_true or y_pred"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(actual > 0, tp / actual, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    present = (predicted > 0) | (actual > 0)
+    n_present = np.maximum(present.sum(axis=-1), 1)
+    macro = [np.where(present, values, 0.0).sum(axis=-1) / n_present for values in (precision, recall, f1)]
+    return precision, recall, f1, macro
+
+
+def classification_report(y_true, y_pred, n_classes):
+    """Confusion matrix, accuracy and macro/per-class precision, recall and F1 (sklearn semantics)"""
+    y_true = np.asarray(y_true, dtype=np.int64)
+    y_pred = np.asarray(y_pred, dtype=np.int64)
+    confusion = np.bincount(y_true * n_classes + y_pred, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+    tp = np.diag(confusion)
+    precision, recall, f1, (macro_precision, macro_recall, macro_f1) = _per_class_scores(
+        tp, confusion.sum(axis=0), confusion.sum(axis=1))
+    return {
+        "confusion_matrix": confusion,
+        "accuracy": float(tp.sum() / max(len(y_true), 1)),
+        "precision": float(macro_precision),
+        "recall": float(macro_recall),
+        "f1_score": float(macro_f1),
+        "class_precision": precision,
+        "class_recall": recall,
+        "class_f1": f1,
+    }
+
+
+def precision_recall_curve(y_true, y_pred, confidence, n_classes, thresholds=CONFIDENCE_THRESHOLDS):
+    """
+    Macro precision and recall of the predictions kept at each confidence
+    threshold (confidence >= threshold), for all thresholds at once: every
+    prediction is counted in the bin of the highest threshold it passes and
+    the bins are accumulated from the top down. Thresholds keeping nothing
+    get 0.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    n_thresholds = len(thresholds)
+    # Index of the highest threshold each prediction passes (-1: none)
+    passed = np.searchsorted(thresholds, confidence, side="right") - 1
+    kept = passed >= 0
+    y_true, y_pred, passed = np.asarray(y_true)[kept], np.asarray(y_pred)[kept], passed[kept]
+
+    def cumulative(class_ids, mask=None):
+        counts = np.bincount(passed * n_classes + class_ids, weights=mask,
+                             minlength=n_thresholds * n_classes).reshape(n_thresholds, n_classes)
+        return np.cumsum(counts[::-1], axis=0)[::-1]
+
+    tp = cumulative(y_true, (y_true == y_pred).astype(np.float64))
+    _, _, _, (precision, recall, _) = _per_class_scores(tp, cumulative(y_pred), cumulative(y_true))
+    return precision, recall
+
+
+def far_frr_curve(genuine, impostor, thresholds=DISTANCE_THRESHOLDS):
+    """
+    False accept / false reject rate of the rule `distance < threshold` at
+    every threshold. Genuine attempts are queries against their own class
+    centroid, impostor attempts against the closest centroid of another class.
+    """
+    genuine = np.sort(genuine)
+    impostor = np.sort(impostor[np.isfinite(impostor)])
+    far = np.searchsorted(impostor, thresholds, side="left") / max(len(impostor), 1)
+    frr = 1.0 - np.searchsorted(genuine, thresholds, side="left") / max(len(genuine), 1)
+    return far, frr
+
+
+def verification_report(genuine, impostor, thresholds=DISTANCE_THRESHOLDS, target_far=0.001):
+    far, frr = far_frr_curve(genuine, impostor, thresholds)
+    eer_at = int(np.argmin(np.abs(far - frr)))
+    impostor = impostor[np.isfinite(impostor)]
+    threshold_at_far = float(np.quantile(impostor, target_far)) if len(impostor) else None
+    return {
+        "distance_thresholds": np.asarray(thresholds).tolist(),
+        "far": far.tolist(),
+        "frr": frr.tolist(),
+        "eer": float((far[eer_at] + frr[eer_at]) / 2),
+        "eer_threshold": float(thresholds[eer_at]),
+        "target_far": target_far,
+        # Largest cosine distance that keeps the false accept rate at target_far
+        "threshold_at_target_far": threshold_at_far,
+        "frr_at_target_far": float(np.mean(genuine >= threshold_at_far)) if threshold_at_far is not None else None,
+    }
+
+
+def evaluate(graph, k, confidence_thresholds=CONFIDENCE_THRESHOLDS, distance_thresholds=DISTANCE_THRESHOLDS,
+             target_far=0.001):
+    """Every training metric for the KNN with `k` neighbours, derived from one NeighbourGraph"""
+    y_pred, confidence = graph.vote(k)
+    report = classification_report(graph.y_true, y_pred, graph.n_classes)
+    precision_list, recall_list = precision_recall_curve(graph.y_true, y_pred, confidence, graph.n_classes,
+                                                         confidence_thresholds)
+    report.update({
+        "y_pred": y_pred,
+        "confidence_scores": confidence,
+        "precision_list": precision_list,
+        "recall_list": recall_list,
+        "thresholds": np.asarray(confidence_thresholds),
+        "verification": verification_report(graph.genuine, graph.impostor, distance_thresholds, target_far),
+    })
+    return report
+
+
+def _evaluate_fold(X, y, train, test, n_classes, k_values):
+    graph = NeighbourGraph.build(X[train], y[train], X[test], y[test], n_classes, max(k_values))
+    scores = {}
+    for k in k_values:
+        y_pred, _ = graph.vote(k)
+        report = classification_report(graph.y_true, y_pred, n_classes)
+        scores[k] = (report["accuracy"], report["f1_score"])
+    return scores, graph.genuine, graph.impostor
+
+
+def default_threads(n_splits):
+    """One thread per fold, within the compute threads given to this process (serve.py sets OMP_NUM_THREADS)"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, min(n_splits, int(os.environ.get("OMP_NUM_THREADS") or cores)))
+
+
+def cross_validate(X, y, n_classes, k_values, n_splits=5, threads=None, distance_thresholds=DISTANCE_THRESHOLDS,
+                   target_far=0.001, seed=42):
+    """
+    Stratified k-fold cross-validation of the KNN for every k in `k_values`.
+
+    Each fold builds one NeighbourGraph with max(k_values) neighbours and
+    scores every k from it. Folds run in parallel threads: the work is
+    numpy/BLAS, which releases the GIL, and threads are safe inside the
+    multithreaded server where forking is not. Returns mean
+    and std of accuracy and macro F1 per k, the recommended k (best mean F1,
+    smallest k on ties) and a verification report pooled over all folds.
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.asarray(y, dtype=np.int64)
+    k_values = sorted({int(k) for k in k_values if k >= 1})
+    # Every class needs a row in each fold
+    n_splits = max(2, min(n_splits, int(np.bincount(y).min())))
+    splits = list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed).split(X, y))
+
+    threads = threads or default_threads(n_splits)
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, n_splits), thread_name_prefix="cv-fold") as pool:
+            futures = [pool.submit(_evaluate_fold, X, y, train, test, n_classes, k_values) for train, test in splits]
+            folds = [future.result() for future in futures]
+    else:
+        folds = [_evaluate_fold(X, y, train, test, n_classes, k_values) for train, test in splits]
+
+    per_k = {}
+    for k in k_values:
+        accuracy, f1 = np.array([scores[k] for scores, _, _ in folds]).T
+        per_k[k] = {
+            "accuracy": float(accuracy.mean()),
+            "accuracy_std": float(accuracy.std()),
+            "f1_score": float(f1.mean()),
+            "f1_score_std": float(f1.std()),
+        }
+    recommended_k = max(k_values, key=lambda k: (round(per_k[k]["f1_score"], 6), -k))
+    genuine = np.concatenate([genuine for _, genuine, _ in folds])
+    impostor = np.concatenate([impostor for _, _, impostor in folds])
+    return {
+        "n_splits": n_splits,
+        "threads": min(threads, n_splits),
+        "k_values": {str(k): scores for k, scores in per_k.items()},
+        "recommended_k": recommended_k,
+        "verification": verification_report(genuine, impostor, distance_thresholds, target_far),
+    }
@@ -0,0 +1,276 @@
+"""
+Export bobot FaceNet dari DeepFace ke ONNX (opsional int8) untuk
+OnnxFacenetEmbedder, dan cek apakah embedding-nya mengubah keputusan
+recognition dibanding jalur DeepFace.
+
+Usage:
+    python export_facenet.py export [--quantize none|dynamic|static] [--output models/facenet.onnx]
+    python export_facenet.py check [--model models/facenet.onnx] [--images N] [--output report.json]
+
+Kuantisasi static memakai crop wajah dari Backend/dataset sebagai data
+kalibrasi. Setelah export, jalankan `check`; bila keputusan sama, aktifkan
+dengan FACE_EMBEDDER_BACKEND=onnx (dan FACE_EMBEDDER_ONNX_PATH untuk model int8).
+
+Dependency tambahan (tidak dibutuhkan oleh server default): tf2onnx untuk
+export, onnxruntime untuk kuantisasi dan inferensi.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "models")
+DEFAULT_OUTPUTS = {
+    "none": os.path.join(MODEL_DIR, "facenet.onnx"),
+    "dynamic": os.path.join(MODEL_DIR, "facenet.int8.onnx"),
+    "static": os.path.join(MODEL_DIR, "facenet.int8.onnx"),
+}
+ONNX_OPSET = 13
+CALIBRATION_IMAGES = 200
+
+
+def load_face_api():
+    # Import lazily: face_api pulls in Flask, the blob store and the detector config
+    import face_api
+
+    return face_api
+
+
+def dataset_crops(face_api, limit=None):
+    """(nim, raw face crop) for every dataset image with a detectable face"""
+    from io import BytesIO
+    from benchmark import dataset_images
+
+    crops = []
+    for nim, filename, data in dataset_images(limit):
+        img_array = face_api.decode_upload(BytesIO(data))
+        face = face_api.detect_and_crop_face(img_array)
+        if face is None:
+            print(f"[WARNING] No face detected in {nim}/{filename}, skipping")
+            continue
+        crops.append((nim, face))
+    return crops
+
+
+def export_float(output):
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    client = DeepFace.build_model("Facenet")
+    model = getattr(client, "model", client)
+    height, width = model.input_shape[1:3]
+    signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=ONNX_OPSET, output_path=output)
+    print(f"[EXPORT] Wrote float32 FaceNet ({height}x{width}) to {output}")
+
+
+def quantize(float_path, output, mode, face_api=None):
+    try:
+        # Shape inference and graph cleanup recommended before quantization
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        _quantize(float_path, output, mode, face_api)
+        return
+    prepared = float_path + ".prep.onnx"
+    # Symbolic shape inference only matters for transformer graphs
+    quant_pre_process(float_path, prepared, skip_symbolic_shape=True)
+    try:
+        _quantize(prepared, output, mode, face_api)
+    finally:
+        os.remove(prepared)
+
+
+def _quantize(float_path, output, mode, face_api):
+    import onnxruntime as ort
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    )
+
+    if mode == "dynamic":
+        quantize_dynamic(float_path, output, weight_type=QuantType.QInt8)
+        print(f"[EXPORT] Wrote dynamically quantized int8 FaceNet to {output}")
+        return
+
+    from face_embedder import FacenetEmbedder
+
+    preprocess = FacenetEmbedder(normalize=True).preprocess
+    crops = [face for _, face in dataset_crops(face_api or load_face_api(), CALIBRATION_IMAGES)]
+    if not crops:
+        raise ValueError("Static quantization needs face images in Backend/dataset for calibration")
+    input_name = ort.InferenceSession(float_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class CropReader(CalibrationDataReader):
+        def __init__(self):
+            self._inputs = iter({input_name: preprocess(face)[None]} for face in crops)
+
+        def get_next(self):
+            return next(self._inputs, None)
+
+    quantize_static(float_path, output, CropReader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8)
+    print(f"[EXPORT] Wrote int8 FaceNet calibrated on {len(crops)} faces to {output}")
+
+
+def export(output, mode="none"):
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    if mode == "none":
+        export_float(output)
+        return
+    fd, float_path = tempfile.mkstemp(suffix=".onnx", dir=os.path.dirname(output))
+    os.close(fd)
+    try:
+        export_float(float_path)
+        quantize(float_path, output, mode)
+    finally:
+        os.remove(float_path)
+
+
+def _user_data(embeddings, labels, threshold_fn):
+    by_nim = defaultdict(list)
+    for embedding, nim in zip(embeddings, labels):
+        by_nim[nim].append(embedding)
+    return {
+        nim: {"avg_embedding": np.mean(rows, axis=0), "threshold": threshold_fn(np.array(rows))}
+        for nim, rows in by_nim.items()
+    }
+
+
+def _decision(result):
+    return bool(result.get("match")), result.get("predicted_label")
+
+
+def check(model_path, limit=None):
+    """
+    Bandingkan embedding OnnxFacenetEmbedder dengan DeepFace.represent
+    (normalize_face lalu extract_face_embedding) pada Backend/dataset.
+
+    Keputusan dicek dengan 2-fold per mahasiswa: index dibangun dari
+    embedding DeepFace separuh foto, lalu separuh lainnya dicocokkan dengan
+    embedding DeepFace dan embedding ONNX. Bila ada model yang sudah
+    dipublikasikan, semua foto juga dicocokkan ke index tersebut.
+    """
+    from embedding_index import EmbeddingIndex
+    from face_embedder import OnnxFacenetEmbedder
+
+    face_api = load_face_api()
+    crops = dataset_crops(face_api, limit)
+    if not crops:
+        raise ValueError("No faces found in Backend/dataset")
+    labels = [nim for nim, _ in crops]
+
+    started = time.perf_counter()
+    reference = [face_api.extract_raw_face_embedding(face) for _, face in crops]
+    reference_ms = (time.perf_counter() - started) * 1000 / len(crops)
+
+    candidate_embedder = OnnxFacenetEmbedder(model_path, normalize=True)
+    candidate_embedder.embed([crops[0][1]])  # Load the session outside the timing
+    started = time.perf_counter()
+    candidate = candidate_embedder.embed([face for _, face in crops])
+    candidate_ms = (time.perf_counter() - started) * 1000 / len(crops)
+
+    valid = [i for i in range(len(crops)) if reference[i] is not None and candidate[i] is not None]
+    ref = np.array([reference[i] for i in valid], dtype=np.float64)
+    cand = np.array([candidate[i] for i in valid], dtype=np.float64)
+    valid_labels = [labels[i] for i in valid]
+    cosine = np.sum(ref * cand, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1))
+
+    report = {
+        "model": model_path,
+        "faces": len(crops),
+        "embedded": len(valid),
+        "reference_ms_per_face": round(reference_ms, 3),
+        "candidate_ms_per_face": round(candidate_ms, 3),
+        "cosine_similarity": {
+            "mean": float(np.mean(cosine)),
+            "min": float(np.min(cosine)),
+            "p1": float(np.percentile(cosine, 1)),
+        },
+    }
+
+    # 2-fold split per student: even photos vs odd photos
+    positions = defaultdict(list)
+    for row, nim in enumerate(valid_labels):
+        positions[nim].append(row)
+    folds = [[], []]
+    for rows in positions.values():
+        if len(rows) < 2:
+            continue
+        for j, row in enumerate(rows):
+            folds[j % 2].append(row)
+
+    compared = agreed = 0
+    disagreements = []
+    for fold in range(2):
+        gallery, queries = folds[1 - fold], folds[fold]
+        if not gallery or not queries:
+            continue
+        gallery_labels = [valid_labels[row] for row in gallery]
+        user_data = _user_data(ref[gallery], gallery_labels, face_api.calculate_dynamic_threshold)
+        index = EmbeddingIndex.build(ref[gallery], gallery_labels, user_data,
+                                     face_api.get_optimal_k(len(user_data)))
+        for row in queries:
+            expected, actual = _decision(index.match(ref[row])), _decision(index.match(cand[row]))
+            compared += 1
+            if expected == actual:
+                agreed += 1
+            else:
+                disagreements.append({"nim": valid_labels[row], "deepface": expected, "onnx": actual})
+    report["cross_validation"] = {
+        "queries": compared,
+        "decision_agreement": agreed / compared if compared else None,
+        "disagreements": disagreements,
+    }
+
+    bundle = face_api.model_registry.get()
+    if bundle is not None and len(bundle.index):
+        decisions = [(_decision(bundle.index.match(r)), _decision(bundle.index.match(c))) for r, c in zip(ref, cand)]
+        report["published_model"] = {
+            "version": bundle.version,
+            "decision_agreement": sum(a == b for a, b in decisions) / len(decisions),
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export FaceNet to ONNX and check it against DeepFace")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export (and optionally quantize) the FaceNet weights")
+    export_parser.add_argument("--quantize", choices=sorted(DEFAULT_OUTPUTS), default="none")
+    export_parser.add_argument("--output", default=None)
+
+    check_parser = commands.add_parser("check", help="Compare ONNX embeddings and decisions with DeepFace")
+    check_parser.add_argument("--model", default=DEFAULT_OUTPUTS["none"])
+    check_parser.add_argument("--images", type=int, default=None, help="Use at most this many dataset images")
+    check_parser.add_argument("--min-agreement", type=float, default=1.0,
+                              help="Exit with status 1 below this decision agreement")
+    check_parser.add_argument("--output", default=None, help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export(args.output or DEFAULT_OUTPUTS[args.quantize], args.quantize)
+        return 0
+
+    report = check(args.model, args.images)
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"[CHECK] Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    agreements = [report["cross_validation"]["decision_agreement"],
+                  report.get("published_model", {}).get("decision_agreement")]
+    return 1 if any(a is not None and a < args.min_agreement for a in agreements) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,49 @@
 import os
 import json
+import logging
+import time
+
+_import_started = time.perf_counter()
+
 import numpy as np
 from PIL import Image
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from mtcnn import MTCNN
-import mediapipe as mp
 import cv2
 import traceback
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
-from scipy.spatial.distance import cosine, euclidean
 from collections import defaultdict
-import joblib
-import matplotlib.pyplot as plt
-import seaborn as sns
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
-from deepface import DeepFace
 
 from flask_cors import CORS, cross_origin
 
-import firebase_admin
-from firebase_admin import credentials, storage
 from io import BytesIO
-import tempfile
+
+from blob_store import FirebaseBlobStore, LocalBlobStore
+from batch_scheduler import MicroBatcher, QueueFullError
+from embedding_cache import EmbeddingCache
+from embedding_index import EmbeddingIndex, VERIFY_THRESHOLD_RATIO
+from embedding_store import compact_store, load_store, migrate_legacy_layout, put_store_delta, update_store
+from evaluation import NeighbourGraph, cross_validate, evaluate
+from face_detection import FaceDetectionPipeline, create_backend, normalize_face
+from face_embedder import FacenetEmbedder, OnnxFacenetEmbedder
+from image_ingest import ImageTooLargeError, load_image
+from job_runner import JOB_SUCCEEDED, JobRunner, SharedJobState
+from lazy_loader import LazyResource, print_startup_report, record_timing, startup_report
+from metrics import MetricsRegistry
+from model_registry import ModelRegistry
+from registration_pipeline import SKIPPED_MAX_REACHED, RegistrationPipeline
+from roster_index import RosterIndexCache, RosterStore, parse_roster
+from video_registration import FrameSelector, PoseEstimator, iter_video_frames
+from threshold_calibration import (
+    CALIBRATION_STRATEGIES, calibrate_thresholds, intra_class_distance_stats, mean_std_thresholds
+)
+
+# Per-request debug output is opt-in: FACE_API_LOG_LEVEL=DEBUG
+LOG_LEVEL = os.environ.get("FACE_API_LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger("face_api")
 
 # Flask setup
 app = Flask(__name__)
@@ -44,26 +62,76 @@ os.makedirs(MODEL_DIR, exist_ok=True)
 os.makedirs(EMBEDDING_DIR, exist_ok=True)
 os.makedirs(TRAINING_LOGS_DIR, exist_ok=True)
 
-cred = credentials.Certificate(os.path.join(BASE_DIR, "lib", "serviceAccountKey.json"))
-firebase_admin.initialize_app(cred, {
-    'storageBucket': 'tugas-akhir-c22c5.appspot.com'
-})
+# Set FACE_API_BLOB_STORE_DIR to run against a local directory instead of Firebase
+LOCAL_BLOB_STORE_DIR = os.environ.get("FACE_API_BLOB_STORE_DIR")
+BLOB_IO_WORKERS = 16  # Concurrent bucket uploads/downloads
 
-bucket = storage.bucket()
+if LOCAL_BLOB_STORE_DIR:
+    blob_store = LocalBlobStore(LOCAL_BLOB_STORE_DIR, max_workers=BLOB_IO_WORKERS)
+else:
+    def _init_firebase_bucket():
+        import firebase_admin
+        from firebase_admin import credentials, storage
+
+        cred = credentials.Certificate(os.path.join(BASE_DIR, "lib", "serviceAccountKey.json"))
+        firebase_admin.initialize_app(cred, {
+            'storageBucket': 'tugas-akhir-c22c5.appspot.com'
+        })
+        return storage.bucket()
+
+    # Firebase baru di-inisialisasi saat bucket pertama kali diakses
+    firebase_bucket = LazyResource("firebase", _init_firebase_bucket)
+    blob_store = FirebaseBlobStore(bucket_factory=firebase_bucket.get, max_workers=BLOB_IO_WORKERS)
 
 TMP_DIR = os.path.join(BASE_DIR, "tmp")
 os.makedirs(TMP_DIR, exist_ok=True)
 
-# Load face detectors
-detector = MTCNN()
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    static_image_mode=True,
-    max_num_faces=1,
-    refine_landmarks=True,
-    min_detection_confidence=0.5
+# Local memory-mapped copies of the packed embedding store and index
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Face detection configuration
+# Backend: "mtcnn", "mediapipe" or "opencv_dnn" (override with FACE_DETECTOR_BACKEND)
+FACE_DETECTOR_BACKEND = os.environ.get("FACE_DETECTOR_BACKEND", "mtcnn")
+# Frames larger than this are downscaled for detection only; crops come from full resolution (0 = off)
+FACE_DETECTION_MAX_SIDE = int(os.environ.get("FACE_DETECTION_MAX_SIDE", "640"))
+FACE_CROP_MARGIN = 0.2
+
+# Uploaded images: JPEGs are decoded at reduced scale (DCT scaling) with the longer side kept
+# at least INGEST_MAX_SIDE, twice the detection size so crops keep their detail
+INGEST_MAX_SIDE = int(os.environ.get("FACE_API_INGEST_MAX_SIDE", "1280"))  # 0 = always decode full size
+INGEST_MAX_BYTES = 15 * 1024 * 1024  # Larger uploads are rejected before decoding
+INGEST_MAX_PIXELS = 40_000_000  # Decompression-bomb guard, checked from the image header
+
+# Face detectors are built on first use (or by warm_up()), not at import time.
+# Crops stay raw: the embedder fuses normalize_face into its preprocessing, and only
+# crops that are uploaded to the dataset are normalized on their own
+face_detector = FaceDetectionPipeline(
+    create_backend(FACE_DETECTOR_BACKEND),
+    max_side=FACE_DETECTION_MAX_SIDE or None,
+    margin=FACE_CROP_MARGIN,
+    normalize=False
 )
 
+# FaceNet runtime: "keras" (DeepFace weights in TensorFlow) or "onnx" (exported with
+# export_facenet.py, optionally int8; override with FACE_EMBEDDER_BACKEND / FACE_EMBEDDER_ONNX_PATH)
+FACE_EMBEDDER_BACKEND = os.environ.get("FACE_EMBEDDER_BACKEND", "keras")
+FACE_EMBEDDER_ONNX_PATH = os.environ.get("FACE_EMBEDDER_ONNX_PATH", os.path.join(MODEL_DIR, "facenet.onnx"))
+
+def _build_face_mesh():
+    import mediapipe as mp
+
+    return mp.solutions.face_mesh.FaceMesh(
+        static_image_mode=True,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5
+    )
+
+face_mesh = LazyResource("mediapipe_face_mesh", _build_face_mesh)
+# One estimator for every stream: its lock is what keeps concurrent requests off the shared FaceMesh
+pose_estimator = PoseEstimator(face_mesh)
+
 # Landmark indices for specific facial features
 LANDMARK_INDICES = {
     'eyebrows': [70, 63, 105, 66, 107, 336, 296, 334, 293, 300],  # 5 per eyebrow
@@ -76,9 +144,90 @@ LANDMARK_INDICES = {
 # Threshold configuration
 DEFAULT_THRESHOLD = 0.85
 UNKNOWN_THRESHOLD_MULTIPLIER = 1.2  # Multiplier for unknown detection
+THRESHOLD_STD_MULTIPLIER = 1.5  # threshold = mean + 1.5 * std of intra-class distances
+
+# Training evaluation (see evaluation.py): hold-out metrics, plus opt-in stratified k-fold
+# cross-validation of every candidate k with the folds in parallel threads
+TRAINING_CV_FOLDS = int(os.environ.get("FACE_API_TRAINING_CV_FOLDS", "0"))  # 0 = only when /train-model asks for it
+TRAINING_CV_REQUEST_FOLDS = 5  # Folds used when a request enables cross-validation (cv=true or k=auto)
+TRAINING_CV_K_VALUES = (1, 3, 4, 5, 6, 8, 10, 12)  # Scored next to get_optimal_k()
+TRAINING_CV_THREADS = int(os.environ.get("FACE_API_TRAINING_CV_THREADS", "0"))  # 0 = one per fold, up to the worker's cores
+TRAINING_TARGET_FAR = 0.001  # False accept rate used to suggest a verification threshold
+TRAINING_LEASE_TTL = float(os.environ.get("FACE_API_TRAINING_LEASE_TTL", "3600"))  # Seconds without progress before other workers drop a training lease
+
+# Model cache configuration
+MODEL_REFRESH_INTERVAL = 30  # Seconds between checks for a newly published model
+
+# Cached per-roster sub-indexes (one per course/roster that is currently taking attendance)
+ROSTER_INDEX_CACHE_SIZE = 64
 
-def save_training_logs(metrics, class_names, confusion_mat, timestamp):
-    """Save training logs and visualizations to files"""
+# Approximate nearest-neighbour search for large indexes
+# Backend: "ivf" (built in), "hnsw" (needs hnswlib) or "exact" (override with FACE_API_ANN_BACKEND)
+ANN_BACKEND = os.environ.get("FACE_API_ANN_BACKEND", "ivf")
+ANN_MIN_EMBEDDINGS = 50000  # Smaller indexes use exact search
+ANN_NPROBE = 8  # IVF lists scanned per query; raise for recall, lower for latency (see benchmark.py --suites ann)
+ANN_HNSW_EF = 64  # HNSW search breadth
+
+# Precision of the embedding rows in the live index (centroids and thresholds stay float32):
+# "float32", "float16" (half the memory) or "pq" (product quantization, 16 bytes per
+# embedding, searched with asymmetric distances); compare with benchmark.py --suites storage.
+# float16 trades latency for memory: every match converts the rows back to float32, about
+# 2x slower than float32 on small indexes and ~7x at 40k embeddings (13 ms vs 1.8 ms)
+INDEX_STORAGE = os.environ.get("FACE_API_INDEX_STORAGE", "float32")
+INDEX_PQ_SUBSPACES = 16  # Bytes per embedding with "pq"; must divide the embedding size (128)
+INDEX_PQ_MIN_EMBEDDINGS = 4096  # Smaller indexes stay float32: too few rows to train the codebooks
+# Embedding store (training source of truth): "float32" or "float16", applied when registration
+# deltas are folded into the packed store (/compact-index, /train-model). float16 halves the
+# packed store download and memory map but costs a float32 conversion wherever rows are
+# read (training, and index rebuilds); keep float32 unless the store size is the bottleneck
+EMBEDDING_STORE_DTYPE = os.environ.get("FACE_API_EMBEDDING_STORE_DTYPE", "float32")
+
+# Recognition micro-batching configuration
+RECOGNITION_MAX_BATCH_SIZE = 8  # Max face crops embedded together (detection runs per request)
+RECOGNITION_MAX_WAIT_MS = 10  # Max time the first request waits for others to join
+RECOGNITION_MAX_QUEUE_SIZE = 256  # Requests beyond this get HTTP 503
+RECOGNITION_TIMEOUT = 30  # Seconds a request waits for its batch result
+
+# Near-duplicate frames (check-in retries) reuse the crop and embedding of the first request
+RECOGNITION_CACHE_MB = float(os.environ.get("FACE_API_RECOGNITION_CACHE_MB", "32"))  # 0 disables the cache
+RECOGNITION_CACHE_TTL = 15  # Seconds a cached frame stays valid
+RECOGNITION_CACHE_MAX_DISTANCE = 24  # Max differing bits (of 256) between frame hashes
+RECOGNITION_CACHE_MAX_PIXEL_DIFF = 1.0  # Max mean grayscale difference (0-255) between 32x32 thumbnails
+
+# Registration (/register-face)
+REGISTRATION_MAX_IMAGES = 20  # Good images used per registration; the rest are skipped
+REGISTRATION_MIN_IMAGES = 10
+REGISTRATION_DETECT_WORKERS = 4  # Images decoded and detected in parallel (shared by all requests)
+REGISTRATION_EMBED_BATCH_SIZE = 8
+
+# Classroom photos (/recognize-group): faces are small, so decode and detect at higher resolution
+GROUP_INGEST_MAX_SIDE = 4096
+GROUP_DETECTION_MAX_SIDE = 1600
+GROUP_MIN_FACE_SIZE = 40  # Smaller faces (full-resolution pixels) are too blurry to embed
+GROUP_MAX_FACES = 200
+
+# Streaming (video / frame sequence) registration
+STREAM_SAMPLE_FPS = 10  # Frames per second decoded from an uploaded video
+STREAM_MAX_FRAMES = 300  # Frames processed per registration at most
+STREAM_MAX_IMAGES = 20  # Frames selected for embedding
+STREAM_MIN_IMAGES = REGISTRATION_MIN_IMAGES
+# Larger video uploads are rejected with 413 instead of being read into memory
+STREAM_MAX_BYTES = int(os.environ.get("FACE_API_STREAM_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Size of the blank image used by warm_up() for the dummy inference
+FACE_WARMUP_SIZE = 160
+
+# Metrics exposed on /metrics
+metrics_registry = MetricsRegistry()
+STAGE_SECONDS = metrics_registry.histogram(
+    "face_api_stage_seconds", "Latency of each recognition stage", ["stage"])
+REQUEST_SECONDS = metrics_registry.histogram(
+    "face_api_request_seconds", "End-to-end request latency", ["endpoint"])
+RECOGNITION_RESULTS = metrics_registry.counter(
+    "face_api_recognitions_total", "Recognition requests by outcome", ["result"])
+
+def save_training_logs(metrics, class_names, confusion_mat, timestamp, render_plots=False):
+    """Save training logs to files; the plots are only rendered when `render_plots` is set"""
     try:
         # Create directory for this training session
         log_dir = os.path.join(TRAINING_LOGS_DIR, timestamp)
@@ -88,49 +237,11 @@ def save_training_logs(metrics, class_names, confusion_mat, timestamp):
         metrics_path = os.path.join(log_dir, "metrics.json")
         with open(metrics_path, 'w') as f:
             json.dump(metrics, f, indent=2)
-        
-        # Save confusion matrix visualization
-        plt.figure(figsize=(15, 15))
-        sns.heatmap(confusion_mat, annot=True, fmt='d', cmap='Blues', 
-                    xticklabels=class_names, yticklabels=class_names)
-        plt.title('Confusion Matrix')
-        plt.ylabel('True Label')
-        plt.xlabel('Predicted Label')
-        plt.xticks(rotation=90)
-        plt.yticks(rotation=0)
-        plt.tight_layout()
-        confusion_matrix_path = os.path.join(log_dir, "confusion_matrix.png")
-        plt.savefig(confusion_matrix_path)
-        plt.close()
-        
-        # Save precision-recall curve
-        plt.figure(figsize=(10, 8))
-        plt.plot(metrics['recall_list'], metrics['precision_list'], marker='.')
-        plt.xlabel('Recall')
-        plt.ylabel('Precision')
-        plt.title('Precision-Recall Curve')
-        plt.grid(True)
-        pr_curve_path = os.path.join(log_dir, "precision_recall_curve.png")
-        plt.savefig(pr_curve_path)
-        plt.close()
-        
-        # Save confidence distributions
-        plt.figure(figsize=(12, 6))
-        plt.subplot(1, 2, 1)
-        plt.hist(metrics['confidence_scores'], bins=20, alpha=0.7)
-        plt.title('Confidence Score Distribution')
-        plt.xlabel('Confidence')
-        plt.ylabel('Count')
-        
-        plt.subplot(1, 2, 2)
-        plt.scatter(metrics['confidence_scores'], metrics['precision_list'], alpha=0.5)
-        plt.title('Precision vs Confidence')
-        plt.xlabel('Confidence')
-        plt.ylabel('Precision')
-        plt.tight_layout()
-        confidence_path = os.path.join(log_dir, "confidence_distributions.png")
-        plt.savefig(confidence_path)
-        plt.close()
+
+        # Keep the confusion matrix so the plots can be rendered later
+        confusion_path = os.path.join(log_dir, "confusion_matrix.json")
+        with open(confusion_path, 'w') as f:
+            json.dump({"class_names": [str(c) for c in class_names], "matrix": np.asarray(confusion_mat).tolist()}, f)
         
         # Save metrics summary
         summary_path = os.path.join(log_dir, "summary.txt")
@@ -143,22 +254,84 @@ def save_training_logs(metrics, class_names, confusion_mat, timestamp):
             f.write(f"Precision (macro): {metrics['precision']:.4f}\n")
             f.write(f"Recall (macro): {metrics['recall']:.4f}\n")
             f.write(f"F1 Score (macro): {metrics['f1_score']:.4f}\n")
+            verification = metrics.get('verification')
+            if verification:
+                f.write(f"EER: {verification['eer']:.4f} at cosine distance {verification['eer_threshold']:.2f}\n")
+            cross_validation = metrics.get('cross_validation')
+            if cross_validation:
+                f.write(f"Cross-validated K ({cross_validation['n_splits']} folds): "
+                        f"{cross_validation['recommended_k']}\n")
             f.write("\nClass-wise metrics:\n")
             for i, class_name in enumerate(class_names):
                 f.write(f"{class_name}:\n")
                 f.write(f"  Precision: {metrics['class_precision'][i]:.4f}\n")
                 f.write(f"  Recall: {metrics['class_recall'][i]:.4f}\n")
                 f.write(f"  F1: {metrics['class_f1'][i]:.4f}\n")
+
+        if render_plots:
+            render_training_plots(log_dir)
         
         print(f"[TRAINING] Saved training logs to {log_dir}")
     except Exception as e:
         print(f"[ERROR] Failed to save training logs: {str(e)}")
 
-def normalize_face(face_img):
-    face_img = cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY)
-    face_img = cv2.equalizeHist(face_img)
-    face_img = cv2.normalize(face_img, None, 0, 255, cv2.NORM_MINMAX)
-    return cv2.cvtColor(face_img, cv2.COLOR_GRAY2RGB)
+def render_training_plots(log_dir):
+    """Render the confusion matrix, PR curve and confidence plots from a saved training log"""
+    import matplotlib
+    matplotlib.use("Agg")  # Rendered from worker threads, never shown
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    with open(os.path.join(log_dir, "metrics.json")) as f:
+        metrics = json.load(f)
+    with open(os.path.join(log_dir, "confusion_matrix.json")) as f:
+        confusion = json.load(f)
+    class_names = confusion["class_names"]
+    confusion_mat = np.array(confusion["matrix"])
+
+    # Save confusion matrix visualization
+    plt.figure(figsize=(15, 15))
+    sns.heatmap(confusion_mat, annot=True, fmt='d', cmap='Blues', 
+                xticklabels=class_names, yticklabels=class_names)
+    plt.title('Confusion Matrix')
+    plt.ylabel('True Label')
+    plt.xlabel('Predicted Label')
+    plt.xticks(rotation=90)
+    plt.yticks(rotation=0)
+    plt.tight_layout()
+    confusion_matrix_path = os.path.join(log_dir, "confusion_matrix.png")
+    plt.savefig(confusion_matrix_path)
+    plt.close()
+    
+    # Save precision-recall curve
+    plt.figure(figsize=(10, 8))
+    plt.plot(metrics['recall_list'], metrics['precision_list'], marker='.')
+    plt.xlabel('Recall')
+    plt.ylabel('Precision')
+    plt.title('Precision-Recall Curve')
+    plt.grid(True)
+    pr_curve_path = os.path.join(log_dir, "precision_recall_curve.png")
+    plt.savefig(pr_curve_path)
+    plt.close()
+    
+    # Save confidence distributions
+    plt.figure(figsize=(12, 6))
+    plt.subplot(1, 2, 1)
+    plt.hist(metrics['confidence_scores'], bins=20, alpha=0.7)
+    plt.title('Confidence Score Distribution')
+    plt.xlabel('Confidence')
+    plt.ylabel('Count')
+    
+    plt.subplot(1, 2, 2)
+    plt.scatter(metrics['thresholds'], metrics['precision_list'], alpha=0.5)
+    plt.title('Precision vs Confidence')
+    plt.xlabel('Confidence threshold')
+    plt.ylabel('Precision')
+    plt.tight_layout()
+    confidence_path = os.path.join(log_dir, "confidence_distributions.png")
+    plt.savefig(confidence_path)
+    plt.close()
+    return [confusion_matrix_path, pr_curve_path, confidence_path]
 
 def extract_face_embedding(face_img):
     """
@@ -167,6 +340,8 @@ def extract_face_embedding(face_img):
     Output: vektor embedding (128-dim) atau None jika gagal.
     """
     try:
+        from deepface import DeepFace
+
         # Gunakan FaceNet sebagai model
         result = DeepFace.represent(
             img_path=face_img,
@@ -187,71 +362,102 @@ def extract_face_embedding(face_img):
         print(f"[ERROR] Failed to extract face embedding: {e}")
         return None
 
+def extract_raw_face_embedding(face_img):
+    """extract_face_embedding for a raw (not yet normalized) face crop"""
+    return extract_face_embedding(normalize_face(face_img))
+
+if FACE_EMBEDDER_BACKEND == "onnx":
+    face_embedder = OnnxFacenetEmbedder(FACE_EMBEDDER_ONNX_PATH, fallback=extract_raw_face_embedding,
+                                        normalize=True)
+else:
+    face_embedder = FacenetEmbedder(fallback=extract_raw_face_embedding, normalize=True)
+
+def detect_and_crop_face(img_array):
+    """Detect the largest face and crop it with a 20% margin (not normalized)"""
+    return face_detector.detect_and_crop(img_array).face
+
+recognition_cache = EmbeddingCache(max_bytes=int(RECOGNITION_CACHE_MB * 1024 * 1024),
+                                   ttl=RECOGNITION_CACHE_TTL, max_distance=RECOGNITION_CACHE_MAX_DISTANCE,
+                                   max_pixel_diff=RECOGNITION_CACHE_MAX_PIXEL_DIFF)
+
+def recognize_batch(face_imgs):
+    """
+    Batch function for the recognition scheduler: embed the face crops of
+    concurrent requests in one FaceNet pass. Detection stays on the request
+    threads (see detect_for_recognition), so it still runs in parallel.
+    """
+    with STAGE_SECONDS.time(stage="embed_batch"):
+        return face_embedder.embed(face_imgs)
+
+def detect_for_recognition(img_array):
+    """
+    Detect and crop the face of a recognition request on the calling thread.
+    Returns (face_img, features, cache_key): features is already set when the
+    frame is a near duplicate of a recent request in recognition_cache.
+    """
+    key = None
+    if recognition_cache.enabled:
+        with STAGE_SECONDS.time(stage="frame_hash"):
+            key = recognition_cache.key(img_array)
+        hit = recognition_cache.get(key)
+        if hit is not None:
+            return hit[0], hit[1], key
+    result = face_detector.detect_and_crop(img_array)
+    for stage, ms in result.timings.items():
+        STAGE_SECONDS.observe(ms / 1000, stage=stage)
+    return result.face, None, key
+
+recognition_batcher = MicroBatcher(
+    recognize_batch,
+    max_batch_size=RECOGNITION_MAX_BATCH_SIZE,
+    max_wait_ms=RECOGNITION_MAX_WAIT_MS,
+    max_queue_size=RECOGNITION_MAX_QUEUE_SIZE,
+    name="recognition-batcher"
+)
+
+registration_executor = ThreadPoolExecutor(max_workers=REGISTRATION_DETECT_WORKERS,
+                                           thread_name_prefix="register-detect")
+
+def decode_upload(stream, max_side=INGEST_MAX_SIDE):
+    """Uploaded image -> RGB uint8 array, raising ImageTooLargeError for oversized uploads"""
+    return load_image(stream, max_side=max_side or None, max_bytes=INGEST_MAX_BYTES,
+                      max_pixels=INGEST_MAX_PIXELS)
+
+def _decode_and_detect(image):
+    return detect_and_crop_face(decode_upload(image.stream))
+
 def calculate_dynamic_threshold(embeddings):
     """Calculate dynamic threshold based on average distances between embeddings"""
     if len(embeddings) < 2:
         return DEFAULT_THRESHOLD
-    
-    distances = []
-    for i in range(len(embeddings)):
-        for j in range(i+1, len(embeddings)):
-            # Pastikan embeddings[i] dan embeddings[j] adalah numpy array 1D
-            emb1 = np.array(embeddings[i]).flatten()
-            emb2 = np.array(embeddings[j]).flatten()
-            dist = cosine(emb1, emb2)
-            distances.append(dist)
-    
-    if not distances:
-        return DEFAULT_THRESHOLD
-    
-    mean_dist = np.mean(distances)
-    std_dist = np.std(distances)
-    
+
+    means, stds, _ = intra_class_distance_stats(np.asarray(embeddings).reshape(len(embeddings), -1),
+                                                [0, len(embeddings)])
+
     # Dynamic threshold formula
-    threshold = mean_dist + (std_dist * 1.5)
-    return max(threshold, DEFAULT_THRESHOLD)
+    threshold = mean_std_thresholds(means, stds, THRESHOLD_STD_MULTIPLIER, floor=DEFAULT_THRESHOLD,
+                                    default=DEFAULT_THRESHOLD)[0]
+    return float(threshold)
 
 def save_embeddings(nim, embeddings):
-    # Simpan embeddings array
-    emb_buffer = BytesIO()
-    np.save(emb_buffer, embeddings)
-    emb_buffer.seek(0)
-    blob = bucket.blob(f"embeddings/{nim}.npy")
-    blob.upload_from_file(emb_buffer, content_type='application/octet-stream')
-
-    # Simpan threshold
     threshold = calculate_dynamic_threshold(embeddings)
-    th_buffer = BytesIO()
-    np.save(th_buffer, threshold)
-    th_buffer.seek(0)
-    threshold_blob = bucket.blob(f"embeddings/threshold_{nim}.npy")
-    threshold_blob.upload_from_file(th_buffer, content_type='application/octet-stream')
-
-    # Simpan rata-rata embedding
     avg_embedding = np.mean(embeddings, axis=0)
-    avg_buffer = BytesIO()
-    np.save(avg_buffer, avg_embedding)
-    avg_buffer.seek(0)
-    avg_blob = bucket.blob(f"embeddings/avg_{nim}.npy")
-    avg_blob.upload_from_file(avg_buffer, content_type='application/octet-stream')
+
+    # Simpan embeddings, rata-rata embedding dan threshold sebagai delta kecil;
+    # /compact-index dan /train-model melipatnya ke embedding store
+    put_store_delta(blob_store, nim, embeddings, avg_embedding, threshold)
+
+    # Tambahkan langsung ke index yang sedang dipakai (tanpa /train-model)
+    try:
+        model_registry.enroll(nim, embeddings, avg_embedding, threshold)
+    except Exception as e:
+        print(f"[ERROR] Failed to enroll {nim} into the live index: {e}")
 
 
 
 
 def load_user_data():
-    user_data = {}
-    for blob in bucket.list_blobs(prefix="embeddings/"):
-        if blob.name.startswith("embeddings/avg_") and blob.name.endswith(".npy"):
-            nim = blob.name.split("/")[-1][4:-4]
-            avg_blob = bucket.blob(f"embeddings/avg_{nim}.npy")
-            threshold_blob = bucket.blob(f"embeddings/threshold_{nim}.npy")
-            avg_embedding = np.load(BytesIO(avg_blob.download_as_bytes()))
-            threshold = np.load(BytesIO(threshold_blob.download_as_bytes()))
-            user_data[nim] = {
-                "avg_embedding": avg_embedding,
-                "threshold": threshold
-            }
-    return user_data  # <-- PENTING!
+    return load_store(blob_store, CACHE_DIR).user_data()  # <-- PENTING!
 
 
 
@@ -270,6 +476,52 @@ def get_optimal_k(n_classes):
     else:
         # Untuk >25 label, gunakan rumus fleksibel
         return min(12, int(n_classes * 0.4))
+
+ann_config = None
+if ANN_BACKEND != "exact":
+    ann_config = {
+        "backend": ANN_BACKEND,
+        "min_embeddings": ANN_MIN_EMBEDDINGS,
+        "search": {"nprobe": ANN_NPROBE} if ANN_BACKEND == "ivf" else {"ef": ANN_HNSW_EF},
+    }
+
+storage_config = None
+if INDEX_STORAGE != "float32":
+    storage_config = {"backend": INDEX_STORAGE}
+    if INDEX_STORAGE == "pq":
+        storage_config.update(min_embeddings=INDEX_PQ_MIN_EMBEDDINGS, params={"n_subspaces": INDEX_PQ_SUBSPACES})
+
+model_registry = ModelRegistry(blob_store, refresh_interval=MODEL_REFRESH_INTERVAL, optimal_k=get_optimal_k,
+                               cache_dir=CACHE_DIR, ann=ann_config, storage=storage_config)
+
+metrics_registry.gauge("face_api_recognition_queue_depth", "Requests waiting for a recognition batch",
+                       lambda: recognition_batcher.stats()["queue_depth"])
+metrics_registry.gauge("face_api_model_cache_hit_ratio", "Share of model lookups served from memory",
+                       lambda: model_registry.stats()["cache_hit_rate"])
+metrics_registry.callback_counter("face_api_model_cache_hits_total", "Model lookups served from memory",
+                                 lambda: model_registry.stats()["cache_hits"])
+metrics_registry.callback_counter("face_api_model_loads_total", "Model bundles loaded from the bucket",
+                                 lambda: model_registry.stats()["loads"])
+metrics_registry.callback_counter("face_api_recognition_cache_hits_total", "Recognition frames answered from the embedding cache",
+                                 lambda: recognition_cache.stats()["hits"])
+metrics_registry.callback_counter("face_api_recognition_cache_misses_total", "Recognition frames not found in the embedding cache",
+                                 lambda: recognition_cache.stats()["misses"])
+metrics_registry.gauge("face_api_recognition_cache_bytes", "Memory held by the embedding cache",
+                       lambda: recognition_cache.stats()["bytes_used"])
+metrics_registry.gauge("face_api_index_classes", "Students in the live recognition index",
+                       lambda: model_registry.stats()["num_classes"])
+metrics_registry.gauge("face_api_index_bytes", "Memory held by the live index embeddings and centroids",
+                       lambda: model_registry.stats()["index_bytes"])
+
+# Course rosters restrict 1:N matching to the students expected in the room
+roster_store = RosterStore(blob_store, refresh_interval=MODEL_REFRESH_INTERVAL)
+roster_index_cache = RosterIndexCache(max_entries=ROSTER_INDEX_CACHE_SIZE, optimal_k=get_optimal_k)
+
+# Training runs one job at a time in the background (see /train-model/jobs).
+# Job state, dedupe and the running lease live in the blob store so every
+# serve.py worker sees the same jobs and never trains concurrently.
+training_jobs = JobRunner(max_workers=1, name="training",
+                          shared=SharedJobState(blob_store, lease_ttl=TRAINING_LEASE_TTL))
     
 @app.route("/register-face", methods=["POST"])
 @cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
@@ -284,69 +536,58 @@ def register_face():
     path = os.path.join(DATASET_DIR, nim)
     os.makedirs(path, exist_ok=True)
 
-    success_count = 0
-    failed_count = 0
+    uploads = []
+
+    def accept(i, image, face_img, features):
+        # Save the normalized face crop (upload runs in the background)
+        filename = f"{pose}_{len(uploads)+1}.jpg"
+        img_bytes = BytesIO()
+        Image.fromarray(normalize_face(face_img)).save(img_bytes, format='JPEG')
+        upload = blob_store.submit_put(f"dataset/{nim}/{filename}", img_bytes.getvalue(), 'image/jpeg')
+
+        entry = {"index": i+1, "filename": filename, "status": "success"}
+        uploads.append((upload, entry, image.filename, features))
+        return entry
+
+    # Decode/detect in parallel, embed in batches and upload asynchronously, in input order
+    pipeline = RegistrationPipeline(
+        _decode_and_detect,
+        face_embedder.embed,
+        registration_executor,
+        max_images=REGISTRATION_MAX_IMAGES,
+        embed_batch_size=REGISTRATION_EMBED_BATCH_SIZE,
+        window=REGISTRATION_DETECT_WORKERS
+    )
+    outcomes = pipeline.run(images, accept)
+
     feedback = []
-    embeddings = []
+    failed_count = 0
+    for i, (status, value) in enumerate(outcomes):
+        if status == "accepted":
+            feedback.append(value)
+            continue
+        if status == "error":
+            status = f"error: {str(value)}"
+        if status != SKIPPED_MAX_REACHED:
+            failed_count += 1
+        feedback.append({"index": i+1, "filename": images[i].filename, "status": status})
+    success_count = len(uploads)
 
-    for i, image in enumerate(images):
+    # Wait for the crop uploads; a failed upload does not count as a registered image
+    embeddings = []
+    for upload, entry, original_filename, features in uploads:
         try:
-            if success_count >= 20:  # Limit to 20 images
-                feedback.append({"index": i+1, "filename": image.filename, "status": "skipped_max_reached"})
-                continue
-
-            img = Image.open(image.stream)
-            img_array = np.array(img)
-            
-            # Detect face with MTCNN
-            results = detector.detect_faces(img_array)
-            if not results:
-                failed_count += 1
-                feedback.append({"index": i+1, "filename": image.filename, "status": "face_not_detected"})
-                continue
-                
-            # Get largest face
-            largest_face = max(results, key=lambda x: x['box'][2] * x['box'][3])
-            x, y, w, h = largest_face['box']
-            
-            # Add margin
-            margin = 0.2
-            x = max(0, x - int(w * margin))
-            y = max(0, y - int(h * margin))
-            w = min(img_array.shape[1] - x, w + int(w * margin * 2))
-            h = min(img_array.shape[0] - y, h + int(h * margin * 2))
-            
-            # Crop face
-            face_img = img_array[y:y+h, x:x+w]
-            face_img = normalize_face(face_img) 
-            
-            # Process with MediaPipe for landmarks
-            features = extract_face_embedding(face_img)
-            if features is None:
-                failed_count += 1
-                feedback.append({"index": i+1, "filename": image.filename, "status": "landmarks_not_detected"})
-                continue
-            
-            # Save the cropped face
-            filename = f"{pose}_{success_count+1}.jpg"
-            full_path = os.path.join(path, filename)
-            img_bytes = BytesIO()
-            Image.fromarray(face_img).save(img_bytes, format='JPEG')
-            blob = bucket.blob(f"dataset/{nim}/{filename}")
-            blob.upload_from_string(img_bytes.getvalue(), content_type='image/jpeg')
-            
-            # Store features
+            upload.result()
             embeddings.append(features)
-            success_count += 1
-            feedback.append({"index": i+1, "filename": filename, "status": "success"})
-            
         except Exception as e:
+            success_count -= 1
             failed_count += 1
-            feedback.append({"index": i+1, "filename": image.filename, "status": f"error: {str(e)}"})
+            entry["filename"] = original_filename
+            entry["status"] = f"error: {str(e)}"
 
-    if success_count < 10:  # Minimum 10 images required
+    if success_count < REGISTRATION_MIN_IMAGES:
         return jsonify({
-            "error": f"Minimum 10 images required (got {success_count})",
+            "error": f"Minimum {REGISTRATION_MIN_IMAGES} images required (got {success_count})",
             "details": feedback
         }), 400
 
@@ -360,289 +601,662 @@ def register_face():
         "details": feedback
     }), 200
 
-@app.route("/train-model", methods=["POST"])
+@app.route("/register-face/stream", methods=["POST"])
 @cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
-def train_model():
+def register_face_stream():
+    """
+    Registrasi dari video pendek (`video`) atau urutan frame (`frames`).
+    Wajah dilacak antar frame, lalu hanya frame yang tajam dan beragam
+    yang di-embed dan disimpan.
+    """
+    nim = request.form.get("nim")
+    pose = request.form.get("pose", "stream")
+    video = request.files.get("video")
+    frames = request.files.getlist("frames")
+
+    if not nim or (video is None and not frames):
+        return jsonify({"error": "Video/frames or NIM missing"}), 400
+
+    selector = FrameSelector(face_detector, pose_estimator=pose_estimator)
     try:
-        # Collect all user embeddings
-        user_data = load_user_data()
-        if not user_data:
-            return jsonify({"error": "No registered users found"}), 400
-            
-        # Prepare data for KNN
-        X = []
-        y = []
-        
-        for nim, data in user_data.items():
-            try:
-                blob = bucket.blob(f"embeddings/{nim}.npy")
-                if not blob.exists():
-                    print(f"[WARNING] embeddings/{nim}.npy not found in Firebase — skipping")
-                    continue
+        if video is not None:
+            # Read one byte past the limit to detect oversized uploads without buffering them whole
+            data = video.read(STREAM_MAX_BYTES + 1)
+            if len(data) > STREAM_MAX_BYTES:
+                return jsonify({"error": "Video too large",
+                                "details": f"The limit is {STREAM_MAX_BYTES} bytes"}), 413
+            for frame_index, frame in iter_video_frames(data, STREAM_SAMPLE_FPS, STREAM_MAX_FRAMES):
+                selector.add_frame(frame_index, frame)
+        else:
+            for frame_index, frame_file in enumerate(frames[:STREAM_MAX_FRAMES]):
+                try:
+                    selector.add_frame(frame_index, decode_upload(frame_file.stream))
+                except Exception as e:
+                    print(f"[WARNING] Skipping frame {frame_index}: {e}")
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Could not read video", "details": str(e)}), 400
 
-                embedding_data = np.load(BytesIO(blob.download_as_bytes()))
-                X.extend(embedding_data)
-                y.extend([nim] * len(embedding_data))
-            except Exception as e:
-                print(f"[ERROR] Failed to load embedding for {nim}: {e}")
+    selected = selector.select(STREAM_MAX_IMAGES)
+    crops = [candidate.crop for candidate in selected]
+    features = face_embedder.embed(crops)
 
+    feedback = []
+    uploads = []
+    for candidate, face_img, embedding in zip(selected, crops, features):
+        if embedding is None:
+            feedback.append({"frame": candidate.frame_index, "status": "landmarks_not_detected"})
+            continue
+        filename = f"{pose}_{len(uploads)+1}.jpg"
+        img_bytes = BytesIO()
+        Image.fromarray(normalize_face(face_img)).save(img_bytes, format='JPEG')
+        entry = {"frame": candidate.frame_index, "filename": filename, "status": "success",
+                 "sharpness": round(candidate.sharpness, 2)}
+        uploads.append((blob_store.submit_put(f"dataset/{nim}/{filename}", img_bytes.getvalue(), 'image/jpeg'),
+                        entry, embedding))
+        feedback.append(entry)
 
-        if len(X) < 10:  # At least 10 samples total
-            return jsonify({"error": "Not enough training data"}), 400
-            
-        # Encode labels
-        le = LabelEncoder()
-        y_encoded = le.fit_transform(y)
-        class_names = le.classes_
-        
-        # Train KNN model
-        X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2, random_state=42, stratify=y_encoded)
+    # A failed upload does not count as a registered image
+    embeddings = []
+    for upload, entry, embedding in uploads:
+        try:
+            upload.result()
+            embeddings.append(embedding)
+        except Exception as e:
+            entry["status"] = f"error: {str(e)}"
 
-        # Dapatkan nilai k berdasarkan jumlah label
-        n_classes = len(le.classes_)
-        optimal_k = get_optimal_k(n_classes)
-        
-        knn = KNeighborsClassifier(n_neighbors=optimal_k, weights='distance', metric='cosine')
-        knn.fit(X_train, y_train)
-        
-        # Evaluate
-        y_pred = knn.predict(X_test)
-        y_proba = knn.predict_proba(X_test)
-        confidence_scores = np.max(y_proba, axis=1)
-        
-        # Calculate metrics
-        accuracy = accuracy_score(y_test, y_pred)
-        precision = precision_score(y_test, y_pred, average='macro')
-        recall = recall_score(y_test, y_pred, average='macro')
-        f1 = f1_score(y_test, y_pred, average='macro')
-        
-        # Class-wise metrics
-        class_precision = precision_score(y_test, y_pred, average=None)
-        class_recall = recall_score(y_test, y_pred, average=None)
-        class_f1 = f1_score(y_test, y_pred, average=None)
-        
-        # Confusion matrix
-        confusion_mat = confusion_matrix(y_test, y_pred)
-        
-        # Precision-recall values for curve
-        precision_list = []
-        recall_list = []
-        thresholds = np.linspace(0, 1, 20)
-        for threshold in thresholds:
-            y_pred_thresh = np.where(y_proba.max(axis=1) >= threshold, y_proba.argmax(axis=1), -1)
-            mask = y_pred_thresh != -1
-            if sum(mask) > 0:
-                precision_list.append(precision_score(y_test[mask], y_pred_thresh[mask], average='macro'))
-                recall_list.append(recall_score(y_test[mask], y_pred_thresh[mask], average='macro'))
-            else:
-                precision_list.append(0)
-                recall_list.append(0)
-        
-        # Prepare metrics dictionary
-        metrics = {
-            'accuracy': accuracy,
-            'precision': precision,
-            'recall': recall,
-            'f1_score': f1,
-            'class_precision': class_precision.tolist(),
-            'class_recall': class_recall.tolist(),
-            'class_f1': class_f1.tolist(),
-            'num_classes': n_classes,
-            'optimal_k': optimal_k,
-            'confidence_scores': confidence_scores.tolist(),
-            'precision_list': precision_list,
-            'recall_list': recall_list,
-            'thresholds': thresholds.tolist()
-        }
-        
-        # Save model and label encoder
-        model_path = os.path.join(MODEL_DIR, "knn_model.pkl")
-        le_path = os.path.join(MODEL_DIR, "label_encoder.pkl")
-        
-        def upload_model_to_firebase(obj, path):
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                joblib.dump(obj, temp_file.name)
-                blob = bucket.blob(path)
-                blob.upload_from_filename(temp_file.name)
+    if len(embeddings) < STREAM_MIN_IMAGES:
+        return jsonify({
+            "error": f"Minimum {STREAM_MIN_IMAGES} images required (got {len(embeddings)})",
+            "details": feedback,
+            "selection": selector.stats()
+        }), 400
 
-        upload_model_to_firebase(knn, "models/knn_model.pkl")
-        upload_model_to_firebase(le, "models/label_encoder.pkl")
-        upload_model_to_firebase(user_data, "models/user_data.pkl")
+    save_embeddings(nim, embeddings)
 
-        
-        # Save user data (averages and thresholds)
-        user_data_path = os.path.join(MODEL_DIR, "user_data.pkl")
+    return jsonify({
+        "message": f"Registered {len(embeddings)} images for {nim}",
+        "uploaded_count": len(embeddings),
+        "skipped_count": selector.frames_seen - len(embeddings),
+        "details": feedback,
+        "selection": selector.stats()
+    }), 200
+
+def run_training(job, render_plots=False, k=None, cv_folds=TRAINING_CV_FOLDS):
+    """
+    Training KNN + evaluasi + publish index. Dijalankan oleh training_jobs
+    di background; job.report() menandai progress dan titik pembatalan.
+    `k` = None memakai get_optimal_k(), "auto" memakai k terbaik hasil
+    cross-validation. Cross-validation hanya jalan bila `cv_folds` > 0.
+    """
+    job.report(0.05, "loading_embeddings")
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.model_selection import train_test_split
+
+    # Deltas written before this point are covered by the full rebuild
+    folded_deltas = model_registry.pending_deltas()
 
+    # Collect all user embeddings, folding pending registrations into the packed store first
+    store, _ = compact_store(blob_store, EMBEDDING_STORE_DTYPE)
+    user_data = store.user_data()
+    if not user_data:
+        raise ValueError("No registered users found")
         
-        # Save training logs with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_training_logs(metrics, class_names, confusion_mat, timestamp)
+    # Prepare data for KNN
+    X, y = store.training_data()
+
+    if len(X) < 10:  # At least 10 samples total
+        raise ValueError("Not enough training data")
         
+    # Encode labels
+    le = LabelEncoder()
+    y_encoded = le.fit_transform(y)
+    class_names = le.classes_
+    
+    n_classes = len(le.classes_)
+
+    # Cross-validate the candidate k values (parallel folds) before choosing k
+    cross_validation = None
+    if cv_folds:
+        job.report(0.15, "cross_validation")
+        cross_validation = cross_validate(X, y_encoded, n_classes,
+                                          TRAINING_CV_K_VALUES + (get_optimal_k(n_classes),),
+                                          n_splits=cv_folds, threads=TRAINING_CV_THREADS or None,
+                                          target_far=TRAINING_TARGET_FAR)
+        cross_validation["verification"]["user_threshold_at_target_far"] = _user_threshold(
+            cross_validation["verification"]["threshold_at_target_far"])
+
+    # Dapatkan nilai k berdasarkan jumlah label (atau hasil cross-validation)
+    if k == "auto" and cross_validation is not None:
+        optimal_k = cross_validation["recommended_k"]
+    else:
+        optimal_k = int(k) if k not in (None, "auto") else get_optimal_k(n_classes)
+
+    # Train KNN model
+    job.report(0.3, "fitting")
+    X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2, random_state=42, stratify=y_encoded)
+    
+    knn = KNeighborsClassifier(n_neighbors=optimal_k, weights='distance', metric='cosine')
+    knn.fit(X_train, y_train)
+    
+    # Evaluate: every metric comes from one neighbour graph of the hold-out set
+    job.report(0.5, "evaluating")
+    report = evaluate(NeighbourGraph.build(X_train, y_train, X_test, y_test, n_classes, optimal_k), optimal_k,
+                      target_far=TRAINING_TARGET_FAR)
+    report["verification"]["user_threshold_at_target_far"] = _user_threshold(
+        report["verification"]["threshold_at_target_far"])
+    accuracy, precision, recall, f1 = (report[key] for key in ("accuracy", "precision", "recall", "f1_score"))
+    confusion_mat = report["confusion_matrix"]
+    
+    # Prepare metrics dictionary
+    metrics = {
+        'accuracy': accuracy,
+        'precision': precision,
+        'recall': recall,
+        'f1_score': f1,
+        'class_precision': report['class_precision'].tolist(),
+        'class_recall': report['class_recall'].tolist(),
+        'class_f1': report['class_f1'].tolist(),
+        'num_classes': n_classes,
+        'optimal_k': optimal_k,
+        'confidence_scores': report['confidence_scores'].tolist(),
+        'precision_list': report['precision_list'].tolist(),
+        'recall_list': report['recall_list'].tolist(),
+        'thresholds': report['thresholds'].tolist(),
+        'verification': report['verification'],
+        'cross_validation': cross_validation
+    }
+    
+    # Last checkpoint: once publishing starts the job runs to completion
+    job.report(0.8, "publishing")
+    # Publish model, label encoder, user data and embedding index, then swap them into the cache
+    model_registry.publish(knn, le, user_data, EmbeddingIndex.from_model(knn, le, user_data),
+                           folded_deltas=folded_deltas)
+    
+    # Save training logs with timestamp
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    job.report(0.95, "saving_logs", checkpoint=False)
+    save_training_logs(metrics, class_names, confusion_mat, timestamp, render_plots=render_plots)
+    
+    return {
+        "message": "KNN model trained successfully",
+        "accuracy": accuracy,
+        "precision": precision,
+        "recall": recall,
+        "f1_score": f1,
+        "num_classes": n_classes,
+        "class_names": class_names.tolist(),
+        "optimal_k": optimal_k,
+        "recommended_k": cross_validation["recommended_k"] if cross_validation else None,
+        "eer": report["verification"]["eer"],
+        "threshold_at_target_far": report["verification"]["threshold_at_target_far"],
+        "log_timestamp": timestamp
+    }
+
+def _user_threshold(distance):
+    # Recognition accepts cosine_distance < user_threshold * VERIFY_THRESHOLD_RATIO
+    return distance / VERIFY_THRESHOLD_RATIO if distance is not None else None
+
+def _training_job_response(job, deduplicated=False):
+    response = job.to_dict()
+    response["deduplicated"] = deduplicated
+    response["status_url"] = f"/train-model/jobs/{job.id}"
+    return response
+
+@app.route("/train-model", methods=["POST"])
+@cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
+def train_model():
+    """
+    Jadwalkan training di background dan langsung balas 202 dengan job ID.
+    `plots=true` ikut me-render plot training log; `wait=true` menunggu
+    hasilnya seperti perilaku lama (200 / 400 / 500). `cv=true` menjalankan
+    cross-validation k-fold; `k=auto` (yang juga menyalakan cross-validation)
+    memakai k terbaik hasilnya, `k=<angka>` memaksa nilai k.
+    """
+    render_plots = request.form.get("plots", "false").lower() == "true"
+    wait = request.form.get("wait", "false").lower() == "true"
+    k = request.form.get("k") or None
+    if k is not None and k != "auto" and not (k.isdigit() and int(k) >= 1):
+        return jsonify({"error": "k must be 'auto' or a positive integer"}), 400
+    cv_folds = TRAINING_CV_FOLDS
+    if not cv_folds and (request.form.get("cv", "false").lower() == "true" or k == "auto"):
+        cv_folds = TRAINING_CV_REQUEST_FOLDS
+
+    # All training requests share one key: a queued job already covers newer requests
+    job, deduplicated = training_jobs.submit(
+        "train_model", lambda job: run_training(job, render_plots=render_plots, k=k, cv_folds=cv_folds), dedupe_key="train_model")
+
+    if not wait:
+        response = _training_job_response(job, deduplicated)
+        response["message"] = ("Training sudah dijadwalkan" if deduplicated else "Training dijadwalkan") + \
+            f", cek progress di {response['status_url']}"
+        return jsonify(response), 202
+
+    job.wait()
+    if job.status == JOB_SUCCEEDED:
+        return jsonify(job.result), 200
+    if job.error_type == "ValueError":
+        return jsonify({"error": job.error}), 400
+    return jsonify({
+        "error": "Model training failed",
+        "details": job.error or job.status,
+        "job_id": job.id
+    }), 500
+
+@app.route("/train-model/jobs", methods=["GET"])
+@cross_origin(origins="*", methods=["GET", "OPTIONS"], allow_headers="*")
+def list_training_jobs():
+    return jsonify({"jobs": [job.to_dict() for job in training_jobs.list()]}), 200
+
+@app.route("/train-model/jobs/<job_id>", methods=["GET"])
+@cross_origin(origins="*", methods=["GET", "OPTIONS"], allow_headers="*")
+def get_training_job(job_id):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_training_job_response(job)), 200
+
+@app.route("/train-model/jobs/<job_id>/cancel", methods=["POST"])
+@cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
+def cancel_training_job(job_id):
+    job = training_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_training_job_response(job)), 200
+
+@app.route("/training-logs/<timestamp>/plots", methods=["POST"])
+@cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
+def render_training_log_plots(timestamp):
+    log_dir = os.path.join(TRAINING_LOGS_DIR, os.path.basename(timestamp))
+    if not os.path.isfile(os.path.join(log_dir, "confusion_matrix.json")):
+        return jsonify({"error": "Training log not found"}), 404
+    try:
+        paths = render_training_plots(log_dir)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Rendering plots failed", "details": str(e)}), 500
+    return jsonify({"message": "Plots rendered", "files": [os.path.basename(path) for path in paths]}), 200
+
+@app.route("/migrate-embeddings", methods=["POST"])
+@cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
+def migrate_embeddings():
+    try:
+        delete_legacy = request.form.get("delete_legacy", "false").lower() == "true"
+        store, migrated = migrate_legacy_layout(blob_store, delete_legacy=delete_legacy)
         return jsonify({
-            "message": "KNN model trained successfully",
-            "accuracy": accuracy,
-            "precision": precision,
-            "recall": recall,
-            "f1_score": f1,
-            "num_classes": n_classes,
-            "class_names": class_names.tolist(),
-            "optimal_k": optimal_k,
-            "log_timestamp": timestamp
+            "message": f"Migrated {len(migrated)} students to the packed embedding store",
+            "migrated": migrated,
+            "num_students": len(store),
+            "num_embeddings": len(store.embeddings),
+            "legacy_deleted": delete_legacy
         }), 200
-        
     except Exception as e:
         traceback.print_exc()
         return jsonify({
-            "error": "Model training failed",
-            "details": str(e),
-            "traceback": traceback.format_exc()
+            "error": "Embedding migration failed",
+            "details": str(e)
+        }), 500
+
+@app.route("/recalibrate-thresholds", methods=["POST"])
+@cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
+def recalibrate_thresholds():
+    strategy = request.form.get("strategy", "mean_std")
+    if strategy not in CALIBRATION_STRATEGIES:
+        return jsonify({"error": f"Unknown strategy, expected one of {list(CALIBRATION_STRATEGIES)}"}), 400
+
+    try:
+        target_far = float(request.form.get("target_far", 0.001))
+        max_samples = request.form.get("max_samples_per_class")
+        max_samples = int(max_samples) if max_samples else None
+
+        summary = {}
+
+        def recalibrate(store):
+            thresholds, stats = calibrate_thresholds(
+                store.embeddings, store.offsets, store.centroids,
+                strategy=strategy,
+                std_multiplier=THRESHOLD_STD_MULTIPLIER,
+                floor=DEFAULT_THRESHOLD if strategy == "mean_std" else None,
+                default=DEFAULT_THRESHOLD,
+                target_far=target_far,
+                verify_ratio=VERIFY_THRESHOLD_RATIO,
+                max_samples_per_class=max_samples
+            )
+            summary["thresholds"] = {str(nim): float(t) for nim, t in zip(store.labels, thresholds)}
+            summary["intra_mean"] = float(np.nanmean(stats["intra_mean"])) if len(thresholds) else None
+            return store.with_thresholds(thresholds)
+
+        store = update_store(blob_store, recalibrate)
+
+        return jsonify({
+            "message": f"Recalibrated {len(store)} thresholds with '{strategy}'; run /train-model to publish them",
+            "strategy": strategy,
+            **summary
+        }), 200
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({
+            "error": "Threshold recalibration failed",
+            "details": str(e)
+        }), 500
+
+@app.route("/compact-index", methods=["POST"])
+@cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
+def compact_index():
+    try:
+        _, store_deltas = compact_store(blob_store, EMBEDDING_STORE_DTYPE)
+        folded = model_registry.pending_deltas()
+        bundle = model_registry.compact()
+        if bundle is None:
+            return jsonify({"error": "No registered users found"}), 400
+
+        return jsonify({
+            "message": "Index compacted successfully",
+            "folded_deltas": len(folded),
+            "folded_store_deltas": len(store_deltas),
+            "num_classes": bundle.index.num_classes,
+            "num_embeddings": len(bundle.index)
+        }), 200
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({
+            "error": "Index compaction failed",
+            "details": str(e)
         }), 500
 
 @app.route("/recognize-face", methods=["POST"])
 @cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
 def recognize_face():
+    with REQUEST_SECONDS.time(endpoint="recognize_face"):
+        return _recognize_face()
+
+def _recognize_face():
     if 'image' not in request.files:
         return jsonify({"error": "Image missing"}), 400
     
     image = request.files['image']
+    # Checked before any decoding or detection so a bad field costs nothing
+    try:
+        roster = _request_roster()
+    except ValueError as e:
+        RECOGNITION_RESULTS.inc(result="invalid_roster")
+        return jsonify({"error": "Invalid roster", "details": str(e)}), 400
     
     try:
-        print("[DEBUG] Starting face recognition process")
+        logger.debug("Starting face recognition process")
         
         # Load image
-        img = Image.open(image.stream)
-        img_array = np.array(img)
-        print("[DEBUG] Image loaded successfully")
+        try:
+            with STAGE_SECONDS.time(stage="decode"):
+                img_array = decode_upload(image.stream)
+        except ImageTooLargeError as e:
+            RECOGNITION_RESULTS.inc(result="too_large")
+            return jsonify({"error": "Image too large", "details": str(e)}), 413
+        logger.debug("Image loaded successfully - Size: %dx%d", img_array.shape[1], img_array.shape[0])
         
-        # Detect face with MTCNN
-        print("[DEBUG] Detecting face with MTCNN")
-        results = detector.detect_faces(img_array)
-        if not results:
-            print("[DEBUG] No faces detected")
+        # Detect on this thread, then embed together with other concurrent requests
+        logger.debug("Detecting face")
+        face_img, features, cache_key = detect_for_recognition(img_array)
+        if face_img is None:
+            logger.debug("No faces detected")
+            RECOGNITION_RESULTS.inc(result="no_face")
             return jsonify({"error": "No face detected"}), 400
-            
-        # Get largest face
-        largest_face = max(results, key=lambda x: x['box'][2] * x['box'][3])
-        x, y, w, h = largest_face['box']
-        print(f"[DEBUG] Face detected at ({x},{y}) with size {w}x{h}")
-        
-        # Add margin
-        margin = 0.2
-        x = max(0, x - int(w * margin))
-        y = max(0, y - int(h * margin))
-        w = min(img_array.shape[1] - x, w + int(w * margin * 2))
-        h = min(img_array.shape[0] - y, h + int(h * margin * 2))
-        print(f"[DEBUG] After margin - Position: ({x},{y}), Size: {w}x{h}")
-        
-        # Crop face
-        face_img = img_array[y:y+h, x:x+w]
-        face_img = normalize_face(face_img)
-        print("[DEBUG] Face cropped successfully")
-        
-        # Extract features
-        print("[DEBUG] Extracting facial landmarks")
-        features = extract_face_embedding(face_img)
+        logger.debug("Face cropped successfully - Size: %dx%d", face_img.shape[1], face_img.shape[0])
+
         if features is None:
-            print("[DEBUG] Failed to extract facial landmarks")
+            logger.debug("Extracting embedding (batched)")
+            try:
+                future = recognition_batcher.submit(face_img)
+            except QueueFullError:
+                logger.error("Recognition queue is full")
+                RECOGNITION_RESULTS.inc(result="busy")
+                return jsonify({"error": "Server busy, please retry"}), 503
+            try:
+                features = future.result(timeout=RECOGNITION_TIMEOUT)
+            except FutureTimeoutError:
+                # Drops the crop if it is still queued; a running batch just finishes without us
+                future.cancel()
+                logger.error("Recognition timed out after %ss", RECOGNITION_TIMEOUT)
+                RECOGNITION_RESULTS.inc(result="timeout")
+                return jsonify({"error": "Recognition timed out, please retry"}), 504
+            if features is not None and cache_key is not None:
+                recognition_cache.put(cache_key, face_img, features)
+
+        if features is None:
+            logger.debug("Failed to extract facial landmarks")
+            RECOGNITION_RESULTS.inc(result="no_embedding")
             return jsonify({"error": "Could not extract facial landmarks"}), 400
-        print(f"[DEBUG] Landmarks extracted - Feature vector length: {len(features)}")
+        logger.debug("Landmarks extracted - Feature vector length: %d", len(features))
             
         # Load model and user data
-        print("[DEBUG] Loading recognition models")
-        model_path = os.path.join(MODEL_DIR, "knn_model.pkl")
-        le_path = os.path.join(MODEL_DIR, "label_encoder.pkl")
-        user_data_path = os.path.join(MODEL_DIR, "user_data.pkl")
-        
-        if not os.path.exists(model_path):
-            print(f"[ERROR] Model not found at {model_path}")
+        with STAGE_SECONDS.time(stage="model_fetch"):
+            bundle = model_registry.get()
+        if bundle is None or len(bundle.index) == 0:
+            logger.error("No published model found")
+            RECOGNITION_RESULTS.inc(result="no_model")
             return jsonify({"error": "Model not trained yet"}), 404
-        if not os.path.exists(le_path):
-            print(f"[ERROR] Label encoder not found at {le_path}")
-            return jsonify({"error": "Label encoder missing"}), 404
-        if not os.path.exists(user_data_path):
-            print(f"[ERROR] User data not found at {user_data_path}")
-            return jsonify({"error": "User data missing"}), 404
-            
-        def load_model_from_firebase(path):
-            blob = bucket.blob(path)
-            return joblib.load(BytesIO(blob.download_as_bytes()))
 
-        knn = load_model_from_firebase("models/knn_model.pkl")
-        le = load_model_from_firebase("models/label_encoder.pkl")
-        user_data = load_model_from_firebase("models/user_data.pkl")
-
-        print("[DEBUG] Models loaded successfully")
+        index, scope = _scoped_index(bundle, roster)
         
-        # Get KNN prediction
-        print("[DEBUG] Making KNN prediction")
+        # Match against the embedding index (class vote + centroid verification)
         try:
-            distances, indices = knn.kneighbors([features], n_neighbors=5)
-            proba = knn.predict_proba([features])[0]
-            pred_class_idx = np.argmax(proba)
-            confidence = float(proba[pred_class_idx])  # Convert to Python float
-            pred_label = le.inverse_transform([pred_class_idx])[0]
-            print(f"[DEBUG] KNN prediction: {pred_label} with confidence {confidence:.2f}")
+            with STAGE_SECONDS.time(stage="match"):
+                response = index.match(features)
         except Exception as e:
-            print(f"[ERROR] KNN prediction failed: {str(e)}")
+            logger.error("Index matching failed: %s", e)
+            RECOGNITION_RESULTS.inc(result="error")
             return jsonify({"error": "Prediction failed", "details": str(e)}), 500
-        
-        # Verify against user data
-        print("[DEBUG] Verifying against user data")
-        try:
-            if pred_label not in user_data:
-                print(f"[ERROR] Predicted user {pred_label} not in user data")
-                return jsonify({
-                    "success": True,  # Changed to True since this is a valid result
-                    "match": False,
-                    "message": "Unknown user predicted"
-                }), 200
-                
-            user_threshold = float(user_data[pred_label]['threshold'])  # Convert to Python float
-            avg_embedding = user_data[pred_label]['avg_embedding']
-            
-            # Calculate distances
-            cosine_dist = float(cosine(features, avg_embedding))  # Convert to Python float
-            euclidean_dist = float(euclidean(features, avg_embedding))  # Convert to Python float
-            print(f"[DEBUG] Distances - Cosine: {cosine_dist:.2f}, Euclidean: {euclidean_dist:.2f}, Threshold: {user_threshold:.2f}")
-            
-            # Dynamic verification with stricter conditions
-            is_verified = bool(cosine_dist < (user_threshold * 0.8))  # Stricter threshold (80% of original)
-            
-            # Additional check - confidence must be > 0.7 and distance < threshold
-            is_verified = is_verified and (confidence > 0.85)
-            
-            print(f"[DEBUG] Verification result: {'MATCH' if is_verified else 'NO MATCH'}")
-            
-            response = {
-                "success": True,
-                "match": bool(is_verified),  # Convert to Python bool
-                "predicted_label": pred_label if is_verified else None,
-                "confidence": confidence,
-                "cosine_distance": cosine_dist,
-                "euclidean_distance": euclidean_dist,
-                "user_threshold": user_threshold,
-                "message": "Face recognized successfully" if is_verified else "Face not recognized"
-            }
-            
-            return jsonify(response), 200
-            
-        except Exception as e:
-            print(f"[ERROR] Verification failed: {str(e)}")
-            return jsonify({
-                "success": False,
-                "error": "Verification failed",
-                "details": str(e)
-            }), 500
+
+        if "cosine_distance" in response:
+            logger.debug("Distances - Cosine: %.2f, Euclidean: %.2f, Threshold: %.2f",
+                         response['cosine_distance'], response['euclidean_distance'], response['user_threshold'])
+            logger.debug("Confidence: %.2f", response['confidence'])
+        logger.debug("Verification result: %s", 'MATCH' if response['match'] else 'NO MATCH')
+        RECOGNITION_RESULTS.inc(result="match" if response['match'] else "no_match")
+        response["scope"] = scope
+
+        return jsonify(response), 200
             
     except Exception as e:
-        print(f"[CRITICAL] Unhandled exception: {str(e)}")
-        traceback.print_exc()
+        # The traceback goes to the server log only
+        logger.exception("Unhandled exception: %s", e)
+        RECOGNITION_RESULTS.inc(result="error")
         return jsonify({
             "success": False,
             "error": "Face recognition failed",
-            "details": str(e),
-            "traceback": traceback.format_exc()
+            "details": str(e)
+        }), 500
+
+@app.route("/recognize-group", methods=["POST"])
+@cross_origin(origins="*", methods=["POST", "OPTIONS"], allow_headers="*")
+def recognize_group():
+    with REQUEST_SECONDS.time(endpoint="recognize_group"):
+        return _recognize_group()
+
+def _recognize_group():
+    if 'image' not in request.files:
+        return jsonify({"error": "Image missing"}), 400
+    try:
+        roster = _request_roster()
+    except ValueError as e:
+        RECOGNITION_RESULTS.inc(result="invalid_roster")
+        return jsonify({"error": "Invalid roster", "details": str(e)}), 400
+
+    try:
+        try:
+            with STAGE_SECONDS.time(stage="decode"):
+                img_array = decode_upload(request.files['image'].stream, max_side=GROUP_INGEST_MAX_SIDE)
+        except ImageTooLargeError as e:
+            RECOGNITION_RESULTS.inc(result="too_large")
+            return jsonify({"error": "Image too large", "details": str(e)}), 413
+
+        # Every face in the photo, embedded in one batch
+        detections, timings = face_detector.detect_all_and_crop(
+            img_array, max_faces=GROUP_MAX_FACES, min_face_size=GROUP_MIN_FACE_SIZE,
+            max_side=GROUP_DETECTION_MAX_SIDE)
+        for stage, ms in timings.items():
+            STAGE_SECONDS.observe(ms / 1000, stage=stage)
+        logger.debug("Detected %d faces in group photo", len(detections))
+        if not detections:
+            RECOGNITION_RESULTS.inc(result="no_face")
+            return jsonify({"error": "No face detected"}), 400
+        with STAGE_SECONDS.time(stage="embed_batch"):
+            features = face_embedder.embed([detection.face for detection in detections])
+
+        with STAGE_SECONDS.time(stage="model_fetch"):
+            bundle = model_registry.get()
+        if bundle is None or len(bundle.index) == 0:
+            logger.error("No published model found")
+            RECOGNITION_RESULTS.inc(result="no_model")
+            return jsonify({"error": "Model not trained yet"}), 404
+
+        index, scope = _scoped_index(bundle, roster)
+
+        # Match all faces together; each student can be assigned to one face only
+        embedded = [i for i, embedding in enumerate(features) if embedding is not None]
+        with STAGE_SECONDS.time(stage="match_group"):
+            matches = index.match_group([features[i] for i in embedded]) if embedded else []
+        # duplicate_of refers to positions among the embedded faces; report face indices instead
+        results = dict(zip(embedded, matches))
+        for result in matches:
+            if "duplicate_of" in result:
+                result["duplicate_of"] = embedded[result["duplicate_of"]]
+
+        faces = []
+        for i, detection in enumerate(detections):
+            face = {
+                "face_index": i,
+                "box": [int(v) for v in detection.box],
+                "detection_confidence": detection.confidence,
+            }
+            face.update(results.get(i, {"success": False, "match": False,
+                                        "message": "Could not extract facial landmarks"}))
+            faces.append(face)
+        recognized = [face["predicted_label"] for face in faces if face["match"]]
+        for face in faces:
+            RECOGNITION_RESULTS.inc(result="match" if face["match"] else "no_match")
+
+        return jsonify({
+            "success": True,
+            "scope": scope,
+            "num_faces": len(faces),
+            "num_recognized": len(recognized),
+            "recognized": recognized,
+            "faces": faces
+        }), 200
+
+    except Exception as e:
+        # The traceback goes to the server log only
+        logger.exception("Unhandled exception: %s", e)
+        RECOGNITION_RESULTS.inc(result="error")
+        return jsonify({
+            "success": False,
+            "error": "Group recognition failed",
+            "details": str(e)
         }), 500
 
+def _scoped_index(bundle, roster):
+    """(index, scope): the roster sub-index when the request names a course or roster, else the global index"""
+    if roster:
+        roster_index = roster_index_cache.get(bundle, roster)
+        if roster_index is not None:
+            return roster_index, "roster"
+        logger.debug("No enrolled students in the roster, using the global index")
+    return bundle.index, "global"
+
+def _request_roster():
+    """
+    NIMs from the optional `roster` field, else from the roster of `course_id`.
+    Raises ValueError for a malformed `roster` field.
+    """
+    if request.form.get("roster"):
+        return parse_roster(request.form.get("roster"))
+    course_id = request.form.get("course_id")
+    if course_id:
+        try:
+            return list(roster_store.get(course_id) or [])
+        except ValueError as e:
+            logger.warning("Ignoring course roster: %s", e)
+    return []
+
+@app.route("/courses/<course_id>/roster", methods=["GET", "PUT"])
+@cross_origin(origins="*", methods=["GET", "PUT", "OPTIONS"], allow_headers="*")
+def course_roster(course_id):
+    try:
+        if request.method == "GET":
+            nims = roster_store.get(course_id)
+            if nims is None:
+                return jsonify({"error": "Roster not found"}), 404
+            return jsonify({"course_id": course_id, "nims": list(nims)}), 200
+
+        payload = request.get_json(silent=True) or {}
+        nims = parse_roster(payload.get("nims", request.form.get("nims")))
+        if not nims:
+            return jsonify({"error": "NIM list missing"}), 400
+        nims = roster_store.put(course_id, nims)
+
+        bundle = model_registry.get()
+        enrolled = set(str(c) for c in bundle.index.classes) if bundle else set()
+        return jsonify({
+            "message": f"Roster saved for {course_id}",
+            "course_id": course_id,
+            "num_students": len(nims),
+            "not_enrolled": [nim for nim in nims if nim not in enrolled]
+        }), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/recognize-face/stats", methods=["GET"])
+@cross_origin(origins="*", methods=["GET", "OPTIONS"], allow_headers="*")
+def recognize_face_stats():
+    stats = recognition_batcher.stats()
+    stats["detection"] = face_detector.stats()
+    stats["roster_index_cache"] = roster_index_cache.stats()
+    stats["embedding_cache"] = recognition_cache.stats()
+    return jsonify(stats), 200
+
+_warmed_up = False
+
+def warm_up():
+    """
+    Load the detector, FaceNet and the current index and run one dummy
+    inference, so the first real request does not pay for model loading.
+    Call once per worker before it accepts traffic.
+    """
+    global _warmed_up
+    dummy = np.zeros((FACE_WARMUP_SIZE, FACE_WARMUP_SIZE, 3), dtype=np.uint8)
+    steps = [
+        ("warmup_detection", lambda: face_detector.detect(dummy)),
+        ("warmup_embedding", lambda: face_embedder.embed([dummy])),
+        ("warmup_model_registry", model_registry.get),
+    ]
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"[WARNING] Warm-up step {name} failed: {e}")
+        record_timing(name, time.perf_counter() - started)
+    _warmed_up = True
+    print_startup_report()
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Under serve.py this merges the samples of every worker (see MetricsRegistry.share);
+    # with `python face_api.py` it is the single process' own registry
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/startup-report", methods=["GET"])
+@cross_origin(origins="*", methods=["GET", "OPTIONS"], allow_headers="*")
+def get_startup_report():
+    return jsonify({
+        "warmed_up": _warmed_up,
+        "components_ms": {name: round(seconds * 1000, 1) for name, seconds in startup_report().items()}
+    }), 200
+
+record_timing("face_api_import", time.perf_counter() - _import_started)
+
 if __name__ == "__main__":
+    warm_up()
     app.run(debug=False, use_reloader=False, port=8000)
\ No newline at end of file
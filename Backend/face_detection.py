@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from lazy_loader import LazyResource
+
+DETECTOR_BACKENDS = ("mtcnn", "mediapipe", "opencv_dnn")
+DETECTION_STAGES = ("downscale", "detect", "crop", "normalize")
+
+# OpenCV res10 SSD face detector (not shipped with the repo, see OpenCVDNNBackend)
+OPENCV_DNN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "face_detector")
+OPENCV_DNN_PROTOTXT = "deploy.prototxt"
+OPENCV_DNN_WEIGHTS = "res10_300x300_ssd_iter_140000.caffemodel"
+
+# box = (x, y, w, h) in pixels of the image passed to detect()
+FaceBox = namedtuple("FaceBox", ["box", "confidence"])
+# face is None when no face was found; timings are in milliseconds per stage
+DetectionResult = namedtuple("DetectionResult", ["face", "box", "confidence", "timings"])
+
+
+def normalize_face(face_img):
+    face_img = cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY)
+    face_img = cv2.equalizeHist(face_img)
+    face_img = cv2.normalize(face_img, None, 0, 255, cv2.NORM_MINMAX)
+    return cv2.cvtColor(face_img, cv2.COLOR_GRAY2RGB)
+
+
+def to_rgb(img_array):
+    """Grayscale / RGBA input -> 3-channel RGB uint8"""
+    img_array = np.asarray(img_array)
+    if img_array.ndim == 2:
+        return cv2.cvtColor(img_array, cv2.COLOR_GRAY2RGB)
+    if img_array.shape[2] == 4:
+        return cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
+    return img_array
+
+
+class MTCNNBackend:
+    name = "mtcnn"
+
+    def __init__(self, min_confidence=0.0):
+        self.min_confidence = min_confidence
+        self._model = LazyResource("mtcnn", self._build)
+
+    def _build(self):
+        from mtcnn import MTCNN
+
+        return MTCNN()
+
+    def detect(self, img_rgb):
+        return [
+            FaceBox(tuple(result["box"]), float(result["confidence"]))
+            for result in self._model.get().detect_faces(img_rgb)
+            if result["confidence"] >= self.min_confidence
+        ]
+
+
+class MediaPipeBackend:
+    """
+    MediaPipe BlazeFace. `model_selection` 0 is tuned for faces within ~2m of
+    the camera (selfie/attendance), 1 for faces further away.
+    """
+
+    name = "mediapipe"
+
+    def __init__(self, min_confidence=0.5, model_selection=0):
+        self.min_confidence = min_confidence
+        self.model_selection = model_selection
+        self._model = LazyResource("mediapipe_face_detection", self._build)
+        # MediaPipe solution graphs are not safe to call from several threads
+        self._lock = threading.Lock()
+
+    def _build(self):
+        import mediapipe as mp
+
+        return mp.solutions.face_detection.FaceDetection(
+            model_selection=self.model_selection,
+            min_detection_confidence=self.min_confidence
+        )
+
+    def detect(self, img_rgb):
+        height, width = img_rgb.shape[:2]
+        with self._lock:
+            results = self._model.get().process(np.ascontiguousarray(img_rgb))
+        faces = []
+        for detection in results.detections or []:
+            rel = detection.location_data.relative_bounding_box
+            box = (int(rel.xmin * width), int(rel.ymin * height), int(rel.width * width), int(rel.height * height))
+            faces.append(FaceBox(box, float(detection.score[0])))
+        return faces
+
+
+class OpenCVDNNBackend:
+    """
+    OpenCV res10 SSD (Caffe). The model files are not part of the repo;
+    download deploy.prototxt and res10_300x300_ssd_iter_140000.caffemodel
+    into `model_dir` (default Backend/models/face_detector).
+    """
+
+    name = "opencv_dnn"
+    input_size = (300, 300)
+    mean = (104.0, 177.0, 123.0)
+
+    def __init__(self, min_confidence=0.5, model_dir=OPENCV_DNN_DIR):
+        self.min_confidence = min_confidence
+        self.model_dir = model_dir
+        self._model = LazyResource("opencv_dnn_face_detector", self._build)
+        self._lock = threading.Lock()
+
+    def _build(self):
+        prototxt = os.path.join(self.model_dir, OPENCV_DNN_PROTOTXT)
+        weights = os.path.join(self.model_dir, OPENCV_DNN_WEIGHTS)
+        for path in (prototxt, weights):
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"OpenCV DNN face detector file missing: {path}")
+        return cv2.dnn.readNetFromCaffe(prototxt, weights)
+
+    def detect(self, img_rgb):
+        height, width = img_rgb.shape[:2]
+        img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+        blob = cv2.dnn.blobFromImage(cv2.resize(img_bgr, self.input_size), 1.0, self.input_size, self.mean)
+        net = self._model.get()
+        with self._lock:
+            net.setInput(blob)
+            detections = net.forward()[0, 0]
+
+        faces = []
+        for detection in detections:
+            confidence = float(detection[2])
+            if confidence < self.min_confidence:
+                continue
+            x1, y1, x2, y2 = np.clip(detection[3:7], 0.0, 1.0) * [width, height, width, height]
+            faces.append(FaceBox((int(x1), int(y1), int(x2 - x1), int(y2 - y1)), confidence))
+        return faces
+
+
+def create_backend(name, **kwargs):
+    backends = {
+        "mtcnn": MTCNNBackend,
+        "mediapipe": MediaPipeBackend,
+        "opencv_dnn": OpenCVDNNBackend,
+    }
+    if name not in backends:
+        raise ValueError(f"Unknown detector backend '{name}', expected one of {DETECTOR_BACKENDS}")
+    return backends[name](**kwargs)
+
+
+class FaceDetectionPipeline:
+    """
+    Deteksi wajah -> ambil wajah terbesar -> tambah margin -> crop -> normalize.
+
+    Dengan `max_side`, gambar yang lebih besar diperkecil dulu sebelum
+    deteksi; box dikembalikan ke resolusi asli sehingga crop tetap diambil
+    dari gambar full resolution. Waktu tiap tahap dicatat per panggilan
+    (DetectionResult.timings) dan diakumulasi untuk stats().
+    """
+
+    def __init__(self, backend, max_side=None, margin=0.2, normalize=True):
+        self.backend = backend
+        self.max_side = max_side
+        self.margin = margin
+        self.normalize = normalize
+        self._totals = dict.fromkeys(DETECTION_STAGES, 0.0)
+        self._calls = 0
+        self._faces_found = 0
+        self._stats_lock = threading.Lock()
+
+    def detect(self, img_array, timings=None, max_side=None):
+        """All face boxes in full-resolution pixel coordinates, largest first"""
+        img_rgb = to_rgb(img_array)
+        height, width = img_rgb.shape[:2]
+        max_side = max_side or self.max_side
+
+        started = time.perf_counter()
+        scale = 1.0
+        small = img_rgb
+        if max_side and max(height, width) > max_side:
+            scale = max_side / max(height, width)
+            small = cv2.resize(img_rgb, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        detect_started = time.perf_counter()
+        faces = self.backend.detect(small)
+        finished = time.perf_counter()
+
+        if timings is not None:
+            timings["downscale"] = (detect_started - started) * 1000
+            timings["detect"] = (finished - detect_started) * 1000
+
+        if scale != 1.0:
+            faces = [
+                FaceBox(tuple(int(round(v / scale)) for v in face.box), face.confidence)
+                for face in faces
+            ]
+        return sorted(faces, key=lambda face: face.box[2] * face.box[3], reverse=True)
+
+    def crop(self, img_array, box):
+        """Crop `box` plus the margin on every side, clamped to the image"""
+        x, y, w, h = box
+        x = max(0, x - int(w * self.margin))
+        y = max(0, y - int(h * self.margin))
+        w = min(img_array.shape[1] - x, w + int(w * self.margin * 2))
+        h = min(img_array.shape[0] - y, h + int(h * self.margin * 2))
+        return img_array[y:y+h, x:x+w]
+
+    def process_face(self, img_array, box, timings=None):
+        started = time.perf_counter()
+        face_img = self.crop(to_rgb(img_array), box)
+        cropped = time.perf_counter()
+        if self.normalize:
+            face_img = normalize_face(face_img)
+        if timings is not None:
+            timings["crop"] = (cropped - started) * 1000
+            timings["normalize"] = (time.perf_counter() - cropped) * 1000
+        return face_img
+
+    def detect_and_crop(self, img_array):
+        """Detect the largest face and return it cropped and normalized as a DetectionResult"""
+        timings = dict.fromkeys(DETECTION_STAGES, 0.0)
+        faces = self.detect(img_array, timings)
+        if not faces:
+            self._record(timings, found=False)
+            return DetectionResult(None, None, None, timings)
+
+        largest = faces[0]
+        face_img = self.process_face(img_array, largest.box, timings)
+        self._record(timings, found=True)
+        return DetectionResult(face_img, largest.box, largest.confidence, timings)
+
+    def detect_all_and_crop(self, img_array, max_faces=None, min_face_size=0, max_side=None):
+        """
+        Detect every face (largest first, at most `max_faces`, boxes smaller
+        than `min_face_size` pixels dropped) and return (list of
+        DetectionResult, timings). `max_side` overrides the detection size,
+        e.g. to find small faces in a classroom photo.
+        """
+        timings = dict.fromkeys(DETECTION_STAGES, 0.0)
+        faces = [face for face in self.detect(img_array, timings, max_side=max_side)
+                 if min(face.box[2], face.box[3]) >= min_face_size]
+        if max_faces is not None:
+            faces = faces[:max_faces]
+
+        results = []
+        for face in faces:
+            face_timings = {}
+            face_img = self.process_face(img_array, face.box, face_timings)
+            for stage, ms in face_timings.items():
+                timings[stage] += ms
+            results.append(DetectionResult(face_img, face.box, face.confidence, face_timings))
+        self._record(timings, found=bool(results))
+        return results, timings
+
+    def _record(self, timings, found):
+        with self._stats_lock:
+            self._calls += 1
+            self._faces_found += int(found)
+            for stage, ms in timings.items():
+                self._totals[stage] += ms
+
+    def stats(self):
+        with self._stats_lock:
+            calls = self._calls
+            return {
+                "backend": self.backend.name,
+                "max_side": self.max_side,
+                "calls": calls,
+                "faces_found": self._faces_found,
+                "avg_stage_ms": {
+                    stage: round(total / calls, 3) if calls else 0.0
+                    for stage, total in self._totals.items()
+                },
+            }
@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from lazy_loader import record_timing
+
+FACENET_INPUT_SIZE = (160, 160)
+# uint8 -> float32 model input, bit-identical to astype(np.float32) followed by / 255
+_IDENTITY = np.arange(256, dtype=np.float32)
+_UNIT_SCALE = _IDENTITY / np.float32(255.0)
+
+
+def resize_with_padding(img, target_size):
+    """
+    Resize keeping aspect ratio and zero-pad to `target_size` (h, w),
+    sama seperti preprocessing.resize_image di DeepFace.
+    """
+    factor = min(target_size[0] / img.shape[0], target_size[1] / img.shape[1])
+    dsize = (int(img.shape[1] * factor), int(img.shape[0] * factor))
+    img = cv2.resize(img, dsize)
+
+    diff_0 = target_size[0] - img.shape[0]
+    diff_1 = target_size[1] - img.shape[1]
+    img = np.pad(
+        img,
+        ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)),
+        "constant",
+    )
+    if img.shape[0:2] != tuple(target_size):
+        img = cv2.resize(img, (target_size[1], target_size[0]))
+    return img
+
+
+class FacePreprocessor:
+    """
+    Preprocessing FaceNet dalam satu kernel: crop RGB mentah -> grayscale ->
+    equalizeHist -> min-max -> resize + padding -> float32 [0, 1], ditulis
+    langsung ke slot tensor batch.
+
+    Hasilnya sama persis dengan normalize_face() lalu FacenetEmbedder.preprocess():
+    ketiga channel hasil GRAY2RGB identik, jadi flip BGR dan resize cukup
+    dikerjakan pada satu channel grayscale. Buffer antara (grayscale seukuran
+    crop, hasil resize dan skalanya, tensor batch) dialokasikan per thread dan
+    dipakai ulang, hanya tumbuh bila ada crop yang lebih besar.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _buffer(self, name, shape, dtype):
+        """Per-thread scratch array of `shape`, reallocated only when it has to grow"""
+        buffers = self._local.__dict__.setdefault("buffers", {})
+        size = int(np.prod(shape))
+        buffer = buffers.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = buffers[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+
+    def batch(self, n, target_size):
+        """Preallocated (n, h, w, 3) float32 input tensor for this thread"""
+        return self._buffer("batch", (n, target_size[0], target_size[1], 3), np.float32)
+
+    def preprocess_into(self, face_img, out):
+        """Raw RGB (or grayscale) uint8 face crop -> normalized model input written into `out` (h, w, 3)"""
+        face_img = np.asarray(face_img)
+        height, width = face_img.shape[:2]
+        gray = self._buffer("gray", (height, width), np.uint8)
+        if face_img.ndim == 2:
+            np.copyto(gray, face_img)
+        else:
+            cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY, dst=gray)
+        cv2.equalizeHist(gray, dst=gray)
+        cv2.normalize(gray, gray, 0, 255, cv2.NORM_MINMAX)
+
+        target_h, target_w = out.shape[:2]
+        factor = min(target_h / height, target_w / width)
+        dsize = (int(width * factor), int(height * factor))
+        resized = self._buffer("resized", (dsize[1], dsize[0]), np.uint8)
+        cv2.resize(gray, dsize, dst=resized)
+
+        # Scale through a lookup table, then zero only the padding and copy the face into all three channels
+        scaled = self._buffer("scaled", resized.shape, np.float32)
+        cv2.LUT(resized, _UNIT_SCALE if resized.max() > 1 else _IDENTITY, dst=scaled)
+        top, left = (target_h - dsize[1]) // 2, (target_w - dsize[0]) // 2
+        bottom, right = top + dsize[1], left + dsize[0]
+        out[:top] = 0
+        out[bottom:] = 0
+        out[top:bottom, :left] = 0
+        out[top:bottom, right:] = 0
+        cv2.cvtColor(scaled, cv2.COLOR_GRAY2RGB, dst=out[top:bottom, left:right])
+        return out
+
+    def preprocess(self, face_img, target_size):
+        """Same as preprocess_into, returning a new (h, w, 3) array"""
+        out = np.empty((target_size[0], target_size[1], 3), dtype=np.float32)
+        return self.preprocess_into(face_img, out)
+
+
+class FacenetEmbedder:
+    """
+    Batch FaceNet inference memakai bobot Facenet dari DeepFace.
+
+    Semua crop wajah di-preprocess seperti DeepFace.represent(detector_backend="skip")
+    lalu ditumpuk menjadi satu tensor, sehingga N wajah cukup satu forward pass.
+    Jika forward pass batch gagal, tiap wajah diproses ulang lewat `fallback`.
+
+    Dengan normalize=True input berupa crop mentah: normalize_face() digabung
+    ke preprocessing lewat FacePreprocessor dan crop ditulis langsung ke
+    tensor batch milik thread pemanggil.
+    """
+
+    def __init__(self, fallback=None, batch_size=32, normalize=False):
+        self.fallback = fallback
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self._preprocessor = FacePreprocessor()
+        self._model = None
+        self._input_size = FACENET_INPUT_SIZE
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    started = time.perf_counter()
+                    from deepface import DeepFace
+
+                    client = DeepFace.build_model("Facenet")
+                    # Newer DeepFace wraps the Keras model in a client object with input_shape (h, w);
+                    # older versions return the Keras model itself, whose input_shape is (None, h, w, 3)
+                    input_shape = tuple(getattr(client, "input_shape", FACENET_INPUT_SIZE))
+                    self._input_size = input_shape[1:3] if len(input_shape) == 4 else input_shape
+                    self._model = getattr(client, "model", client)
+                    record_timing("facenet", time.perf_counter() - started)
+        return self._model
+
+    def _infer(self, model, batch):
+        return np.asarray(model(batch, training=False))
+
+    def preprocess(self, face_img):
+        """RGB uint8 face crop -> float32 model input in [0, 1]"""
+        if self.normalize:
+            return self._preprocessor.preprocess(face_img, self._input_size)
+        img = np.asarray(face_img)[:, :, ::-1]
+        img = resize_with_padding(img, self._input_size).astype(np.float32)
+        if img.max() > 1:
+            img /= 255.0
+        return img
+
+    def embed(self, face_imgs):
+        """
+        Return one embedding per input crop (np.ndarray), or None for crops
+        that could not be embedded.
+        """
+        embeddings = [None] * len(face_imgs)
+        if not face_imgs:
+            return embeddings
+
+        try:
+            model = self._get_model()
+        except Exception as e:
+            print(f"[ERROR] Failed to load FaceNet model: {e}")
+            return [self.fallback(face_img) if self.fallback else None for face_img in face_imgs]
+
+        # Crops are preprocessed straight into this thread's reusable input tensor
+        inputs = self._preprocessor.batch(len(face_imgs), self._input_size)
+        positions = []
+        for i, face_img in enumerate(face_imgs):
+            try:
+                if self.normalize:
+                    self._preprocessor.preprocess_into(face_img, inputs[len(positions)])
+                else:
+                    inputs[len(positions)] = self.preprocess(face_img)
+                positions.append(i)
+            except Exception as e:
+                print(f"[ERROR] Failed to preprocess face {i}: {e}")
+
+        inputs = inputs[:len(positions)]
+        for start in range(0, len(positions), self.batch_size):
+            batch = inputs[start:start + self.batch_size]
+            batch_positions = positions[start:start + self.batch_size]
+            try:
+                outputs = self._infer(model, batch)
+            except Exception as e:
+                print(f"[ERROR] Batched FaceNet inference failed, falling back per image: {e}")
+                if self.fallback is None:
+                    continue
+                for i in batch_positions:
+                    embeddings[i] = self.fallback(face_imgs[i])
+                continue
+            for i, output in zip(batch_positions, outputs):
+                embeddings[i] = np.array(output, dtype=np.float64)
+
+        return embeddings
+
+
+class OnnxFacenetEmbedder(FacenetEmbedder):
+    """
+    FaceNet lewat onnxruntime memakai model hasil export_facenet.py (float32
+    atau int8). Preprocessing sama dengan FacenetEmbedder, jadi embedding
+    bisa dipakai bersama index yang dibangun dari jalur DeepFace; cek dulu
+    dengan `python export_facenet.py check` sebelum dipakai di produksi.
+    """
+
+    def __init__(self, model_path, fallback=None, batch_size=32, num_threads=None, normalize=False):
+        super().__init__(fallback=fallback, batch_size=batch_size, normalize=normalize)
+        self.model_path = model_path
+        # Defaults to the per-worker limit set by serve.py, if any
+        self.num_threads = num_threads or int(os.environ.get("OMP_NUM_THREADS", "0"))
+        self._input_name = None
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    started = time.perf_counter()
+                    import onnxruntime as ort
+
+                    if not os.path.exists(self.model_path):
+                        raise FileNotFoundError(f"ONNX FaceNet model not found at {self.model_path}, "
+                                                f"run export_facenet.py export first")
+                    options = ort.SessionOptions()
+                    options.intra_op_num_threads = self.num_threads
+                    options.inter_op_num_threads = 1
+                    session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+                    model_input = session.get_inputs()[0]
+                    self._input_name = model_input.name
+                    if all(isinstance(dim, int) for dim in model_input.shape[1:3]):
+                        self._input_size = tuple(model_input.shape[1:3])
+                    self._model = session
+                    record_timing("facenet_onnx", time.perf_counter() - started)
+        return self._model
+
+    def _infer(self, model, batch):
+        return model.run(None, {self._input_name: batch.astype(np.float32, copy=False)})[0]
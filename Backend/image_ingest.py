@@ -0,0 +1,61 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def _payload_size(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    try:
+        position = source.tell()
+        source.seek(0, 2)
+        size = source.tell() - position
+        source.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def load_image(source, max_side=None, max_bytes=None, max_pixels=None):
+    """
+    Decode an uploaded image (file-like object or bytes) into an RGB uint8 array.
+
+    - Payloads over `max_bytes`, or whose header declares more than
+      `max_pixels` pixels, raise ImageTooLargeError before anything is decoded.
+    - JPEGs are decoded directly at a reduced scale with libjpeg DCT scaling
+      (1/2, 1/4 or 1/8), keeping the longer side at least `max_side`. Other
+      formats decode at full size.
+    - EXIF orientation is applied and any colour mode (palette, RGBA, CMYK,
+      grayscale, 16-bit) becomes RGB.
+    """
+    if max_bytes is not None:
+        size = _payload_size(source)
+        if size is not None and size > max_bytes:
+            raise ImageTooLargeError(f"Image is {size} bytes, the limit is {max_bytes}")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        from io import BytesIO
+
+        source = BytesIO(source)
+
+    img = Image.open(source)
+    width, height = img.size
+    if max_pixels is not None and width * height > max_pixels:
+        raise ImageTooLargeError(f"Image is {width}x{height} pixels, the limit is {max_pixels}")
+
+    if max_side and img.format == "JPEG" and max(width, height) > max_side:
+        # draft() keeps the result at least as large as the requested size
+        scale = max_side / max(width, height)
+        img.draft("RGB", (int(width * scale), int(height * scale)))
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        if img.mode == "I;16" or img.mode == "I":
+            # 16/32-bit grayscale: scale to 8 bits before converting
+            img = Image.fromarray((np.asarray(img, dtype=np.float32) / 256).clip(0, 255).astype(np.uint8))
+        elif img.mode == "P" and "transparency" in img.info:
+            img = img.convert("RGBA")
+        img = img.convert("RGB")
+    return np.array(img)
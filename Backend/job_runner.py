@@ -0,0 +1,502 @@
+import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_CANCELLING = "cancelling"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING)
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+class Job:
+    """
+    Satu background job. Fungsi job menerima objek ini dan memanggil
+    report() di antara tahapan; report() melempar JobCancelledError bila job
+    diminta berhenti, jadi pembatalan terjadi di checkpoint yang aman.
+    """
+
+    def __init__(self, kind, dedupe_key=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.dedupe_key = dedupe_key
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.stage = "queued"
+        self.result = None
+        self.error = None
+        self.error_type = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_requested = threading.Event()
+        self._done = threading.Event()
+        # Guards progress/stage so readers never see one without the other
+        self._lock = threading.Lock()
+        # Set by JobRunner when the state is shared with other worker processes
+        self._remote_cancel = None
+        self._on_report = None
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATES
+
+    def report(self, progress, stage, checkpoint=True):
+        """
+        Record progress (0..1). Unless `checkpoint` is False (for stages past
+        the point of no return), also act as a cancellation checkpoint.
+        """
+        if checkpoint and self._remote_cancel is not None and self._remote_cancel():
+            self._cancel_requested.set()
+        with self._lock:
+            if checkpoint and self._cancel_requested.is_set():
+                raise JobCancelledError(f"Job {self.id} cancelled during {self.stage}")
+            self.progress = progress
+            self.stage = stage
+        if self._on_report is not None:
+            self._on_report(self)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        with self._lock:
+            progress, stage = self.progress, self.stage
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(progress, 3),
+            "stage": stage,
+            "result": self.result,
+            "error": self.error,
+            "error_type": self.error_type,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobSnapshot:
+    """
+    Status job milik worker proses lain, dibaca dari SharedJobState.
+    Punya atribut dan method yang sama dengan Job yang dipakai endpoint
+    (to_dict, status, result, wait), tapi hanya untuk dibaca.
+    """
+
+    def __init__(self, record, state):
+        self._state = state
+        self._load(record)
+
+    def _load(self, record):
+        self._record = dict(record)
+        self.id = record["job_id"]
+        self.kind = record.get("kind")
+        self.dedupe_key = record.get("dedupe_key")
+        self.status = record["status"]
+        self.progress = record.get("progress", 0.0)
+        self.stage = record.get("stage")
+        self.result = record.get("result")
+        self.error = record.get("error")
+        self.error_type = record.get("error_type")
+        self.created_at = record.get("created_at", 0.0)
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATES
+
+    def to_dict(self):
+        record = {key: value for key, value in self._record.items() if key != "dedupe_key"}
+        record["status"] = self.status
+        return record
+
+    def wait(self, timeout=None):
+        """Poll the shared record until the job finishes; refreshes this snapshot"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.active:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self._state.poll_interval)
+            latest = self._state.load(self.id)
+            if latest is None:
+                return False
+            self._load(latest._record)
+        return True
+
+
+class SharedJobState:
+    """
+    Status job di blob store, dibagi semua worker proses (serve.py) sehingga
+    job yang dibuat di satu worker bisa di-poll dan di-cancel dari worker lain:
+
+    - {prefix}records/<id>.json   status terakhir job (ditulis tiap report())
+    - {prefix}cancel/<id>         permintaan cancel dari worker lain
+    - {prefix}queued/<key>.json   job yang sedang antri untuk dedupe_key
+    - {prefix}running/<key>.json  lease job yang sedang berjalan untuk dedupe_key
+
+    Slot antri dan lease dibuat dengan if_generation_match=0 (hanya bila
+    belum ada), jadi hanya satu worker yang menang. Worker pemilik
+    memperbarui slot antri selama menunggu dan lease tiap report(); slot
+    milik worker yang mati dianggap basi setelah `queue_ttl` detik (antri)
+    atau `lease_ttl` detik (berjalan) tanpa update.
+    """
+
+    def __init__(self, blob_store, prefix="jobs/", lease_ttl=3600.0, queue_ttl=300.0, poll_interval=2.0):
+        self.blob_store = blob_store
+        self.prefix = prefix
+        self.lease_ttl = lease_ttl
+        self.queue_ttl = queue_ttl
+        self.poll_interval = poll_interval
+
+    def _path(self, kind, name):
+        return f"{self.prefix}{kind}/{name}"
+
+    def _read_json(self, path):
+        data = self.blob_store.get_many([path])[path]
+        return None if data is None else json.loads(data)
+
+    def _write_json(self, path, value, if_generation_match=None):
+        self.blob_store._with_retries(self.blob_store.put_bytes, path,
+                                      json.dumps(value, default=str).encode("utf-8"), "application/json",
+                                      if_generation_match=if_generation_match)
+
+    def save(self, job):
+        record = job.to_dict()
+        record["dedupe_key"] = job.dedupe_key
+        record["updated_at"] = time.time()
+        try:
+            self._write_json(self._path("records", f"{job.id}.json"), record)
+        except Exception as e:
+            print(f"[WARNING] Could not save job {job.id} state: {e}")
+
+    def load(self, job_id):
+        record = self._read_json(self._path("records", f"{job_id}.json"))
+        return None if record is None else JobSnapshot(record, self)
+
+    def list(self):
+        paths = self.blob_store.list(self._path("records", ""))
+        records = [json.loads(data) for data in self.blob_store.get_many(paths).values() if data is not None]
+        return [JobSnapshot(record, self) for record in records]
+
+    def _delete(self, path):
+        try:
+            self.blob_store._with_retries(self.blob_store.delete, path)
+        except Exception as e:
+            if not self.blob_store.is_not_found(e):
+                raise
+
+    def delete(self, job_id):
+        for path in (self._path("records", f"{job_id}.json"), self._path("cancel", job_id)):
+            self._delete(path)
+
+    def request_cancel(self, job_id):
+        self.blob_store._with_retries(self.blob_store.put_bytes, self._path("cancel", job_id), b"1")
+
+    def cancel_requested(self, job_id):
+        return self.blob_store._with_retries(self.blob_store.exists, self._path("cancel", job_id))
+
+    def _finished(self, job_id):
+        record = self._read_json(self._path("records", f"{job_id}.json"))
+        return record is not None and record["status"] not in ACTIVE_STATES
+
+    def _ttl(self, kind):
+        return self.queue_ttl if kind == "queued" else self.lease_ttl
+
+    def _claim(self, kind, key, job_id):
+        """Create the {kind}/<key> slot for `job_id`; returns the job ID holding it"""
+        path = self._path(kind, f"{key}.json")
+        while True:
+            try:
+                self._write_json(path, {"job_id": job_id, "updated_at": time.time()}, if_generation_match=0)
+                return job_id
+            except Exception as e:
+                if not self.blob_store.is_precondition_failed(e):
+                    raise
+            entry = self._read_json(path)
+            if entry is None:
+                continue
+            if entry["job_id"] == job_id:
+                # A retried write whose first attempt already went through
+                return job_id
+            if time.time() - entry["updated_at"] > self._ttl(kind):
+                # The worker holding it died without releasing it
+                print(f"[JOBS] Dropping stale {kind} slot of job {entry['job_id']} for {key}")
+            elif not self._finished(entry["job_id"]):
+                return entry["job_id"]
+            self._delete(path)
+
+    def _refresh(self, kind, key, job_id):
+        """Bump the {kind}/<key> slot if `job_id` still holds it; returns whether it does"""
+        path = self._path(kind, f"{key}.json")
+        try:
+            generation = self.blob_store._with_retries(self.blob_store.generation, path)
+            entry = self._read_json(path)
+            if generation is None or entry is None or entry["job_id"] != job_id:
+                return False
+            # Conditional on the generation so a slot taken over meanwhile is left alone
+            self._write_json(path, {"job_id": job_id, "updated_at": time.time()}, if_generation_match=generation)
+            return True
+        except Exception as e:
+            if not self.blob_store.is_precondition_failed(e):
+                print(f"[WARNING] Could not refresh {kind} slot of job {job_id}: {e}")
+            return False
+
+    def _release(self, kind, key, job_id):
+        path = self._path(kind, f"{key}.json")
+        entry = self._read_json(path)
+        if entry is not None and entry["job_id"] == job_id:
+            self._delete(path)
+
+    def claim_queued(self, key, job_id):
+        """Become the queued job for `key`; returns the ID of the job already queued otherwise"""
+        return self._claim("queued", key, job_id)
+
+    def refresh_queued(self, key, job_id):
+        return self._refresh("queued", key, job_id)
+
+    def release_queued(self, key, job_id):
+        self._release("queued", key, job_id)
+
+    def acquire_running(self, job):
+        """Wait until no other worker runs a job with the same key, then hold the lease"""
+        while self._claim("running", job.dedupe_key, job.id) != job.id:
+            if self.cancel_requested(job.id):
+                job._cancel_requested.set()
+            if job._cancel_requested.is_set():
+                raise JobCancelledError(f"Job {job.id} cancelled while waiting for another worker")
+            # Keep our queued slot alive so other workers keep deduping onto this job
+            self.refresh_queued(job.dedupe_key, job.id)
+            time.sleep(self.poll_interval)
+
+    def refresh_running(self, job):
+        return self._refresh("running", job.dedupe_key, job.id)
+
+    def release_running(self, job):
+        self._release("running", job.dedupe_key, job.id)
+
+
+class JobRunner:
+    """
+    Jalankan job berat (training) di thread background dengan job ID,
+    progress dan pembatalan.
+
+    Job dengan `dedupe_key` yang sama digabung: selama masih ada job yang
+    antri dengan key itu, submit() mengembalikan job tersebut. Jika job
+    dengan key itu sedang berjalan, satu job baru tetap diantrikan supaya
+    data yang masuk setelah job berjalan ikut terproses.
+
+    Dengan `shared` (SharedJobState) status job, dedupe dan pembatalan
+    berlaku lintas worker proses, dan job dengan key yang sama tidak pernah
+    berjalan bersamaan di dua worker.
+    """
+
+    def __init__(self, max_workers=1, history_size=50, name="jobs", shared=None):
+        self.history_size = history_size
+        self.shared = shared
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, dedupe_key=None):
+        """Queue fn(job). Returns (job, deduplicated)"""
+        with self._lock:
+            queued = self._queued_job(dedupe_key)
+            if queued is not None:
+                return queued, True
+
+        job = Job(kind, dedupe_key)
+        if self.shared is not None:
+            job._remote_cancel = lambda: self._remote_cancel_requested(job)
+            job._on_report = self._on_report
+            if dedupe_key is not None:
+                # Another worker may already have a job queued for this key
+                queued_id = self.shared.claim_queued(dedupe_key, job.id)
+                if queued_id != job.id:
+                    queued = self.get(queued_id)
+                    if queued is not None and queued.status == JOB_QUEUED:
+                        return queued, True
+
+        with self._lock:
+            queued = self._queued_job(dedupe_key)
+            if queued is not None:
+                if self.shared is not None and dedupe_key is not None:
+                    self.shared.release_queued(dedupe_key, job.id)
+                return queued, True
+            self._jobs[job.id] = job
+            self._trim_history()
+        self._save(job)
+        self._executor.submit(self._run, job, fn)
+        return job, False
+
+    def _queued_job(self, dedupe_key):
+        # Caller must hold self._lock
+        if dedupe_key is None:
+            return None
+        for job in reversed(self._jobs.values()):
+            if job.dedupe_key == dedupe_key and job.status == JOB_QUEUED:
+                return job
+        return None
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.shared is not None:
+            return self.shared.load(job_id)
+        return job
+
+    def list(self):
+        with self._lock:
+            jobs = {job.id: job for job in self._jobs.values()}
+        if self.shared is not None:
+            for snapshot in self.shared.list():
+                jobs.setdefault(snapshot.id, snapshot)
+        return sorted(jobs.values(), key=lambda job: job.created_at, reverse=True)[:self.history_size]
+
+    def cancel(self, job_id):
+        """Request cancellation. Returns the job, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.active:
+                job._cancel_requested.set()
+                if job.status == JOB_QUEUED:
+                    self._finish(job, JOB_CANCELLED)
+                else:
+                    job.status = JOB_CANCELLING
+        if job is not None:
+            if job.status == JOB_CANCELLED:
+                self._release_slots(job)
+            self._save(job)
+            if not job.active:
+                job._done.set()
+            return job
+        if self.shared is None:
+            return None
+
+        # Owned by another worker: leave a marker its next checkpoint picks up
+        snapshot = self.shared.load(job_id)
+        if snapshot is not None and snapshot.active:
+            self.shared.request_cancel(job_id)
+            snapshot.status = JOB_CANCELLING
+        return snapshot
+
+    def _save(self, job):
+        if self.shared is not None:
+            self.shared.save(job)
+
+    def _on_report(self, job):
+        self.shared.save(job)
+        if job.dedupe_key is not None and job.status != JOB_QUEUED:
+            self.shared.refresh_running(job)
+        # Jobs queued behind this one in the local executor are not polling yet
+        with self._lock:
+            queued = [other for other in self._jobs.values()
+                      if other.status == JOB_QUEUED and other.dedupe_key is not None]
+        for other in queued:
+            self.shared.refresh_queued(other.dedupe_key, other.id)
+
+    def _remote_cancel_requested(self, job):
+        try:
+            return self.shared.cancel_requested(job.id)
+        except Exception as e:
+            print(f"[WARNING] Could not check job {job.id} for cancellation: {e}")
+            return False
+
+    def _run(self, job, fn):
+        leased = False
+        try:
+            if self.shared is not None and job.dedupe_key is not None and job.status == JOB_QUEUED:
+                if self.shared.cancel_requested(job.id):
+                    raise JobCancelledError(f"Job {job.id} cancelled while queued")
+                # Another worker may be running the same kind of job; wait for its lease
+                self.shared.acquire_running(job)
+                leased = True
+                # Running now: the next request for this key may queue a new job
+                self.shared.release_queued(job.dedupe_key, job.id)
+        except Exception as e:
+            # Never leave the job QUEUED: waiters would hang and later submits dedupe onto it
+            with self._lock:
+                if job.active:
+                    if isinstance(e, JobCancelledError):
+                        self._finish(job, JOB_CANCELLED)
+                    else:
+                        job.error = str(e)
+                        job.error_type = type(e).__name__
+                        self._finish(job, JOB_FAILED)
+            if isinstance(e, JobCancelledError):
+                print(f"[JOBS] {job.kind} job {job.id} cancelled")
+            else:
+                print(f"[ERROR] {job.kind} job {job.id} failed before it could start: {e}")
+            self._release_slots(job, leased)
+            self._save(job)
+            job._done.set()
+            return
+
+        try:
+            with self._lock:
+                if job.status != JOB_QUEUED:
+                    return
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+            job.report(0.0, "starting", checkpoint=False)
+            self._execute(job, fn)
+        finally:
+            if leased:
+                self._release_slots(job, leased)
+            self._save(job)
+            # Only now: waiters see the final record and can start the next job right away
+            job._done.set()
+
+    def _release_slots(self, job, leased=False):
+        if self.shared is None or job.dedupe_key is None:
+            return
+        try:
+            self.shared.release_queued(job.dedupe_key, job.id)
+            if leased:
+                self.shared.release_running(job)
+        except Exception as e:
+            print(f"[WARNING] Could not release job {job.id} slots: {e}")
+
+    def _execute(self, job, fn):
+        try:
+            result = fn(job)
+        except JobCancelledError:
+            with self._lock:
+                self._finish(job, JOB_CANCELLED)
+            print(f"[JOBS] {job.kind} job {job.id} cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                job.error = str(e)
+                job.error_type = type(e).__name__
+                self._finish(job, JOB_FAILED)
+        else:
+            job.report(1.0, "done", checkpoint=False)
+            with self._lock:
+                job.result = result
+                self._finish(job, JOB_SUCCEEDED)
+
+    def _finish(self, job, status):
+        # Caller must hold self._lock; the caller sets job._done once the state is persisted
+        job.status = status
+        job.finished_at = time.time()
+
+    def _trim_history(self):
+        # Caller must hold self._lock; never drop a job that is still active
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[job_id]
+            if self.shared is not None:
+                try:
+                    self.shared.delete(job_id)
+                except Exception as e:
+                    print(f"[WARNING] Could not delete job {job_id} state: {e}")
@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+
+# name -> seconds, in the order things were loaded
+_startup_timings = OrderedDict()
+_timings_lock = threading.Lock()
+
+
+def record_timing(name, seconds):
+    with _timings_lock:
+        _startup_timings[name] = seconds
+
+
+def startup_report():
+    """Return {component: seconds} for everything loaded so far"""
+    with _timings_lock:
+        return OrderedDict(_startup_timings)
+
+
+def print_startup_report():
+    report = startup_report()
+    print("[STARTUP] Component load times:")
+    for name, seconds in report.items():
+        print(f"[STARTUP]   {name:<24} {seconds * 1000:9.1f} ms")
+
+
+class LazyResource:
+    """
+    Bangun objek berat (model, detector, client) saat pertama kali dipakai,
+    bukan saat modul di-import. Waktu load dicatat untuk startup report.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    started = time.perf_counter()
+                    self._value = self.factory()
+                    record_timing(self.name, time.perf_counter() - started)
+                    self._loaded = True
+        return self._value
@@ -0,0 +1,269 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond matching up to slow cold loads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callback at scrape time"""
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class CallbackCounter(Gauge):
+    """Counter whose running total is read from a callback at scrape time (e.g. cache stats)"""
+
+    type_name = "counter"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count], sum
+        self._counts = {}
+        self._sums = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            snapshot = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        lines = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _parse_sample_value(value):
+    if value == "+Inf":
+        return float("inf")
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _with_label(key, name, value):
+    # `key` is a rendered sample name with its labels, e.g. metric{a="b"}
+    if key.endswith("}"):
+        return f'{key[:-1]},{name}="{value}"}}'
+    return f'{key}{{{name}="{value}"}}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """
+    Kumpulan metric in-process yang di-render ke format teks Prometheus.
+    Sengaja tanpa dependency tambahan. Di bawah serve.py setiap worker
+    memanggil share() dengan direktori yang sama, sehingga /metrics dari
+    worker mana pun menampilkan total gabungan semua worker.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self._share_dir = None
+
+    def _register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback):
+        return self._register(Gauge(name, documentation, callback))
+
+    def callback_counter(self, name, documentation, callback):
+        return self._register(CallbackCounter(name, documentation, callback))
+
+    def share(self, directory, interval=5.0):
+        """
+        Publish this process's samples to `directory` every `interval` seconds
+        and make render() merge the samples of every process sharing it:
+        counters and histograms are summed (totals of exited workers are kept so
+        they never go backwards), gauges get a `worker` label per live process.
+        Call after fork; the publishing thread does not survive one.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._share_dir = directory
+
+        def publish_forever():
+            while True:
+                try:
+                    self._publish()
+                except Exception as e:
+                    print(f"[WARNING] Could not publish metrics: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=publish_forever, name="metrics-share", daemon=True).start()
+
+    def _metrics_snapshot(self):
+        with self._lock:
+            return list(self._metrics)
+
+    def _publish(self):
+        snapshot = {}
+        for metric in self._metrics_snapshot():
+            samples = [line.rsplit(" ", 1) for line in metric._samples()]
+            snapshot[metric.name] = {"type": metric.type_name, "samples": samples}
+        fd, tmp_path = tempfile.mkstemp(dir=self._share_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, os.path.join(self._share_dir, f"{os.getpid()}.json"))
+
+    def _merged_samples(self):
+        self._publish()
+        merged = {}
+        for filename in sorted(os.listdir(self._share_dir)):
+            pid = filename[:-len(".json")]
+            if not filename.endswith(".json") or not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(self._share_dir, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(int(pid))
+            for name, metric in snapshot.items():
+                samples = merged.setdefault(name, {})
+                for key, value in metric["samples"]:
+                    if metric["type"] == "gauge":
+                        if not alive:
+                            continue
+                        key = _with_label(key, "worker", pid)
+                    samples[key] = samples.get(key, 0) + _parse_sample_value(value)
+        return merged
+
+    def render(self):
+        metrics = self._metrics_snapshot()
+        if self._share_dir is None:
+            lines = []
+            for metric in metrics:
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
+
+        merged = self._merged_samples()
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(f"{key} {_format_value(value)}" for key, value in merged.get(metric.name, {}).items())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,367 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from io import BytesIO
+
+import joblib
+import numpy as np
+
+from embedding_index import EmbeddingIndex
+from embedding_store import write_local_copy
+
+KNN_MODEL_PATH = "models/knn_model.pkl"
+LABEL_ENCODER_PATH = "models/label_encoder.pkl"
+USER_DATA_PATH = "models/user_data.pkl"
+EMBEDDING_INDEX_PATH = "models/embedding_index.pemb"
+MANIFEST_PATH = "models/manifest.json"
+INDEX_DELTA_PREFIX = "models/index_deltas/"
+
+ModelBundle = namedtuple("ModelBundle", ["version", "index", "deltas", "loaded_at"])
+
+
+class ModelRegistry:
+    """
+    Process-wide cache untuk index recognition.
+
+    Snapshot index di-download sekali lalu disimpan di memori sebagai satu
+    ModelBundle. Versi yang dipublikasikan dicek paling sering setiap
+    `refresh_interval` detik lewat generation dari manifest; jika berubah,
+    bundle baru di-load lalu di-swap secara atomik sehingga request yang
+    sedang berjalan tetap memakai bundle lama. Dengan `cache_dir`, snapshot
+    disimpan sebagai file lokal dan di-memory-map sehingga worker di host yang
+    sama berbagi page yang sama.
+
+    Mahasiswa yang baru register ditambahkan langsung ke index lewat enroll()
+    dan disimpan sebagai delta kecil di `models/index_deltas/`. Worker lain
+    menerapkan delta yang belum mereka lihat saat refresh, dan compact()
+    melipat semua delta ke snapshot index yang baru.
+
+    KNN, label encoder dan user_data tetap di-upload oleh publish() sebagai
+    artefak evaluasi, tetapi tidak di-load di jalur recognition.
+
+    `ann` mengaktifkan index ANN untuk index besar, misalnya
+    {"backend": "ivf", "min_embeddings": 50000, "build": {"n_lists": None}, "search": {"nprobe": 8}}.
+    Searcher IVF ikut disimpan di snapshot sehingga worker lain tidak perlu
+    melatih ulang.
+
+    `storage` menyimpan baris embedding index dalam presisi lebih rendah,
+    misalnya {"backend": "pq", "min_embeddings": 4096, "params": {"n_subspaces": 16}}
+    atau {"backend": "float16"}. Snapshot ditulis dalam format itu, jadi
+    worker langsung me-memory-map kode yang kecil.
+    """
+
+    def __init__(self, blob_store, refresh_interval=30.0, optimal_k=None, cache_dir=None, ann=None, storage=None):
+        self.blob_store = blob_store
+        self.refresh_interval = refresh_interval
+        self.optimal_k = optimal_k
+        self.cache_dir = cache_dir
+        self.ann = ann
+        self.storage = storage
+        self._bundle = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        # get() calls served from memory / that re-checked the bucket / bundle (re)loads
+        self._hits = 0
+        self._checks = 0
+        self._loads = 0
+
+    def get(self):
+        """Return the current ModelBundle, or None if no model has been published"""
+        bundle = self._bundle
+        if bundle is not None and time.monotonic() - self._checked_at < self.refresh_interval:
+            self._hits += 1
+            return bundle
+
+        # Only one thread refreshes; the rest keep serving the current bundle
+        if not self._lock.acquire(blocking=bundle is None):
+            self._hits += 1
+            return bundle
+        try:
+            if self._bundle is not None and time.monotonic() - self._checked_at < self.refresh_interval:
+                self._hits += 1
+                return self._bundle
+            self._checks += 1
+            self._refresh()
+            return self._bundle
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        bundle = self._bundle
+        lookups = self._hits + self._checks
+        return {
+            "version": bundle.version if bundle else None,
+            "num_classes": bundle.index.num_classes if bundle else 0,
+            "num_embeddings": len(bundle.index) if bundle else 0,
+            "index_storage": bundle.index.storage if bundle else None,
+            "index_bytes": bundle.index.nbytes if bundle else 0,
+            "applied_deltas": len(bundle.deltas) if bundle else 0,
+            "cache_hits": self._hits,
+            "cache_checks": self._checks,
+            "loads": self._loads,
+            "cache_hit_rate": self._hits / lookups if lookups else 0.0,
+        }
+
+    def invalidate(self):
+        """Force the next get() to re-check the published version"""
+        self._checked_at = 0.0
+
+    def pending_deltas(self):
+        """Names of the index deltas currently waiting to be compacted"""
+        return sorted(self.blob_store.list(INDEX_DELTA_PREFIX))
+
+    def publish(self, knn, label_encoder, user_data, index=None, folded_deltas=()):
+        """
+        Upload a new bundle and swap it in for this process.
+        `folded_deltas` are the deltas already contained in this bundle; they
+        are recorded in the manifest and removed from the bucket.
+        """
+        if index is None:
+            index = EmbeddingIndex.from_model(knn, label_encoder, user_data)
+        index = self._prepare_index(index)
+        self._put_all([
+            (KNN_MODEL_PATH, self._pickle(knn)),
+            (LABEL_ENCODER_PATH, self._pickle(label_encoder)),
+            (USER_DATA_PATH, self._pickle(user_data)),
+            (EMBEDDING_INDEX_PATH, index.to_bytes()),
+        ])
+        self._write_manifest(folded_deltas)
+
+        with self._lock:
+            self._bundle = ModelBundle(
+                version=self._published_version(),
+                index=index,
+                deltas=frozenset(folded_deltas),
+                loaded_at=time.time(),
+            )
+            self._refresh_deltas()
+            self._checked_at = time.monotonic()
+        self._delete_deltas(folded_deltas)
+        return self._bundle
+
+    def enroll(self, nim, embeddings, avg_embedding, threshold):
+        """
+        Tambahkan (atau ganti) satu user di index yang sedang dipakai tanpa
+        training ulang, lalu simpan perubahannya sebagai delta.
+        """
+        name = f"{INDEX_DELTA_PREFIX}{time.time_ns():020d}_{nim}.npz"
+        buffer = BytesIO()
+        np.savez(
+            buffer,
+            nim=nim,
+            embeddings=np.asarray(embeddings, dtype=np.float32),
+            avg_embedding=np.asarray(avg_embedding),
+            threshold=np.asarray(threshold),
+        )
+        self.blob_store.put_bytes(name, buffer.getvalue())
+
+        self.get()
+        with self._lock:
+            if self._bundle is None:
+                self._refresh()
+            elif name not in self._bundle.deltas:
+                self._bundle = self._apply_deltas(self._bundle, [name])
+        print(f"[MODEL] Enrolled {nim} into the live index ({name})")
+        return self._bundle
+
+    def compact(self):
+        """Fold every pending delta into a new index snapshot"""
+        with self._lock:
+            self._refresh()
+            bundle = self._bundle
+        if bundle is None:
+            return None
+
+        folded = sorted(bundle.deltas)
+        bundle = bundle._replace(index=self._prepare_index(bundle.index, rebuild_ann=True))
+        self.blob_store.put_bytes(EMBEDDING_INDEX_PATH, bundle.index.to_bytes())
+        self._write_manifest(folded)
+
+        with self._lock:
+            self._bundle = bundle._replace(version=self._published_version())
+            self._checked_at = time.monotonic()
+        self._delete_deltas(folded)
+        print(f"[MODEL] Compacted {len(folded)} index deltas into a new snapshot")
+        return self._bundle
+
+    def _refresh(self):
+        # Caller must hold self._lock
+        version = self._published_version()
+        if self._bundle is None or self._bundle.version != version:
+            if version is not None:
+                self._bundle = self._load(version)
+                self._loads += 1
+                print(f"[MODEL] Loaded model bundle version {version}")
+            elif self.pending_deltas():
+                # Students registered before the first training run
+                self._bundle = ModelBundle(
+                    version=None,
+                    index=EmbeddingIndex.empty(),
+                    deltas=frozenset(),
+                    loaded_at=time.time(),
+                )
+        self._refresh_deltas()
+        self._checked_at = time.monotonic()
+
+    def _refresh_deltas(self):
+        # Caller must hold self._lock
+        if self._bundle is None:
+            return
+        new_deltas = [name for name in self.pending_deltas() if name not in self._bundle.deltas]
+        if new_deltas:
+            self._bundle = self._apply_deltas(self._bundle, new_deltas)
+
+    def _apply_deltas(self, bundle, names):
+        index = bundle.index
+        applied = set(bundle.deltas)
+        blobs = self.blob_store.get_many(sorted(names))
+        for name, data in blobs.items():
+            if data is None:
+                # Delta may have been compacted away in the meantime
+                print(f"[WARNING] Could not apply index delta {name}: not found")
+                continue
+            delta = np.load(BytesIO(data))
+            nim = str(delta["nim"])
+            num_classes = index.num_classes + (0 if nim in index.classes else 1)
+            k = self.optimal_k(num_classes) if self.optimal_k else None
+            index = index.with_class(nim, delta["embeddings"], delta["avg_embedding"], delta["threshold"], k=k)
+            applied.add(name)
+        return bundle._replace(index=self._prepare_index(index), deltas=frozenset(applied))
+
+    def _published_version(self):
+        generation = self.blob_store.generation(MANIFEST_PATH)
+        if generation is not None:
+            return f"manifest:{generation}"
+        # Models trained before the manifest existed only have the pickles
+        generation = self.blob_store.generation(KNN_MODEL_PATH)
+        if generation is not None:
+            return f"knn:{generation}"
+        return None
+
+    def _load(self, version):
+        blobs = self.blob_store.get_many([EMBEDDING_INDEX_PATH, MANIFEST_PATH])
+        if blobs[EMBEDDING_INDEX_PATH] is not None:
+            index = self._open_index(version, blobs[EMBEDDING_INDEX_PATH])
+        else:
+            # Bundles published before the packed index existed
+            legacy = self.blob_store.get_many([KNN_MODEL_PATH, LABEL_ENCODER_PATH, USER_DATA_PATH])
+            index = EmbeddingIndex.from_model(*(self._unpickle(legacy[path]) for path in legacy))
+
+        index = self._prepare_index(index)
+
+        folded = []
+        if blobs[MANIFEST_PATH] is not None:
+            folded = json.loads(blobs[MANIFEST_PATH]).get("folded_deltas", [])
+
+        return ModelBundle(
+            version=version,
+            index=index,
+            deltas=frozenset(folded),
+            loaded_at=time.time(),
+        )
+
+    def _prepare_index(self, index, rebuild_ann=False):
+        """
+        Re-encode the rows in the configured storage and attach (or re-tune)
+        the configured ANN searcher once the index is large enough.
+        `rebuild_ann` trains a fresh searcher even if one is attached (on
+        compaction, after deltas were folded in incrementally).
+        """
+        index = self._prepare_storage(index)
+        if not self.ann:
+            return index
+        backend = self.ann.get("backend", "ivf")
+        search_params = self.ann.get("search", {})
+        if rebuild_ann or index.searcher is None or index.searcher.backend != backend:
+            if len(index) == 0 or len(index) < self.ann.get("min_embeddings", 0):
+                return index
+            started = time.monotonic()
+            index = index.with_ann(backend, **self.ann.get("build", {}), **search_params)
+            print(f"[MODEL] Built {backend} ANN index over {len(index)} embeddings "
+                  f"in {time.monotonic() - started:.2f}s")
+            return index
+        if search_params:
+            index = index.with_searcher(index.searcher.with_params(**search_params))
+        return index
+
+    def _prepare_storage(self, index):
+        if not self.storage:
+            return index
+        backend = self.storage.get("backend", "float32")
+        if index.storage == backend or len(index) == 0 or len(index) < self.storage.get("min_embeddings", 0):
+            return index
+        started = time.monotonic()
+        before = index.nbytes
+        index = index.with_storage(backend, **self.storage.get("params", {}))
+        print(f"[MODEL] Encoded {len(index)} embeddings as {backend} ({before} -> {index.nbytes} bytes) "
+              f"in {time.monotonic() - started:.2f}s")
+        return index
+
+    def _open_index(self, version, data):
+        if self.cache_dir is None:
+            return EmbeddingIndex.from_bytes(data)
+
+        filename = f"embedding_index_{version.replace(':', '_')}.pemb"
+        local_path = os.path.join(self.cache_dir, filename)
+        for attempt in range(3):
+            if not os.path.exists(local_path):
+                # Snapshots are immutable per version; let the first worker's copy win
+                write_local_copy(local_path, data, replace=False)
+            try:
+                index = EmbeddingIndex.open(local_path)
+            except FileNotFoundError:
+                # Cleaned up by a worker that already moved to a newer version
+                continue
+            self._remove_older_snapshots(local_path)
+            return index
+        print(f"[WARNING] Could not keep a cached copy of index {version}; loading it in memory")
+        return EmbeddingIndex.from_bytes(data)
+
+    def _remove_older_snapshots(self, local_path):
+        # Unlinking is safe once mapped: processes that mapped the old file keep their pages
+        try:
+            current = os.stat(local_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        for old in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, old)
+            if not (old.startswith("embedding_index_") and old.endswith(".pemb")) or path == local_path:
+                continue
+            try:
+                if os.stat(path).st_mtime_ns < current:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _write_manifest(self, folded_deltas):
+        # Manifest ditulis terakhir supaya worker lain hanya melihat bundle yang lengkap
+        manifest = {
+            "published_at": datetime.now().isoformat(),
+            "artifacts": [KNN_MODEL_PATH, LABEL_ENCODER_PATH, USER_DATA_PATH, EMBEDDING_INDEX_PATH],
+            "folded_deltas": sorted(folded_deltas),
+        }
+        self.blob_store.put_bytes(MANIFEST_PATH, json.dumps(manifest).encode("utf-8"),
+                                  content_type="application/json")
+
+    def _delete_deltas(self, names):
+        for name in names:
+            try:
+                self.blob_store.delete(name)
+            except Exception as e:
+                print(f"[WARNING] Failed to delete index delta {name}: {e}")
+
+    def _unpickle(self, data):
+        return None if data is None else joblib.load(BytesIO(data))
+
+    def _pickle(self, obj):
+        buffer = BytesIO()
+        joblib.dump(obj, buffer)
+        return buffer.getvalue()
+
+    def _put_all(self, items):
+        for error in self.blob_store.put_many(items):
+            if error is not None:
+                raise error
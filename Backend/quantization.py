@@ -0,0 +1,314 @@
+import time
+
+import numpy as np
+
+STORAGE_BACKENDS = ("float32", "float16", "pq")
+
+
+class FloatVectors:
+    """Embedding rows as a plain float32 matrix (exact search)"""
+
+    storage = "float32"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    @classmethod
+    def encode(cls, unit_vectors):
+        return cls(np.ascontiguousarray(unit_vectors, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def shape(self):
+        return self.vectors.shape
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes
+
+    @property
+    def params(self):
+        return {}
+
+    def __getitem__(self, rows):
+        """Rows as float32 vectors"""
+        return self.vectors[rows]
+
+    def similarities(self, queries):
+        """Cosine similarities of unit queries (d,) or (q, d) against every row"""
+        return queries @ self.vectors.T
+
+    def take(self, rows):
+        return type(self)(self.vectors[rows])
+
+    def append(self, unit_vectors):
+        return type(self).encode(np.vstack([self[:], unit_vectors]))
+
+    def arrays(self):
+        return {"vectors": self.vectors}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        return cls(arrays["vectors"])
+
+
+class HalfVectors(FloatVectors):
+    """
+    Embedding rows disimpan float16 (separuh memori float32). Perkalian
+    dilakukan per chunk setelah di-cast ke float32 supaya tetap memakai BLAS
+    dan tidak pernah membuat salinan float32 dari seluruh matriks.
+
+    Cast itu dibayar di setiap query: similarities() sekitar 2x lebih lambat
+    dari FloatVectors pada index kecil dan ~7x pada 40k baris, jadi float16
+    hanya layak bila memori lebih mahal daripada latency recognition.
+    """
+
+    storage = "float16"
+    chunk_size = 16384
+
+    @classmethod
+    def encode(cls, unit_vectors):
+        return cls(np.ascontiguousarray(unit_vectors, dtype=np.float16))
+
+    def __getitem__(self, rows):
+        return self.vectors[rows].astype(np.float32)
+
+    def similarities(self, queries):
+        queries = np.asarray(queries, dtype=np.float32)
+        sims = np.empty(queries.shape[:-1] + (len(self.vectors),), dtype=np.float32)
+        for start in range(0, len(self.vectors), self.chunk_size):
+            chunk = self.vectors[start:start + self.chunk_size].astype(np.float32)
+            sims[..., start:start + len(chunk)] = queries @ chunk.T
+        return sims
+
+
+class ProductQuantizer:
+    """
+    Product quantization: vektor d-dimensi dibagi menjadi `n_subspaces`
+    sub-vektor, dan tiap sub-vektor diganti indeks (uint8) centroid k-means
+    terdekat di subspace itu. Embedding FaceNet 128-d dengan 16 subspace
+    menjadi 16 byte.
+
+    Similarity dihitung dengan asymmetric distance computation (ADC): query
+    tetap float32, tabel inner product query terhadap semua centroid per
+    subspace dihitung sekali, lalu similarity tiap baris adalah jumlah
+    `n_subspaces` entri tabel yang ditunjuk kodenya.
+    """
+
+    def __init__(self, codebooks):
+        # (n_subspaces, n_centroids, subspace_dim)
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+
+    @classmethod
+    def train(cls, vectors, n_subspaces=16, n_centroids=256, iterations=15, sample_size=None, seed=0):
+        """Euclidean k-means per subspace on at most `sample_size` rows (default 64 per centroid)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        if dim % n_subspaces:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by {n_subspaces} subspaces")
+        if n_centroids > 256:
+            raise ValueError("Codes are stored as uint8, so at most 256 centroids per subspace")
+        rng = np.random.default_rng(seed)
+        if sample_size is None:
+            sample_size = 64 * n_centroids
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+        n_centroids = max(1, min(n_centroids, len(vectors)))
+
+        sub_vectors = vectors.reshape(len(vectors), n_subspaces, -1).transpose(1, 0, 2)
+        codebooks = np.empty((n_subspaces, n_centroids, sub_vectors.shape[2]), dtype=np.float32)
+        for s, points in enumerate(sub_vectors):
+            centroids = points[rng.choice(len(points), size=n_centroids, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = cls._nearest(points, centroids)
+                counts = np.bincount(assignments, minlength=n_centroids)
+                sums = np.stack([np.bincount(assignments, weights=points[:, j], minlength=n_centroids)
+                                 for j in range(points.shape[1])], axis=1)
+                empty = counts == 0
+                centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+                if empty.any():
+                    # Re-seed unused centroids with random points
+                    centroids[empty] = points[rng.choice(len(points), size=int(empty.sum()), replace=False)]
+            codebooks[s] = centroids
+        return cls(codebooks)
+
+    @staticmethod
+    def _nearest(points, centroids, chunk_size=16384):
+        assignments = np.empty(len(points), dtype=np.int64)
+        centroid_sq = np.sum(centroids ** 2, axis=1)
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            # |x - c|^2 without the |x|^2 term, which is the same for every centroid
+            assignments[start:start + chunk_size] = np.argmin(centroid_sq - 2.0 * chunk @ centroids.T, axis=1)
+        return assignments
+
+    @property
+    def n_subspaces(self):
+        return self.codebooks.shape[0]
+
+    @property
+    def dim(self):
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.n_subspaces, -1)
+        codes = np.empty((len(vectors), self.n_subspaces), dtype=np.uint8)
+        for s in range(self.n_subspaces):
+            codes[:, s] = self._nearest(vectors[:, s], self.codebooks[s])
+        return codes
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        return self.codebooks[np.arange(self.n_subspaces), codes].reshape(len(codes), -1)
+
+    def lookup_table(self, query):
+        """(n_subspaces, n_centroids) inner products of the query sub-vectors with every centroid"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.n_subspaces, -1)
+        return np.einsum("skd,sd->sk", self.codebooks, query)
+
+
+class PQVectors:
+    """Embedding rows as product-quantization codes, searched with ADC"""
+
+    storage = "pq"
+
+    def __init__(self, quantizer, codes):
+        self.quantizer = quantizer
+        self.codes = codes
+
+    @classmethod
+    def encode(cls, unit_vectors, quantizer=None, **train_params):
+        if quantizer is None:
+            quantizer = ProductQuantizer.train(unit_vectors, **train_params)
+        return cls(quantizer, quantizer.encode(unit_vectors))
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return (len(self.codes), self.quantizer.dim)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.quantizer.codebooks.nbytes
+
+    @property
+    def params(self):
+        return {"n_subspaces": self.quantizer.n_subspaces, "n_centroids": self.quantizer.codebooks.shape[1]}
+
+    def __getitem__(self, rows):
+        """Reconstructed float32 rows (their inner product with a query equals the ADC similarity)"""
+        return self.quantizer.decode(self.codes[rows])
+
+    def _adc(self, query):
+        table = self.quantizer.lookup_table(query)
+        sims = np.zeros(len(self.codes), dtype=np.float32)
+        # One gather per subspace with the uint8 codes as indexes (no index array is materialized)
+        for s, subspace_table in enumerate(table):
+            sims += np.take(subspace_table, self.codes[:, s])
+        return sims
+
+    def similarities(self, queries):
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            return self._adc(queries)
+        return np.vstack([self._adc(query) for query in queries]) if len(queries) else \
+            np.zeros((0, len(self.codes)), dtype=np.float32)
+
+    def take(self, rows):
+        return PQVectors(self.quantizer, self.codes[rows])
+
+    def append(self, unit_vectors):
+        # New rows reuse the trained codebooks; retraining happens on the next publish
+        return PQVectors(self.quantizer, np.vstack([self.codes, self.quantizer.encode(unit_vectors)]))
+
+    def arrays(self):
+        return {"codes": self.codes, "codebooks": self.quantizer.codebooks}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        return cls(ProductQuantizer(arrays["codebooks"]), arrays["codes"])
+
+
+_STORAGE_CLASSES = {cls.storage: cls for cls in (FloatVectors, HalfVectors, PQVectors)}
+
+
+def encode_vectors(unit_vectors, storage="float32", **params):
+    """Encode L2-normalized rows as `storage` ("float32", "float16" or "pq")"""
+    if storage not in _STORAGE_CLASSES:
+        raise ValueError(f"Unknown embedding storage '{storage}', expected one of {STORAGE_BACKENDS}")
+    return _STORAGE_CLASSES[storage].encode(unit_vectors, **params)
+
+
+def vectors_from_arrays(storage, arrays, params):
+    return _STORAGE_CLASSES[storage].from_arrays(arrays, params)
+
+
+def storage_report(embeddings, labels, user_data, k, storages, n_splits=5, max_queries=500, seed=42):
+    """
+    Bandingkan index float16 / PQ dengan index float32 pada embedding yang
+    sudah terdaftar.
+
+    Embedding tiap mahasiswa dibagi `n_splits` fold: index (dan codebook PQ)
+    dibangun dari fold lain, lalu (paling banyak `max_queries` embedding
+    dari) fold tersebut dicocokkan lewat match().
+    Untuk tiap storage dilaporkan ukuran embedding di memori, akurasi
+    identifikasi, recall@k tetangga terhadap float32, seberapa sering
+    keputusan match() (label + verifikasi) sama dengan float32, dan latency.
+    `storages` memetakan nama laporan ke (storage, params), misal
+    {"float16": ("float16", {}), "pq16": ("pq", {"n_subspaces": 16})}.
+    """
+    from embedding_index import EmbeddingIndex
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    labels = np.asarray(labels, dtype=str)
+    rng = np.random.default_rng(seed)
+    folds = np.empty(len(labels), dtype=np.int64)
+    for label in np.unique(labels):
+        rows = np.nonzero(labels == label)[0]
+        folds[rows] = rng.permutation(len(rows)) % n_splits
+
+    results = {name: {"bytes": [], "correct": 0, "recall": [], "agreed": 0, "ms": []}
+               for name in ["float32"] + list(storages)}
+    queries_total = 0
+    for fold in range(n_splits):
+        test = folds == fold
+        if not test.any() or test.all():
+            continue
+        exact = EmbeddingIndex.build(embeddings[~test], labels[~test], user_data, k)
+        indexes = [("float32", exact)] + [(name, exact.with_storage(storage, **params))
+                                          for name, (storage, params) in storages.items()]
+        queries = np.nonzero(test)[0]
+        if len(queries) > max_queries:
+            queries = np.sort(rng.choice(queries, size=max_queries, replace=False))
+        expected = [exact.match(query) for query in embeddings[queries]]
+        truth = [set(exact.search(query)[0].tolist()) for query in embeddings[queries]]
+        queries_total += len(queries)
+
+        for name, index in indexes:
+            result = results[name]
+            result["bytes"].append(index.vectors.nbytes / len(index))
+            for query, label, reference, neighbours in zip(embeddings[queries], labels[queries], expected, truth):
+                started = time.perf_counter()
+                match = index.match(query)
+                result["ms"].append((time.perf_counter() - started) * 1000)
+                result["correct"] += match.get("predicted_label") == label
+                result["agreed"] += (match.get("match") == reference.get("match")
+                                     and match.get("predicted_label") == reference.get("predicted_label"))
+                result["recall"].append(len(set(index.search(query)[0].tolist()) & neighbours) / max(len(neighbours), 1))
+
+    report = {"embeddings": len(embeddings), "classes": int(len(np.unique(labels))), "k": k,
+              "queries": queries_total, "storages": {}}
+    for name, result in results.items():
+        report["storages"][name] = {
+            # Includes the PQ codebooks, which dominate on small datasets
+            "bytes_per_embedding": float(np.mean(result["bytes"])) if result["bytes"] else None,
+            "identification_rate": result["correct"] / max(queries_total, 1),
+            "recall_at_k": float(np.mean(result["recall"])) if result["recall"] else None,
+            "decision_agreement": result["agreed"] / max(queries_total, 1),
+            "mean_ms": float(np.mean(result["ms"])) if result["ms"] else None,
+        }
+    return report
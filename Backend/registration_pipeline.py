@@ -0,0 +1,90 @@
+SKIPPED_MAX_REACHED = "skipped_max_reached"
+FACE_NOT_DETECTED = "face_not_detected"
+LANDMARKS_NOT_DETECTED = "landmarks_not_detected"
+
+
+class RegistrationPipeline:
+    """
+    Pipeline registrasi: decode + deteksi wajah berjalan paralel di
+    `executor`, sementara thread pemanggil meng-embed crop per batch dan
+    memanggil `accept` (misalnya untuk memulai upload async) sesuai urutan
+    input.
+
+    Deteksi hanya dijalankan untuk gambar yang masih mungkin dipakai:
+    jumlah gambar yang sudah diterima + menunggu embedding + sedang dideteksi
+    tidak pernah melebihi `max_images`, jadi pipeline berhenti tanpa
+    membuang kerja begitu batas gambar bagus tercapai. Gambar gagal membuka
+    slot untuk gambar berikutnya.
+    """
+
+    def __init__(self, detect, embed, executor, max_images=20, embed_batch_size=8, window=4):
+        # detect(item) -> face crop or None (may raise); embed(crops) -> features or None per crop
+        self.detect = detect
+        self.embed = embed
+        self.executor = executor
+        self.max_images = max_images
+        self.embed_batch_size = embed_batch_size
+        self.window = window
+
+    def run(self, items, accept):
+        """
+        Process `items` and return one outcome per item, in input order:
+        ("accepted", value returned by accept), (status, None) for faces that
+        were not usable, or ("error", exception).
+        accept(index, item, face_img, features) is called in input order.
+        """
+        outcomes = [(SKIPPED_MAX_REACHED, None)] * len(items)
+        futures = {}
+        pending = []  # (index, face_img) detected, waiting for embedding
+        accepted = 0
+        next_submit = 0
+        next_consume = 0
+
+        def flush():
+            nonlocal accepted
+            features = self.embed([face_img for _, face_img in pending])
+            for (i, face_img), embedding in zip(pending, features):
+                if embedding is None:
+                    outcomes[i] = (LANDMARKS_NOT_DETECTED, None)
+                    continue
+                try:
+                    outcomes[i] = ("accepted", accept(i, items[i], face_img, embedding))
+                    accepted += 1
+                except Exception as e:
+                    outcomes[i] = ("error", e)
+            pending.clear()
+
+        try:
+            while accepted < self.max_images:
+                # Keep the detection workers busy, but never detect more images than can still be used
+                while (next_submit < len(items) and len(futures) < self.window
+                       and accepted + len(pending) + len(futures) < self.max_images):
+                    futures[next_submit] = self.executor.submit(self.detect, items[next_submit])
+                    next_submit += 1
+
+                exhausted = next_consume >= len(items)
+                if pending and (exhausted
+                                or len(pending) >= self.embed_batch_size
+                                or accepted + len(pending) >= self.max_images
+                                # Embed now instead of idling until the next detection finishes
+                                or not futures[next_consume].done()):
+                    flush()
+                    continue
+                if exhausted:
+                    break
+
+                i = next_consume
+                next_consume += 1
+                try:
+                    face_img = futures.pop(i).result()
+                except Exception as e:
+                    outcomes[i] = ("error", e)
+                    continue
+                if face_img is None:
+                    outcomes[i] = (FACE_NOT_DETECTED, None)
+                else:
+                    pending.append((i, face_img))
+        finally:
+            for future in futures.values():
+                future.cancel()
+        return outcomes
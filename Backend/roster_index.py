@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+ROSTER_PREFIX = "rosters/"
+
+
+def parse_roster(value):
+    """
+    Roster from a request field: JSON list or comma/whitespace separated NIMs.
+    Raises ValueError for anything else (e.g. a truncated JSON list).
+    """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        nims = value
+    elif isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            try:
+                nims = json.loads(value)
+            except ValueError as e:
+                raise ValueError(f"Invalid roster: malformed JSON list ({e})") from e
+        else:
+            nims = value.replace(",", " ").split()
+    else:
+        raise ValueError("Invalid roster: expected a list or comma/whitespace separated NIMs")
+    return sorted({str(nim).strip() for nim in nims if str(nim).strip()})
+
+
+class RosterStore:
+    """
+    Daftar mahasiswa per mata kuliah, disimpan di `rosters/<course_id>.json`.
+    Roster di-cache per proses dan dicek ulang paling sering setiap
+    `refresh_interval` detik lewat generation blob-nya.
+    """
+
+    def __init__(self, blob_store, refresh_interval=30.0):
+        self.blob_store = blob_store
+        self.refresh_interval = refresh_interval
+        # course_id -> (generation, nims, checked_at)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _path(self, course_id):
+        if not course_id or "/" in course_id or course_id.startswith("."):
+            raise ValueError(f"Invalid course id '{course_id}'")
+        return f"{ROSTER_PREFIX}{course_id}.json"
+
+    def get(self, course_id):
+        """NIMs registered for the course, or None if the course has no roster"""
+        path = self._path(course_id)
+        cached = self._cache.get(course_id)
+        if cached is not None and time.monotonic() - cached[2] < self.refresh_interval:
+            return cached[1]
+
+        generation = self.blob_store.generation(path)
+        if generation is None:
+            nims = None
+        elif cached is not None and cached[0] == generation:
+            nims = cached[1]
+        else:
+            data = self.blob_store.get_many([path])[path]
+            nims = None if data is None else tuple(json.loads(data)["nims"])
+        with self._lock:
+            self._cache[course_id] = (generation, nims, time.monotonic())
+        return nims
+
+    def put(self, course_id, nims):
+        nims = parse_roster(list(nims))
+        roster = {"course_id": course_id, "nims": nims, "updated_at": datetime.now().isoformat()}
+        path = self._path(course_id)
+        self.blob_store.put_bytes(path, json.dumps(roster).encode("utf-8"), content_type="application/json")
+        with self._lock:
+            self._cache[course_id] = (self.blob_store.generation(path), tuple(nims), time.monotonic())
+        return nims
+
+
+class RosterIndexCache:
+    """
+    LRU cache berisi sub-index per roster (hanya mahasiswa yang diharapkan
+    hadir). Key memuat versi bundle dan delta yang sudah diterapkan, jadi
+    sub-index otomatis dibangun ulang setelah training atau enroll baru.
+    """
+
+    def __init__(self, max_entries=64, optimal_k=None):
+        self.max_entries = max_entries
+        self.optimal_k = optimal_k
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, bundle, nims):
+        """Sub-index of `bundle.index` for `nims`, or None if none of them are enrolled"""
+        key = (bundle.version, bundle.deltas, tuple(sorted(set(nims))))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        enrolled = len(set(nims) & set(str(c) for c in bundle.index.classes))
+        k = self.optimal_k(enrolled) if self.optimal_k and enrolled else None
+        index = bundle.index.subset(nims, k=k)
+        with self._lock:
+            self._entries[key] = index
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,155 @@
+"""
+Entry point produksi: face API dijalankan di beberapa proses worker
+gunicorn (satu per core secara default) supaya MTCNN dan FaceNet tidak
+antri di belakang satu GIL.
+
+- Aplikasi di-import sekali di master (preload) lalu di-fork, jadi kode
+  Python dan library yang sudah ter-load dibagi copy-on-write.
+- Index embedding di-memory-map dari CACHE_DIR; semua worker memetakan
+  file snapshot yang sama sehingga berbagi page cache yang sama.
+- Bobot model (MTCNN, FaceNet) TIDAK dibagi antar worker: tiap worker
+  me-load salinannya sendiri setelah fork karena runtime TF tidak fork-safe
+  (thread pool dan state sesi tidak ikut ter-fork). Perkiraan memori untuk
+  N worker: N x (bobot FaceNet ~90 MB float32, ~23 MB dengan backend ONNX
+  int8, + MTCNN beberapa MB + runtime TF/onnxruntime, biasanya beberapa
+  ratus MB RSS per worker). Ukur RSS per worker sebelum menaikkan --workers
+  di mesin dengan RAM terbatas.
+- Thread komputasi per worker (OpenMP/BLAS, TensorFlow, OpenCV) dibatasi
+  ke cores / workers supaya worker tidak saling berebut core.
+
+Status job training (/train-model), dedupe dan lease training disimpan di
+blob store (SharedJobState), jadi job bisa di-poll dan di-cancel dari worker
+mana pun dan hanya satu training yang berjalan di seluruh worker. Dengan
+LocalBlobStore pengecekan generation hanya atomic di dalam satu proses;
+pakai Firebase Storage untuk lebih dari satu worker.
+
+Registry /metrics ada per proses; tiap worker menulis sampelnya ke
+--metrics-dir setiap beberapa detik dan /metrics dari worker mana pun
+menjumlahkan counter/histogram semua worker (gauge diberi label worker).
+Nilai worker lain bisa tertinggal beberapa detik.
+
+Usage:
+    python serve.py [--bind 0.0.0.0:8000] [--workers N] [--threads 4]
+                    [--compute-threads T] [--timeout 120] [--metrics-dir DIR]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+# Environment variables read by the OpenMP/BLAS and TensorFlow thread pools
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "TF_NUM_INTRAOP_THREADS",
+    "TF_NUM_INTEROP_THREADS",
+)
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def limit_compute_threads(threads):
+    """
+    Cap the compute threads of this process. The environment variables only
+    take effect for libraries that have not started their thread pools yet,
+    so call this before the models are loaded.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+
+    import cv2
+
+    cv2.setNumThreads(threads)
+    try:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except ImportError:
+        pass
+    except RuntimeError as e:
+        # TensorFlow was already initialized in this process
+        print(f"[WARNING] Could not limit TensorFlow threads: {e}")
+
+
+def make_post_fork(compute_threads, metrics_dir):
+    def post_fork(server, worker):
+        limit_compute_threads(compute_threads)
+        import face_api
+
+        face_api.metrics_registry.share(metrics_dir)
+        face_api.warm_up()
+        print(f"[SERVE] Worker {worker.pid} ready")
+
+    return post_fork
+
+
+def build_options(args):
+    workers = args.workers or available_cores()
+    compute_threads = args.compute_threads or max(1, available_cores() // workers)
+    metrics_dir = args.metrics_dir or os.path.join(tempfile.gettempdir(), f"face_api_metrics_{os.getpid()}")
+    # Samples of a previous run would otherwise be summed into this one
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    return {
+        "bind": args.bind,
+        "workers": workers,
+        "worker_class": "gthread",
+        # Concurrent requests per worker; the recognition micro-batcher groups them
+        "threads": args.threads,
+        "timeout": args.timeout,
+        "preload_app": True,
+        "post_fork": make_post_fork(compute_threads, metrics_dir),
+    }, compute_threads
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the face API with a pool of worker processes")
+    parser.add_argument("--bind", default=os.environ.get("FACE_API_BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("FACE_API_WORKERS", "0")),
+                        help="Worker processes (default: one per available core)")
+    parser.add_argument("--threads", type=int, default=4, help="Request threads per worker")
+    parser.add_argument("--compute-threads", type=int, default=int(os.environ.get("FACE_API_COMPUTE_THREADS", "0")),
+                        help="TensorFlow/OpenCV/BLAS threads per worker (default: cores / workers)")
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="Seconds before a silent worker is restarted; covers model loading at boot")
+    parser.add_argument("--metrics-dir", default=os.environ.get("FACE_API_METRICS_DIR"),
+                        help="Directory where workers share /metrics samples (default: a fresh temp dir)")
+    args = parser.parse_args(argv)
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("[ERROR] serve.py needs gunicorn (pip install gunicorn); "
+              "use `python face_api.py` for the single-process development server")
+        return 1
+
+    options, compute_threads = build_options(args)
+    # Set before face_api (and numpy/OpenCV) are imported in the master so forked workers inherit it
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(compute_threads)
+
+    class FaceApiApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import face_api
+
+            return face_api.app
+
+    print(f"[SERVE] {options['workers']} workers x {options['threads']} request threads, "
+          f"{compute_threads} compute threads per worker, binding {options['bind']}")
+    FaceApiApplication().run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
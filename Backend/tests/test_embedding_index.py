@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import cosine
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.preprocessing import LabelEncoder
+
+from embedding_index import MIN_CONFIDENCE, VERIFY_THRESHOLD_RATIO, EmbeddingIndex
+
+DIM = 128
+
+
+def make_dataset(n_students=30, per_student=8, spread=0.35, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_students, DIM))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.normal(scale=spread / np.sqrt(DIM), size=(n_students, per_student, DIM))
+    embeddings = (centers[:, None, :] + noise).astype(np.float32)
+    labels = np.repeat([f"S{i:04d}" for i in range(n_students)], per_student)
+    # Thresholds around the typical query distance so verification both passes and fails
+    thresholds = rng.uniform(0.02, 0.2, size=n_students)
+    user_data = {
+        f"S{i:04d}": {"avg_embedding": embeddings[i].mean(axis=0), "threshold": thresholds[i]}
+        for i in range(n_students)
+    }
+    return embeddings.reshape(-1, DIM), labels, user_data
+
+
+def make_queries(embeddings, n=150, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(embeddings), size=n)
+    near = embeddings[rows] + rng.normal(scale=0.3 / np.sqrt(DIM), size=(n, DIM)).astype(np.float32)
+    strangers = rng.normal(size=(20, DIM)).astype(np.float32)
+    # Exact copies of stored rows exercise the zero-distance vote
+    return np.vstack([near, strangers, embeddings[rows[:5]]])
+
+
+def legacy_decision(knn, label_encoder, user_data, query):
+    """The sklearn KNN + scipy cosine verification the index replaced"""
+    proba = knn.predict_proba([query])[0]
+    pred = int(np.argmax(proba))
+    confidence = float(proba[pred])
+    label = label_encoder.inverse_transform([pred])[0]
+    data = user_data[label]
+    cosine_dist = float(cosine(query, data["avg_embedding"]))
+    verified = cosine_dist < data["threshold"] * VERIFY_THRESHOLD_RATIO and confidence > MIN_CONFIDENCE
+    return label, confidence, cosine_dist, verified
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    embeddings, labels, user_data = make_dataset()
+    label_encoder = LabelEncoder().fit(labels)
+    knn = KNeighborsClassifier(n_neighbors=5, weights="distance", metric="cosine")
+    knn.fit(embeddings, label_encoder.transform(labels))
+    return embeddings, labels, user_data, knn, label_encoder
+
+
+def assert_same_decisions(index, knn, label_encoder, user_data, queries):
+    verified = 0
+    for query in queries:
+        label, confidence, cosine_dist, expected = legacy_decision(knn, label_encoder, user_data, query)
+        result = index.match(query)
+        assert result["match"] == expected
+        assert result["predicted_label"] == (label if expected else None)
+        assert result["confidence"] == pytest.approx(confidence, abs=1e-4)
+        assert result["cosine_distance"] == pytest.approx(cosine_dist, abs=1e-4)
+        verified += expected
+    # Both outcomes must actually occur for the comparison to mean anything
+    assert 0 < verified < len(queries)
+
+
+def test_match_agrees_with_sklearn_knn(fitted):
+    embeddings, labels, user_data, knn, label_encoder = fitted
+    index = EmbeddingIndex.build(embeddings, labels, user_data, k=5)
+    assert_same_decisions(index, knn, label_encoder, user_data, make_queries(embeddings))
+
+
+def test_from_model_agrees_with_sklearn_knn(fitted):
+    embeddings, _, user_data, knn, label_encoder = fitted
+    index = EmbeddingIndex.from_model(knn, label_encoder, user_data)
+    assert_same_decisions(index, knn, label_encoder, user_data, make_queries(embeddings, seed=2))
+
+
+def test_serialized_index_keeps_decisions(fitted, tmp_path):
+    embeddings, labels, user_data, knn, label_encoder = fitted
+    data = EmbeddingIndex.build(embeddings, labels, user_data, k=5).to_bytes()
+    path = tmp_path / "index.pemb"
+    path.write_bytes(data)
+    queries = make_queries(embeddings, seed=3)
+    assert_same_decisions(EmbeddingIndex.from_bytes(data), knn, label_encoder, user_data, queries)
+    assert_same_decisions(EmbeddingIndex.open(str(path)), knn, label_encoder, user_data, queries)
+
+
+def test_hnsw_deltas_skip_dropped_rows_and_find_new_ones(fitted):
+    pytest.importorskip("hnswlib")
+    embeddings, labels, user_data, _, _ = fitted
+    index = EmbeddingIndex.build(embeddings, labels, user_data, k=5).with_ann("hnsw", ef=64)
+    graph = index.searcher._graph
+
+    rng = np.random.default_rng(4)
+    center = rng.normal(size=DIM)
+    center /= np.linalg.norm(center)
+    new_rows = (center + rng.normal(scale=0.35 / np.sqrt(DIM), size=(8, DIM))).astype(np.float32)
+    # Re-enroll an existing student far away from their old embeddings
+    updated = index.with_class("S0000", new_rows, new_rows.mean(axis=0), 0.2)
+    assert updated.searcher._graph is graph
+
+    result = updated.match(new_rows[0])
+    assert result["match"] and result["predicted_label"] == "S0000"
+
+    exact = updated.with_searcher(None)
+    for query in (embeddings[0], embeddings[1], new_rows[3]):
+        rows, _, _ = updated.search(query, 5)
+        assert set(rows.tolist()) == set(exact.search(query, 5)[0].tolist())
+
+
+def test_hnsw_with_params_leaves_shared_graph_alone(fitted):
+    pytest.importorskip("hnswlib")
+    embeddings, labels, user_data, _, _ = fitted
+    searcher = EmbeddingIndex.build(embeddings, labels, user_data, k=5).with_ann("hnsw", ef=32).searcher
+
+    wider = searcher.with_params(ef=128)
+    assert searcher._graph.ef == 32
+    assert wider._graph is not searcher._graph and wider._graph.ef == 128
+    assert searcher.with_params(ef=32)._graph is searcher._graph
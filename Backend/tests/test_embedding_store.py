@@ -0,0 +1,94 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from embedding_store import (
+    PACKED_ALIGNMENT, PACKED_MAGIC, EmbeddingStore, open_packed, pack_arrays, unpack_arrays,
+)
+
+
+def sample_arrays():
+    rng = np.random.default_rng(0)
+    return {
+        "labels": np.array(["A001", "B0000002", "C3"], dtype="<U32"),
+        "offsets": np.array([0, 2, 5, 6], dtype=np.int64),
+        "embeddings": rng.normal(size=(6, 128)).astype(np.float32),
+        "half": rng.normal(size=(6, 128)).astype(np.float16),
+        "codes": rng.integers(0, 256, size=(6, 16)).astype(np.uint8),
+        "thresholds": rng.uniform(size=3),
+        "empty": np.zeros((0, 128), dtype=np.float32),
+    }
+
+
+def assert_arrays_equal(actual, expected):
+    assert set(actual) == set(expected)
+    for name, array in expected.items():
+        assert actual[name].dtype == array.dtype, name
+        assert actual[name].shape == array.shape, name
+        np.testing.assert_array_equal(np.asarray(actual[name]), array)
+
+
+def test_pack_unpack_round_trip():
+    arrays = sample_arrays()
+    arrays_out, meta = unpack_arrays(pack_arrays(arrays, meta={"version": 7, "note": "x"}))
+    assert meta == {"version": 7, "note": "x"}
+    assert_arrays_equal(arrays_out, arrays)
+
+
+def test_memory_mapped_round_trip(tmp_path):
+    arrays = sample_arrays()
+    path = tmp_path / "store.pemb"
+    path.write_bytes(pack_arrays(arrays, meta={"version": 3}))
+    arrays_out, meta = open_packed(str(path))
+    assert meta == {"version": 3}
+    assert_arrays_equal(arrays_out, arrays)
+    assert isinstance(arrays_out["embeddings"], np.memmap)
+
+
+def test_arrays_are_aligned_for_mmap():
+    data = pack_arrays(sample_arrays())
+    header_len = struct.unpack("<IQ", data[4:16])[1]
+    header = json.loads(data[16:16 + header_len])
+    data_start = -(-(16 + header_len) // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+    for entry in header["arrays"].values():
+        assert (data_start + entry["offset"]) % PACKED_ALIGNMENT == 0
+
+
+def test_rejects_foreign_and_future_files():
+    data = pack_arrays(sample_arrays())
+    with pytest.raises(ValueError, match="Not a packed"):
+        unpack_arrays(b"NOPE" + data[4:])
+    future = PACKED_MAGIC + struct.pack("<I", 99) + data[8:]
+    with pytest.raises(ValueError, match="Unsupported packed format version"):
+        unpack_arrays(future)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_embedding_store_round_trip(tmp_path, dtype):
+    rng = np.random.default_rng(1)
+    users = {
+        nim: (rng.normal(size=(n, 128)), rng.normal(size=128), rng.uniform())
+        for nim, n in (("2101", 3), ("2102", 1), ("2103", 5))
+    }
+    store = EmbeddingStore.from_users(users, version=4).astype(dtype)
+    path = tmp_path / "store.pemb"
+    path.write_bytes(store.to_bytes())
+
+    for loaded in (EmbeddingStore.from_bytes(store.to_bytes()), EmbeddingStore.open(str(path))):
+        assert loaded.version == 4
+        assert list(loaded.users()) == ["2101", "2102", "2103"]
+        assert loaded.embeddings.dtype == np.dtype(dtype)
+        np.testing.assert_array_equal(loaded.offsets, store.offsets)
+        np.testing.assert_array_equal(loaded.embeddings, store.embeddings)
+        np.testing.assert_array_equal(loaded.centroids, store.centroids)
+        np.testing.assert_array_equal(loaded.thresholds, store.thresholds)
+        embeddings, avg_embedding, threshold = loaded.get("2103")
+        np.testing.assert_array_equal(embeddings, np.asarray(users["2103"][0], dtype=dtype))
+        assert threshold == pytest.approx(users["2103"][2])
+
+
+def test_empty_store_round_trip():
+    loaded = EmbeddingStore.from_bytes(EmbeddingStore.empty().to_bytes())
+    assert len(loaded) == 0
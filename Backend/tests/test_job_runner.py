@@ -0,0 +1,178 @@
+import threading
+import time
+
+import pytest
+
+from blob_store import LocalBlobStore
+from job_runner import (
+    JOB_CANCELLED, JOB_FAILED, JOB_QUEUED, JOB_SUCCEEDED, JobRunner, SharedJobState,
+)
+
+POLL = 0.02
+
+
+class FlakyBlobStore(LocalBlobStore):
+    """Local store whose cancel-marker lookups can be made to time out"""
+
+    fail_exists = False
+
+    def exists(self, path):
+        if self.fail_exists:
+            raise TimeoutError("bucket timeout")
+        return super().exists(path)
+
+
+@pytest.fixture
+def blob_store(tmp_path):
+    return FlakyBlobStore(str(tmp_path / "bucket"), retries=1, retry_backoff=0.001)
+
+
+def shared(blob_store, **kwargs):
+    return SharedJobState(blob_store, poll_interval=POLL, **kwargs)
+
+
+def two_workers(blob_store):
+    """Two runners sharing one blob store, like two serve.py worker processes"""
+    return JobRunner(name="worker-a", shared=shared(blob_store)), JobRunner(name="worker-b", shared=shared(blob_store))
+
+
+def steps(n=10, delay=0.01, log=None):
+    def run(job):
+        if log is not None:
+            log.append(("start", job.id))
+        for i in range(n):
+            time.sleep(delay)
+            job.report(i / n, f"step {i}")
+        if log is not None:
+            log.append(("end", job.id))
+        return {"job": job.id}
+    return run
+
+
+def test_first_claim_wins_until_released(blob_store):
+    state = shared(blob_store)
+    assert state.claim_queued("train", "a") == "a"
+    assert state.claim_queued("train", "b") == "a"
+    # Only the holder can release
+    state.release_queued("train", "b")
+    assert state.claim_queued("train", "b") == "a"
+    state.release_queued("train", "a")
+    assert state.claim_queued("train", "b") == "b"
+
+
+def test_refresh_only_by_the_holder(blob_store):
+    state = shared(blob_store)
+    state.claim_queued("train", "a")
+    assert state.refresh_queued("train", "a")
+    assert not state.refresh_queued("train", "b")
+    assert not state.refresh_queued("other", "a")
+
+
+def test_abandoned_queued_slot_expires_after_queue_ttl(blob_store):
+    state = shared(blob_store, queue_ttl=0.1, lease_ttl=60)
+    state.claim_queued("train", "dead-worker-job")
+    assert state.claim_queued("train", "b") == "dead-worker-job"
+    time.sleep(0.15)
+    assert state.claim_queued("train", "b") == "b"
+
+
+def test_refreshed_queued_slot_does_not_expire(blob_store):
+    state = shared(blob_store, queue_ttl=0.1)
+    state.claim_queued("train", "a")
+    for _ in range(4):
+        time.sleep(0.05)
+        assert state.refresh_queued("train", "a")
+    assert state.claim_queued("train", "b") == "a"
+
+
+def test_job_is_visible_from_every_worker(blob_store):
+    a, b = two_workers(blob_store)
+    job, deduplicated = a.submit("train", steps(), "train_model")
+    assert not deduplicated
+    assert job.wait(5)
+
+    snapshot = b.get(job.id)
+    assert snapshot.status == JOB_SUCCEEDED
+    assert snapshot.result == {"job": job.id}
+    assert job.id in [listed.id for listed in b.list()]
+    assert b.get("missing") is None
+
+
+def test_dedupe_and_single_run_across_workers(blob_store):
+    a, b = two_workers(blob_store)
+    log = []
+    first, _ = a.submit("train", steps(log=log), "train_model")
+    while first.status == JOB_QUEUED:
+        time.sleep(POLL)
+
+    # While `first` runs, one follow-up job is queued and every later submit joins it
+    second, deduplicated = b.submit("train", steps(log=log), "train_model")
+    assert not deduplicated
+    third, deduplicated = a.submit("train", steps(log=log), "train_model")
+    assert deduplicated and third.id == second.id
+
+    assert third.wait(10) and first.wait(10)
+    assert third.status == JOB_SUCCEEDED
+    assert [event for event, _ in log] == ["start", "end", "start", "end"]
+    assert blob_store.list("jobs/queued/") == []
+
+
+def test_cancel_from_another_worker(blob_store):
+    a, b = two_workers(blob_store)
+    job, _ = a.submit("train", steps(n=200), "train_model")
+    while job.status == JOB_QUEUED:
+        time.sleep(POLL)
+
+    assert b.cancel(job.id).status == "cancelling"
+    assert job.wait(5)
+    assert job.status == JOB_CANCELLED
+    assert b.get(job.id).status == JOB_CANCELLED
+
+
+def test_cancel_while_waiting_for_another_workers_lease(blob_store):
+    a, b = two_workers(blob_store)
+    running, _ = a.submit("train", steps(n=200), "train_model")
+    while running.status == JOB_QUEUED:
+        time.sleep(POLL)
+    waiting, _ = b.submit("train", steps(), "train_model")
+
+    a.cancel(waiting.id)
+    assert waiting.wait(5)
+    assert waiting.status == JOB_CANCELLED
+    a.cancel(running.id)
+    assert running.wait(5)
+
+
+def test_lease_error_fails_the_job_instead_of_leaving_it_queued(blob_store):
+    runner = JobRunner(name="worker", shared=shared(blob_store))
+    blob_store.fail_exists = True
+    job, _ = runner.submit("train", steps(), "train_model")
+
+    assert job.wait(5), "waiters must not hang when the lease phase fails"
+    assert job.status == JOB_FAILED
+    assert job.error_type == "TimeoutError"
+    assert blob_store.list("jobs/queued/") == []
+
+    # The failed job must not swallow the next submit
+    blob_store.fail_exists = False
+    retry, deduplicated = runner.submit("train", steps(), "train_model")
+    assert not deduplicated and retry.id != job.id
+    assert retry.wait(5) and retry.status == JOB_SUCCEEDED
+    assert runner.get(job.id).status == JOB_FAILED
+
+
+def test_runner_without_shared_state_is_process_local():
+    runner = JobRunner(name="local")
+    release = threading.Event()
+
+    def blocked(job):
+        release.wait(5)
+        return 1
+
+    first, _ = runner.submit("train", blocked, "train_model")
+    second, _ = runner.submit("train", blocked, "train_model")
+    third, deduplicated = runner.submit("train", blocked, "train_model")
+    assert deduplicated and third is second
+    release.set()
+    assert first.wait(5) and second.wait(5)
+    assert runner.get("missing") is None
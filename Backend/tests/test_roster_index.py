@@ -0,0 +1,22 @@
+import pytest
+
+from roster_index import parse_roster
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, []),
+    ("", []),
+    ('["2101", 2102, " 2103 "]', ["2101", "2102", "2103"]),
+    ("2102, 2101 2103\n2101", ["2101", "2102", "2103"]),
+    (["2102", 2101, ""], ["2101", "2102"]),
+    (("2101",), ["2101"]),
+    ("  []  ", []),
+])
+def test_parse_roster(value, expected):
+    assert parse_roster(value) == expected
+
+
+@pytest.mark.parametrize("value", ["[123,", '["2101"', "[2101]]", 2101, {"nims": ["2101"]}])
+def test_parse_roster_rejects_malformed_values(value):
+    with pytest.raises(ValueError, match="Invalid roster"):
+        parse_roster(value)
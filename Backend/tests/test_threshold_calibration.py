@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import cosine
+
+from threshold_calibration import intra_class_distance_stats
+
+
+def naive_stats(embeddings, offsets):
+    """Per-pair loop the vectorized version replaced"""
+    means, stds = [], []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        distances = [cosine(embeddings[i], embeddings[j]) for i in range(start, end) for j in range(i + 1, end)]
+        means.append(np.mean(distances) if distances else np.nan)
+        stds.append(np.std(distances) if distances else np.nan)
+    return np.array(means), np.array(stds)
+
+
+@pytest.fixture(scope="module")
+def ragged_classes():
+    rng = np.random.default_rng(0)
+    sizes = [1, 2, 5, 20, 33, 0, 7, 20]
+    embeddings = rng.normal(size=(sum(sizes), 128)).astype(np.float32)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    return embeddings, offsets
+
+
+# From one chunk for everything down to one class per chunk
+@pytest.mark.parametrize("max_chunk_elements", [4_000_000, 5000, 1])
+def test_matches_naive_loop(ragged_classes, max_chunk_elements):
+    embeddings, offsets = ragged_classes
+    means, stds, counts = intra_class_distance_stats(embeddings, offsets, max_chunk_elements=max_chunk_elements)
+    expected_means, expected_stds = naive_stats(embeddings, offsets)
+    np.testing.assert_allclose(means, expected_means, atol=1e-6)
+    np.testing.assert_allclose(stds, expected_stds, atol=1e-6)
+    np.testing.assert_array_equal(counts, np.diff(offsets))
+
+
+def test_classes_without_pairs_get_nan(ragged_classes):
+    embeddings, offsets = ragged_classes
+    means, stds, _ = intra_class_distance_stats(embeddings, offsets)
+    no_pairs = np.diff(offsets) < 2
+    assert np.isnan(means[no_pairs]).all() and np.isnan(stds[no_pairs]).all()
+    assert not np.isnan(means[~no_pairs]).any()
+
+
+def test_max_samples_caps_rows_per_class(ragged_classes):
+    embeddings, offsets = ragged_classes
+    _, _, counts = intra_class_distance_stats(embeddings, offsets, max_samples=6)
+    np.testing.assert_array_equal(counts, np.minimum(np.diff(offsets), 6))
@@ -0,0 +1,144 @@
+import numpy as np
+
+CALIBRATION_STRATEGIES = ("mean_std", "target_far")
+
+
+def _normalize(vectors, dtype=np.float64):
+    vectors = np.asarray(vectors, dtype=dtype)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _class_rows(offsets, max_samples, rng):
+    """Row indices per class, randomly subsampled to at most `max_samples`"""
+    rows = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        idx = np.arange(start, end)
+        if max_samples is not None and len(idx) > max_samples:
+            idx = np.sort(rng.choice(idx, size=max_samples, replace=False))
+        rows.append(idx)
+    return rows
+
+
+def intra_class_distance_stats(embeddings, offsets, max_samples=None, max_chunk_elements=4_000_000, seed=42):
+    """
+    Mean and (population) std of pairwise cosine distances within every class.
+
+    Classes are padded to a common size and processed in chunks as one batched
+    Gram-matrix product, so there is no Python loop over pairs. A chunk holds
+    at most about `max_chunk_elements` values in its largest array.
+    Returns (means, stds, counts); classes with fewer than 2 rows get NaN.
+    """
+    # float32 like the stored embeddings; only the distance sums use float64
+    embeddings = _normalize(embeddings, dtype=np.float32)
+    offsets = np.asarray(offsets)
+    rng = np.random.default_rng(seed)
+    rows = _class_rows(offsets, max_samples, rng)
+
+    n_classes = len(rows)
+    means = np.full(n_classes, np.nan)
+    stds = np.full(n_classes, np.nan)
+    counts = np.array([len(r) for r in rows])
+    # Bound both the (classes, rows, d) batch and the (classes, rows, rows) distance tensor of one chunk
+    max_width = int(counts.max(initial=0))
+    chunk_size = max(1, max_chunk_elements // max(max_width * max_width, max_width * embeddings.shape[1], 1))
+
+    for start in range(0, n_classes, chunk_size):
+        chunk = rows[start:start + chunk_size]
+        width = max((len(r) for r in chunk), default=0)
+        if width < 2:
+            continue
+
+        batch = np.zeros((len(chunk), width, embeddings.shape[1]), dtype=np.float32)
+        valid = np.zeros((len(chunk), width), dtype=bool)
+        for i, idx in enumerate(chunk):
+            batch[i, :len(idx)] = embeddings[idx]
+            valid[i, :len(idx)] = True
+
+        distances = 1.0 - np.einsum("cmd,cnd->cmn", batch, batch).astype(np.float64)
+        upper = np.triu(np.ones((width, width), dtype=bool), k=1)
+        pair_mask = valid[:, :, None] & valid[:, None, :] & upper[None]
+
+        n_pairs = pair_mask.sum(axis=(1, 2))
+        total = np.where(pair_mask, distances, 0.0).sum(axis=(1, 2))
+        total_sq = np.where(pair_mask, distances ** 2, 0.0).sum(axis=(1, 2))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / n_pairs
+            var = np.maximum(total_sq / n_pairs - mean ** 2, 0.0)
+        has_pairs = n_pairs > 0
+        means[start:start + len(chunk)] = np.where(has_pairs, mean, np.nan)
+        stds[start:start + len(chunk)] = np.where(has_pairs, np.sqrt(var), np.nan)
+
+    return means, stds, counts
+
+
+def impostor_centroid_distances(embeddings, offsets, centroids, samples_per_class=1000, seed=42):
+    """
+    Cosine distance from each class centroid to randomly sampled embeddings of
+    other classes (impostors). Returns an array of shape (C, samples_per_class).
+    """
+    embeddings = _normalize(embeddings)
+    centroids = _normalize(centroids)
+    offsets = np.asarray(offsets)
+    labels = np.repeat(np.arange(len(centroids)), np.diff(offsets))
+    rng = np.random.default_rng(seed)
+
+    n_classes = len(centroids)
+    if n_classes < 2:
+        return np.zeros((n_classes, 0))
+
+    # Sample rows uniformly from everything, then redraw those that hit the class itself
+    samples = rng.integers(0, len(embeddings), size=(n_classes, samples_per_class))
+    own = labels[samples] == np.arange(n_classes)[:, None]
+    while own.any():
+        samples[own] = rng.integers(0, len(embeddings), size=int(own.sum()))
+        own = labels[samples] == np.arange(n_classes)[:, None]
+
+    return 1.0 - np.einsum("cd,ckd->ck", centroids, embeddings[samples])
+
+
+def mean_std_thresholds(means, stds, std_multiplier=1.5, floor=None, default=None):
+    """Current rule: mean + 1.5 * std of intra-class distances, never below `floor`"""
+    thresholds = means + std_multiplier * stds
+    if default is not None:
+        thresholds = np.where(np.isnan(thresholds), default, thresholds)
+    if floor is not None:
+        thresholds = np.maximum(thresholds, floor)
+    return thresholds
+
+
+def target_far_thresholds(impostor_distances, target_far=0.001, verify_ratio=1.0):
+    """
+    Threshold per class such that only `target_far` of impostors fall inside
+    the verification radius (cosine_distance < threshold * verify_ratio).
+    """
+    if impostor_distances.shape[1] == 0:
+        return np.full(len(impostor_distances), np.nan)
+    return np.quantile(impostor_distances, target_far, axis=1) / verify_ratio
+
+
+def calibrate_thresholds(embeddings, offsets, centroids, strategy="mean_std", std_multiplier=1.5,
+                         floor=None, default=None, target_far=0.001, verify_ratio=1.0,
+                         max_samples_per_class=None, impostor_samples=1000, seed=42):
+    """
+    Hitung threshold semua mahasiswa sekaligus.
+    Returns (thresholds, stats) where stats holds the per-class distance statistics.
+    """
+    if strategy not in CALIBRATION_STRATEGIES:
+        raise ValueError(f"Unknown calibration strategy '{strategy}', expected one of {CALIBRATION_STRATEGIES}")
+
+    means, stds, counts = intra_class_distance_stats(embeddings, offsets, max_samples_per_class, seed=seed)
+    stats = {"intra_mean": means, "intra_std": stds, "count": counts}
+
+    if strategy == "mean_std":
+        thresholds = mean_std_thresholds(means, stds, std_multiplier, floor=floor, default=default)
+    else:
+        impostors = impostor_centroid_distances(embeddings, offsets, centroids, impostor_samples, seed=seed)
+        thresholds = target_far_thresholds(impostors, target_far, verify_ratio)
+        if default is not None:
+            thresholds = np.where(np.isnan(thresholds), default, thresholds)
+        if floor is not None:
+            thresholds = np.maximum(thresholds, floor)
+        stats["impostor_mean"] = impostors.mean(axis=1) if impostors.size else np.full(len(thresholds), np.nan)
+
+    return thresholds, stats
@@ -0,0 +1,312 @@
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from face_detection import FaceBox, to_rgb
+
+# Landmarks from the MediaPipe face mesh used for the head pose estimate
+NOSE_TIP = 1
+LEFT_EYE_OUTER = 33
+RIGHT_EYE_OUTER = 263
+FOREHEAD = 10
+CHIN = 152
+
+QUALITY_SIZE = (112, 112)  # Crops are resized to this before scoring sharpness
+THUMBNAIL_SIZE = (16, 16)  # Appearance descriptor used when no pose is available
+
+# frame_index: position in the stream; crop: raw RGB crop with margin (not normalized);
+# pose: (yaw, pitch) or None
+FrameCandidate = namedtuple("FrameCandidate", ["frame_index", "box", "crop", "sharpness", "pose", "descriptor"])
+
+
+def iter_video_frames(data, sample_fps=10, max_frames=300):
+    """
+    Decode an uploaded video clip, yielding (frame_index, RGB frame) for
+    roughly `sample_fps` frames per second, at most `max_frames` frames.
+    """
+    # VideoCapture needs a path, so spool the upload to a temp file
+    fd, path = tempfile.mkstemp(suffix=".video")
+    capture = None
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError("Could not decode video")
+        fps = capture.get(cv2.CAP_PROP_FPS) or sample_fps
+        step = max(1, int(round(fps / sample_fps)))
+
+        index = 0
+        yielded = 0
+        while yielded < max_frames:
+            ok = capture.grab()
+            if not ok:
+                break
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                yielded += 1
+            index += 1
+    finally:
+        # Also runs when the caller closes the generator early or decoding raises
+        if capture is not None:
+            capture.release()
+        os.remove(path)
+
+
+def sharpness_score(crop_rgb):
+    """Variance of the Laplacian on a fixed-size grayscale crop (higher = sharper)"""
+    gray = cv2.cvtColor(cv2.resize(crop_rgb, QUALITY_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def appearance_descriptor(crop_rgb):
+    gray = cv2.cvtColor(cv2.resize(crop_rgb, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+    gray = gray.astype(np.float32).ravel()
+    gray -= gray.mean()
+    return gray / max(float(np.linalg.norm(gray)), 1e-6)
+
+
+class PoseEstimator:
+    """
+    Perkiraan yaw/pitch kasar dari landmark MediaPipe face mesh.
+    yaw: -1 (menoleh ke kiri) .. 1 (ke kanan), pitch: -1 (menunduk) .. 1 (mendongak), 0 = frontal.
+    """
+
+    def __init__(self, face_mesh):
+        # `face_mesh` is a LazyResource around a static-image FaceMesh, which is not
+        # thread-safe; share one estimator per FaceMesh so this lock serializes it
+        self.face_mesh = face_mesh
+        self._lock = threading.Lock()
+
+    def estimate(self, crop_rgb):
+        with self._lock:
+            results = self.face_mesh.get().process(np.ascontiguousarray(crop_rgb))
+        if not results.multi_face_landmarks:
+            return None
+        landmarks = results.multi_face_landmarks[0].landmark
+
+        nose = landmarks[NOSE_TIP]
+        left, right = landmarks[LEFT_EYE_OUTER], landmarks[RIGHT_EYE_OUTER]
+        top, bottom = landmarks[FOREHEAD], landmarks[CHIN]
+
+        to_left = abs(nose.x - left.x)
+        to_right = abs(right.x - nose.x)
+        to_top = abs(nose.y - top.y)
+        to_bottom = abs(bottom.y - nose.y)
+        yaw = (to_left - to_right) / max(to_left + to_right, 1e-6)
+        pitch = (to_bottom - to_top) / max(to_top + to_bottom, 1e-6)
+        return float(yaw), float(pitch)
+
+
+class FaceTracker:
+    """
+    Ikuti satu wajah di sepanjang frame tanpa deteksi ulang di setiap frame.
+
+    Frame di antara keyframe dilacak dengan template matching pada gambar
+    grayscale yang diperkecil di sekitar posisi terakhir. Setiap
+    `redetect_every` frame, atau saat skor template turun, detector
+    dijalankan ulang hanya di area sekitar wajah; deteksi full frame hanya
+    dipakai saat wajah benar-benar hilang.
+    """
+
+    def __init__(self, pipeline, redetect_every=10, min_match_score=0.6, search_scale=2.0, track_max_side=320):
+        self.pipeline = pipeline
+        self.redetect_every = redetect_every
+        self.min_match_score = min_match_score
+        self.search_scale = search_scale
+        self.track_max_side = track_max_side
+        self.box = None
+        self._template = None
+        self._since_detection = 0
+        self.detections = 0
+        self.roi_detections = 0
+        self.tracked_frames = 0
+
+    def _small_gray(self, frame_rgb):
+        height, width = frame_rgb.shape[:2]
+        scale = min(1.0, self.track_max_side / max(height, width))
+        small = cv2.resize(frame_rgb, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA) if scale < 1.0 else frame_rgb
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY), scale
+
+    def _search_region(self, box, shape, scale_factor):
+        x, y, w, h = box
+        pad_w, pad_h = int(w * (scale_factor - 1) / 2), int(h * (scale_factor - 1) / 2)
+        x0, y0 = max(0, x - pad_w), max(0, y - pad_h)
+        x1, y1 = min(shape[1], x + w + pad_w), min(shape[0], y + h + pad_h)
+        return x0, y0, x1, y1
+
+    def _detect(self, frame_rgb):
+        if self.box is not None:
+            x0, y0, x1, y1 = self._search_region(self.box, frame_rgb.shape, self.search_scale)
+            faces = self.pipeline.detect(frame_rgb[y0:y1, x0:x1])
+            if faces:
+                self.roi_detections += 1
+                face = faces[0]
+                bx, by, bw, bh = face.box
+                return FaceBox((bx + x0, by + y0, bw, bh), face.confidence)
+
+        self.detections += 1
+        faces = self.pipeline.detect(frame_rgb)
+        return faces[0] if faces else None
+
+    def _track(self, gray, scale):
+        x, y, w, h = (int(v * scale) for v in self.box)
+        x0, y0, x1, y1 = self._search_region((x, y, w, h), gray.shape, self.search_scale)
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < self._template.shape[0] or window.shape[1] < self._template.shape[1]:
+            return None
+        scores = cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (mx, my) = cv2.minMaxLoc(scores)
+        if best < self.min_match_score:
+            return None
+        return FaceBox((int((x0 + mx) / scale), int((y0 + my) / scale), self.box[2], self.box[3]), float(best))
+
+    def update(self, frame_rgb):
+        """Return the face FaceBox in this frame (full-resolution pixels), or None if lost"""
+        gray, scale = self._small_gray(frame_rgb)
+
+        face = None
+        if self._template is not None and self._since_detection < self.redetect_every:
+            face = self._track(gray, scale)
+            if face is not None:
+                self.tracked_frames += 1
+                self._since_detection += 1
+
+        if face is None:
+            face = self._detect(frame_rgb)
+            self._since_detection = 0
+            if face is None:
+                self.box = None
+                self._template = None
+                return None
+            x, y, w, h = (int(v * scale) for v in face.box)
+            x, y = max(0, x), max(0, y)
+            self._template = gray[y:y + max(h, 1), x:x + max(w, 1)].copy()
+            if self._template.size == 0:
+                self._template = None
+
+        self.box = tuple(int(v) for v in face.box)
+        return face
+
+    def stats(self):
+        return {
+            "full_detections": self.detections,
+            "roi_detections": self.roi_detections,
+            "tracked_frames": self.tracked_frames,
+        }
+
+
+class FrameSelector:
+    """
+    Kumpulkan kandidat frame dari tracker, lalu pilih frame yang tajam dan
+    beragam (pose berbeda) untuk di-embed.
+    """
+
+    def __init__(self, pipeline, pose_estimator=None, min_face_size=60, min_sharpness=20.0,
+                 relative_sharpness=0.5, max_candidates=120, max_abs_yaw=0.6, max_abs_pitch=0.6,
+                 tracker_options=None):
+        self.pipeline = pipeline
+        self.pose_estimator = pose_estimator
+        self.min_face_size = min_face_size
+        self.min_sharpness = min_sharpness
+        self.relative_sharpness = relative_sharpness
+        self.max_candidates = max_candidates
+        self.max_abs_yaw = max_abs_yaw
+        self.max_abs_pitch = max_abs_pitch
+        self.tracker = FaceTracker(pipeline, **(tracker_options or {}))
+        self.candidates = []
+        self.frames_seen = 0
+        self.rejected = {"no_face": 0, "too_small": 0, "blurry": 0, "extreme_pose": 0}
+
+    def add_frame(self, frame_index, frame):
+        self.frames_seen += 1
+        frame = to_rgb(frame)
+        face = self.tracker.update(frame)
+        if face is None:
+            self.rejected["no_face"] += 1
+            return
+        if min(face.box[2], face.box[3]) < self.min_face_size:
+            self.rejected["too_small"] += 1
+            return
+
+        crop = np.ascontiguousarray(self.pipeline.crop(frame, face.box))
+        if crop.size == 0:
+            self.rejected["no_face"] += 1
+            return
+        sharpness = sharpness_score(crop)
+        if sharpness < self.min_sharpness:
+            self.rejected["blurry"] += 1
+            return
+
+        self.candidates.append(FrameCandidate(frame_index, face.box, crop, sharpness, None,
+                                              appearance_descriptor(crop)))
+        if len(self.candidates) > self.max_candidates:
+            # Keep memory bounded: drop the blurriest candidate
+            self.candidates.pop(int(np.argmin([c.sharpness for c in self.candidates])))
+
+    def _with_poses(self, candidates):
+        if self.pose_estimator is None:
+            return candidates
+        scored = []
+        for candidate in candidates:
+            try:
+                pose = self.pose_estimator.estimate(candidate.crop)
+            except Exception as e:
+                print(f"[WARNING] Pose estimation unavailable: {e}")
+                self.pose_estimator = None
+                return candidates
+            if pose is not None and (abs(pose[0]) > self.max_abs_yaw or abs(pose[1]) > self.max_abs_pitch):
+                self.rejected["extreme_pose"] += 1
+                continue
+            scored.append(candidate._replace(pose=pose))
+        return scored
+
+    def select(self, max_frames=20, diversity_weight=0.5):
+        """
+        Greedy pick: start from the sharpest frame, then repeatedly take the
+        frame with the best mix of sharpness and distance (pose, or appearance
+        when no pose is known) to the frames already picked.
+        """
+        candidates = self._with_poses(self.candidates)
+        if not candidates:
+            return []
+        # Motion-blurred frames look "different" too; drop them before rewarding diversity
+        cutoff = self.relative_sharpness * float(np.median([c.sharpness for c in candidates]))
+        sharp_enough = [c for c in candidates if c.sharpness >= cutoff]
+        self.rejected["blurry"] += len(candidates) - len(sharp_enough)
+        candidates = sharp_enough
+
+        sharpness = np.array([c.sharpness for c in candidates])
+        quality = sharpness / sharpness.max()
+        if all(c.pose is not None for c in candidates):
+            features = np.array([c.pose for c in candidates])
+        else:
+            features = np.array([c.descriptor for c in candidates])
+
+        selected = [int(np.argmax(quality))]
+        min_dist = np.linalg.norm(features - features[selected[0]], axis=1)
+        while len(selected) < min(max_frames, len(candidates)):
+            spread = min_dist / max(float(min_dist.max()), 1e-12)
+            score = (1 - diversity_weight) * quality + diversity_weight * spread
+            score[selected] = -np.inf
+            best = int(np.argmax(score))
+            selected.append(best)
+            min_dist = np.minimum(min_dist, np.linalg.norm(features - features[best], axis=1))
+
+        return sorted((candidates[i] for i in selected), key=lambda c: c.frame_index)
+
+    def stats(self):
+        return {
+            "frames_seen": self.frames_seen,
+            "candidates": len(self.candidates),
+            "rejected": dict(self.rejected),
+            "tracker": self.tracker.stats(),
+        }